@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+# Copyright: 2020, Diez B. Roggisch, Berlin . All rights reserved.
+"""
+Compares feeding a trace sample by sample with feeding
+it as blocks.
+"""
+import argparse
+import timeit
+
+import numpy as np
+
+import filters
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--samples", type=int, default=100000)
+    parser.add_argument("--block-size", type=int, default=4096)
+    parser.add_argument("--size", type=int, default=32, help="FIR size")
+    parser.add_argument("--gain", type=float, default=0.01, help="IIR gain")
+    parser.add_argument("--repeat", type=int, default=3)
+    opts = parser.parse_args()
+
+    trace = np.random.RandomState(0).uniform(0, 100, opts.samples)
+    values = trace.tolist()
+    blocks = [
+        trace[i:i + opts.block_size]
+        for i in range(0, len(trace), opts.block_size)
+    ]
+
+    def single(f):
+        feed = f.feed
+        for v in values:
+            feed(v)
+
+    def blocked(f):
+        for block in blocks:
+            f.feed_block(block)
+
+    print("{} samples, blocks of {}, scipy {}".format(
+        opts.samples,
+        opts.block_size,
+        "available" if filters.lfilter is not None else "missing",
+    ))
+    for name, factory in [
+            ("IIRFilter", lambda: filters.IIRFilter(opts.gain)),
+            ("FIRFilter", lambda: filters.FIRFilter(opts.size)),
+    ]:
+        for mode, run in [("feed", single), ("feed_block", blocked)]:
+            best = min(timeit.repeat(
+                lambda: run(factory()), number=1, repeat=opts.repeat,
+            ))
+            print("{:10} {:11} {:8.1f}ns/sample".format(
+                name, mode, best / opts.samples * 1e9,
+            ))
+
+
+if __name__ == '__main__':
+    main()
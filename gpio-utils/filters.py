@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+# Copyright: 2020, Diez B. Roggisch, Berlin . All rights reserved.
+import math
+
+try:
+    import numpy as np
+except ImportError:
+    # only needed for the filter banks and block processing
+    np = None
+
+try:
+    from scipy.signal import lfilter
+except ImportError:
+    lfilter = None
+
+
+def _as_block(values):
+    if np is None:
+        raise RuntimeError("block processing needs numpy")
+    return np.asarray(values, dtype=float)
+
+
+class IIRFilter:
+    """
+    A first order low pass, computing
+
+      value = gain * input + (1 - gain) * value
+    """
+
+    def __init__(self, gain, start=0.0):
+        self._gain = gain
+        self._decay = 1.0 - gain
+        self.value = start
+
+    def feed(self, value):
+        self.value = self._gain * value + self._decay * self.value
+        return self.value
+
+    def feed_block(self, values):
+        """
+        Feeds all values, and returns the array of
+        outputs - the same as feeding one by one, down
+        to the last bit. Uses scipy if available.
+        """
+        values = _as_block(values)
+        if not len(values):
+            return values
+        if lfilter is not None:
+            output, _ = lfilter(
+                [self._gain],
+                [1.0, -self._decay],
+                values,
+                zi=[self._decay * self.value],
+            )
+        else:
+            # the recursion can't be vectorized without changing
+            # the rounding, so this is about as fast as feed
+            gain, decay, y = self._gain, self._decay, self.value
+            output = []
+            append = output.append
+            for x in values.tolist():
+                y = gain * x + decay * y
+                append(y)
+            output = np.array(output)
+        self.value = float(output[-1])
+        return output
+
+
+class FIRFilter:
+    """
+    The mean of the last size values.
+
+    It keeps a running sum, so feeding is O(1) regardless
+    of the size. To not accumulate rounding errors over
+    millions of values, the sum is re-computed exactly
+    every resum values (defaulting to size).
+    """
+
+    def __init__(self, size, resum=None):
+        self._ring = [0.0] * size
+        self._index = 0
+        self._count = 0
+        self._sum = 0.0
+        self._resum = size if resum is None else resum
+        self._until_resum = self._resum
+
+    def feed(self, value):
+        ring = self._ring
+        if self._count == len(ring):
+            self._sum -= ring[self._index]
+        else:
+            self._count += 1
+        ring[self._index] = value
+        self._sum += value
+        self._index = (self._index + 1) % len(ring)
+
+        self._until_resum -= 1
+        if not self._until_resum:
+            # the slots not yet filled are zero
+            self._sum = math.fsum(ring)
+            self._until_resum = self._resum
+        return self.value
+
+    @property
+    def value(self):
+        return self._sum / self._count
+
+    def feed_block(self, values):
+        """
+        Feeds all values, and returns the array of
+        outputs - the same as feeding one by one, down
+        to the last bit: the running sums are cumsums
+        over the same subtractions and additions, one
+        row per stretch between re-summings.
+        """
+        values = _as_block(values)
+        n = len(values)
+        if not n:
+            return values.copy()
+        size, resum = len(self._ring), self._resum
+        # the last size values before and all of the block,
+        # oldest first. Slots not yet filled are zero, and
+        # subtracting them is the same as not subtracting
+        history = np.concatenate([
+            self._ring[self._index:] + self._ring[:self._index],
+            values,
+        ])
+        # re-summing after these values, and as fsum doesn't
+        # depend on the order, over the window of history
+        ends = np.arange(self._until_resum - 1, n, resum)
+        resums = np.array(
+            [math.fsum(history[end + 1:end + 1 + size]) for end in ends]
+        )
+
+        # pad the first row so all are resum long, -0.0
+        # leaves any sum unchanged
+        offset = resum - self._until_resum
+        rows = -(-(offset + n) // resum)
+        flat = np.full(rows * 2 * resum, -0.0)
+        flat[2 * offset:2 * (offset + n):2] = -history[:n]
+        flat[2 * offset + 1:2 * (offset + n):2] = values
+        steps = np.empty((rows, 2 * resum + 1))
+        steps[0, 0] = self._sum
+        steps[1:, 0] = resums[:rows - 1]
+        steps[:, 1:] = flat.reshape(rows, 2 * resum)
+        sums = np.cumsum(steps, axis=1)[:, 2::2].reshape(-1)[offset:offset + n]
+        sums[ends] = resums
+
+        counts = np.minimum(self._count + np.arange(1, n + 1), size)
+        self._index = (self._index + n) % size
+        self._ring = np.roll(history[-size:], self._index).tolist()
+        self._count = int(counts[-1])
+        self._sum = float(sums[-1])
+        self._until_resum = resum - (offset + n) % resum
+        return sums / counts
+
+
+class WeightedFIRFilter:
+    """
+    A FIR filter with arbitrary taps, taps[0] being the
+    weight of the newest value. Before len(taps) values
+    have been fed, the missing ones count as start.
+    """
+
+    def __init__(self, taps, start=0.0):
+        self._taps = [float(tap) for tap in taps]
+        size = len(self._taps)
+        # each value is stored twice, so the last
+        # size values are always contiguous
+        self._ring = [float(start)] * (2 * size)
+        self._index = 0
+        self.value = start
+
+    def feed(self, value):
+        size = len(self._taps)
+        self._index = (self._index - 1) % size
+        self._ring[self._index] = self._ring[self._index + size] = value
+        window = self._ring[self._index:self._index + size]
+        self.value = math.fsum(tap * v for tap, v in zip(self._taps, window))
+        return self.value
+
+
+class FilterBank:
+    """
+    Runs a filter on many channels at once: feed takes
+    a NumPy array with one value per channel, and returns
+    the array of the filter values - which is updated in
+    place by the next feed. Subclasses implement feed.
+    """
+
+    def __init__(self, channels):
+        if np is None:
+            raise RuntimeError("filter banks need numpy")
+        self.channels = channels
+
+
+class IIRFilterBank(FilterBank):
+    """
+    An IIRFilter per channel. The gain is either one for
+    all channels, or an array with one per channel.
+    """
+
+    def __init__(self, channels, gain, start=0.0):
+        super().__init__(channels)
+        self._gain = np.asarray(gain, dtype=float)
+        self._decay = 1.0 - self._gain
+        self.value = np.full(channels, start, dtype=float)
+        self._scratch = np.empty(channels)
+
+    def feed(self, values):
+        np.multiply(values, self._gain, out=self._scratch)
+        self.value *= self._decay
+        self.value += self._scratch
+        return self.value
+
+
+class FIRFilterBank(FilterBank):
+    """
+    A FIRFilter per channel, all of the same size,
+    with running sums re-computed every resum values.
+    """
+
+    def __init__(self, channels, size, resum=None):
+        super().__init__(channels)
+        self._ring = np.zeros((size, channels))
+        self._index = 0
+        self._count = 0
+        self._sum = np.zeros(channels)
+        self._resum = size if resum is None else resum
+        self._until_resum = self._resum
+        self.value = np.zeros(channels)
+
+    def feed(self, values):
+        ring = self._ring
+        row = ring[self._index]
+        if self._count == len(ring):
+            self._sum -= row
+        else:
+            self._count += 1
+        row[:] = values
+        self._sum += row
+        self._index = (self._index + 1) % len(ring)
+
+        self._until_resum -= 1
+        if not self._until_resum:
+            self._sum = np.sum(ring, axis=0)
+            self._until_resum = self._resum
+        np.divide(self._sum, self._count, out=self.value)
+        return self.value
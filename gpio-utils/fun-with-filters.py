@@ -1,31 +1,6 @@
 # -*- coding: utf-8 -*-
 # Copyright: 2020, Diez B. Roggisch, Berlin . All rights reserved.
-from collections import deque
-
-
-class IIRFilter:
-
-    def __init__(self, gain, start=0.0):
-        self._gain = gain
-        self.value = start
-
-    def feed(self, value):
-        self.value += (value - self.value) * self._gain
-        return self.value
-
-
-class FIRFilter:
-
-    def __init__(self, size):
-        self._q = deque(maxlen=size)
-
-    def feed(self, value):
-        self._q.append(value)
-        return self.value
-
-    @property
-    def value(self):
-        return sum(self._q) / len(self._q)
+from filters import IIRFilter, FIRFilter
 
 
 def main():
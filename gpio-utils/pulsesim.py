@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+# Copyright: 2021, Diez B. Roggisch, Berlin . All rights reserved.
+"""
+Simulated pulse sources, to test pulse counting
+way beyond the rates of real hardware.
+
+The timestamps of the pulses are computed upfront in
+batches - from a rate profile, with jitter and dropouts
+drawn from a seeded random generator, so the same
+parameters always give the same pulses. FakeGPIO then
+delivers them to the callbacks, either in (scaled) real
+time, or as fast as possible. Its clock tells the
+simulated time, which counters must use instead of
+time.monotonic.
+"""
+import time
+import threading
+
+import numpy as np
+
+
+class Constant:
+    """
+    rate pulses per second.
+    """
+
+    def __init__(self, rate):
+        self.rate = rate
+
+    def times(self, pulses):
+        """
+        The time of each of the given pulse numbers
+        (counted from zero, which is at time zero).
+        """
+        return pulses / self.rate
+
+
+class Ramp:
+    """
+    The rate changes linearly from start to end over
+    duration seconds, and stays at end afterwards. With
+    an end of zero, the shaft stands still after the
+    ramp - the pulses following it are at infinity.
+    """
+
+    def __init__(self, start, end, duration):
+        self.start = start
+        self.end = end
+        self.duration = duration
+        self._acceleration = (end - start) / duration
+        self._ramp_pulses = (start + end) / 2 * duration
+
+    def times(self, pulses):
+        pulses = np.asarray(pulses, dtype=float)
+        # solving start * t + acceleration / 2 * t ** 2 = pulses,
+        # written so it also works without acceleration
+        with np.errstate(invalid="ignore"):
+            ramp = 2 * pulses / (
+                self.start
+                # rounding might make it negative at the very
+                # end of a ramp to standstill
+                + np.sqrt(np.maximum(
+                    self.start ** 2 + 2 * self._acceleration * pulses, 0.0
+                ))
+            )
+        ramp[pulses == 0] = 0.0
+        if not self.end:
+            return np.where(pulses <= self._ramp_pulses, ramp, np.inf)
+        after = self.duration + (pulses - self._ramp_pulses) / self.end
+        return np.where(pulses < self._ramp_pulses, ramp, after)
+
+
+class PulseSource:
+    """
+    The pulses of a profile.
+
+    Each pulse is moved by up to jitter periods, drawn
+    from a uniform distribution - or for "normal", with
+    a standard deviation of jitter periods. It's never
+    moved more than half a period, so pulses don't swap.
+
+    Each pulse is dropped with a probability of dropout.
+    """
+
+    def __init__(self, profile, jitter=0.0, distribution="uniform",
+                 dropout=0.0, seed=0):
+        if distribution not in ("uniform", "normal"):
+            raise ValueError("unknown distribution {!r}".format(distribution))
+        self._profile = profile
+        self._jitter = jitter
+        self._distribution = distribution
+        self._dropout = dropout
+        self._seed = seed
+
+    def batches(self, batch_size=4096, duration=None):
+        """
+        Yields arrays of timestamps, in seconds since the
+        start, up to duration - or forever if None, unless
+        the profile comes to a standstill. No batch is
+        empty.
+        """
+        jitter_seed, dropout_seed = np.random.SeedSequence(self._seed).spawn(2)
+        jitter_rng = np.random.default_rng(jitter_seed)
+        dropout_rng = np.random.default_rng(dropout_seed)
+        first = 0
+        last = 0.0
+        while True:
+            # with the pulses before and after, the first
+            # pulse of all being its own predecessor
+            pulses = np.maximum(np.arange(first - 1, first + batch_size + 1), 0)
+            first += batch_size
+            times = self._profile.times(pulses)
+            # infinity minus infinity after a standstill
+            with np.errstate(invalid="ignore"):
+                periods = np.diff(times)
+            times = times[1:-1]
+            # the pulses after a standstill never come
+            stopped = np.searchsorted(times, np.inf)
+            if stopped < batch_size:
+                times = times[:stopped]
+                periods = periods[:stopped + 1]
+            if self._jitter and len(times):
+                if self._distribution == "uniform":
+                    offsets = jitter_rng.uniform(-self._jitter, self._jitter, len(times))
+                else:
+                    offsets = jitter_rng.normal(0.0, self._jitter, len(times))
+                offsets = np.clip(offsets, -0.5, 0.5)
+                before, after = periods[:-1], periods[1:]
+                # the last pulse before a standstill has no
+                # period after it
+                after = np.where(np.isfinite(after), after, before)
+                # moving back by parts of the period before, and
+                # forth by the one after, so neighbours meet at
+                # most half way - but might swap by rounding
+                times = times + offsets * np.where(offsets < 0, before, after)
+                times = np.maximum.accumulate(np.concatenate([[last], times]))[1:]
+                last = times[-1]
+            if self._dropout:
+                times = times[dropout_rng.random(len(times)) >= self._dropout]
+            if duration is not None and len(times) and times[-1] >= duration:
+                times = times[times < duration]
+                if len(times):
+                    yield times
+                return
+            if len(times):
+                yield times
+            if stopped < batch_size:
+                return
+
+
+class FakeGPIO:
+    """
+    Stands in for RPi.GPIO, and delivers the pulses of
+    the sources (a dict of channel to PulseSource) to the
+    callbacks registered for their channels.
+
+    With a speed, a simulated second takes 1 / speed real
+    seconds. If the callbacks can't keep up, the pulses
+    are delivered late, but their timestamps aren't
+    affected. Without, everything is delivered as fast as
+    possible.
+
+    Each run continues where the last stopped.
+    """
+
+    BCM = 11
+    IN = 1
+    RISING = 31
+    FALLING = 32
+    BOTH = 33
+
+    def __init__(self, sources, speed=1.0, batch_size=4096):
+        self._sources = sources
+        self._speed = speed
+        self._batch_size = batch_size
+        self._callbacks = {}
+        self._start = time.monotonic()
+        self._real_start = None
+        self._now = self._start
+        # set while the callbacks of a batch are called
+        self._delivering = False
+        self._batches = None
+        self._leftover = None
+        # the simulated seconds delivered
+        self._elapsed = 0.0
+        self.delivered = 0
+
+    def setmode(self, mode):
+        pass
+
+    def setwarnings(self, warnings):
+        pass
+
+    def setup(self, channel, direction):
+        pass
+
+    def cleanup(self):
+        pass
+
+    def add_event_detect(self, channel, event, callback, bouncetime=0):
+        if channel not in self._sources:
+            raise ValueError("no pulse source for channel {}".format(channel))
+        self._callbacks[channel] = callback
+
+    def clock(self):
+        """
+        The simulated time: while delivering a pulse its
+        timestamp, and between pulses the scaled real time
+        - or the last pulse at full speed.
+        """
+        if self._delivering or not self._speed or self._real_start is None:
+            return self._now
+        return self._start + (time.monotonic() - self._real_start) * self._speed
+
+    def _merged(self):
+        """
+        Yields batches of timestamps and their channels
+        from all sources, in order, until all of them
+        stopped.
+        """
+        sources = {
+            channel: source.batches(self._batch_size)
+            for channel, source in self._sources.items()
+        }
+        pending = {channel: np.empty(0) for channel in sources}
+        while True:
+            for channel, timestamps in list(pending.items()):
+                if not len(timestamps):
+                    try:
+                        pending[channel] = next(sources[channel])
+                    except StopIteration:
+                        del pending[channel]
+            if not pending:
+                return
+            # each source might have pulses after the
+            # end of its batch
+            horizon = min(timestamps[-1] for timestamps in pending.values())
+            times, channels = [], []
+            for channel, timestamps in pending.items():
+                count = np.searchsorted(timestamps, horizon, side="right")
+                times.append(timestamps[:count])
+                channels.append(np.full(count, channel))
+                pending[channel] = timestamps[count:]
+            times = np.concatenate(times)
+            order = np.argsort(times, kind="stable")
+            yield times[order], np.concatenate(channels)[order]
+
+    def run(self, duration=None):
+        """
+        Delivers the pulses of the next duration simulated
+        seconds, or forever.
+        """
+        if self._batches is None:
+            self._batches = self._merged()
+        start = self._elapsed
+        end = np.inf if duration is None else start + duration
+        self._real_start = time.monotonic() - start / self._speed if self._speed else None
+        while True:
+            if self._leftover is None:
+                self._leftover = next(self._batches, None)
+                if self._leftover is None:
+                    # all sources stopped
+                    break
+            times, channels = self._leftover
+            count = np.searchsorted(times, end)
+            self._deliver(times[:count], channels[:count])
+            if count < len(times):
+                self._leftover = times[count:], channels[count:]
+                break
+            self._leftover = None
+        self._elapsed = end
+
+    def _deliver(self, times, channels):
+        noop = lambda channel: None
+        timestamps = (self._start + times).tolist()
+        channels = channels.tolist()
+        if self._speed:
+            due = self._real_start + times / self._speed
+        start = 0
+        while start < len(timestamps):
+            end = len(timestamps)
+            if self._speed:
+                now = time.monotonic()
+                if due[start] > now:
+                    time.sleep(due[start] - now)
+                    now = due[start]
+                end = np.searchsorted(due, now, side="right")
+            self._delivering = True
+            try:
+                for timestamp, channel in zip(timestamps[start:end], channels[start:end]):
+                    self._now = timestamp
+                    self._callbacks.get(channel, noop)(channel)
+            finally:
+                self._delivering = False
+            self.delivered += end - start
+            start = end
+
+    def start(self, duration=None):
+        thread = threading.Thread(target=self.run, args=(duration,), daemon=True)
+        thread.start()
+        return thread
@@ -1,80 +1,366 @@
 # Copyright: 2021, Diez B. Roggisch, Berlin . All rights reserved.
 
 import time
-import queue
-import random
-# just for testing purposes
 import threading
+from array import array
+from collections import namedtuple
 
+import numpy as np
 
-PULSES_PER_REVOLUTION = 20
-
-
-class FakeGPIO:
+from filters import IIRFilter
+# just for testing purposes
+from pulsesim import FakeGPIO, PulseSource, Constant
 
-    RISING = 1
-    FALLING = 2
 
-    def __init__(self, channel, period, variance=.1):
-        self._channel = channel
-        self._period = period
-        self._variance = period * variance
-        self._callback = lambda channel: None
-        threading.Thread(target=self._run, daemon=True).start()
+PULSES_PER_REVOLUTION = 20
 
-    def add_event_detect(self, channel, event, callback, bouncetime=0):
-        assert self._channel == channel
-        assert event == self.RISING
-        self._callback = callback
 
-    def _run(self):
-        when = time.monotonic()
-        while True:
-            self._callback(self._channel)
-            when += self._period + random.random() * 2 * self._variance - self._variance
-            time.sleep(when - time.monotonic())
+# 1 RPS for 20 PPR, 20% variance
+GPIO = FakeGPIO({20: PulseSource(Constant(PULSES_PER_REVOLUTION), jitter=0.2)})
 
 
-GPIO = FakeGPIO(20, 1 / PULSES_PER_REVOLUTION, variance=0.2)  # 1 RPM for 20 PPR, 20% variance
+class RPMCounter:
+    """
+    The GPIO callback only appends the timestamp of a
+    pulse to a preallocated ring, which is lock free as
+    long as there is just one writer - the callback
+    thread. Reading rps processes all pulses since the
+    last read at once.
 
+    If more than capacity pulses arrive between two
+    reads, the oldest are lost, which is counted in
+    overruns. So are the pulses a burst overwrote while
+    they were being read.
 
-class RPMCounter:
+    The timestamps come from clock, time.monotonic if
+    None.
+    """
 
-    def __init__(self, channel, pulses_per_revolution, filter=0.1):
+    def __init__(self, channel, pulses_per_revolution, filter=0.1, capacity=4096,
+                 clock=None):
         self._pulses_per_revolution = pulses_per_revolution
-        self._events = queue.Queue()
-        self._filter = filter
+        self._clock = time.monotonic if clock is None else clock
+        self._capacity = capacity
+        self._timestamps = array('d', bytes(8 * capacity))
+        # only ever incremented by _rise_event
+        self._written = 0
+        self._read = 0
+        self._filter = IIRFilter(filter)
+        self.overruns = 0
         GPIO.add_event_detect(
             channel,
             GPIO.RISING,
             callback=self._rise_event,
             bouncetime=200
         )
-        self._rpm = 0.0
         self._last_timestamp = None
 
     def _rise_event(self, _channel):
-        self._events.put(time.monotonic())
+        self._timestamps[self._written % self._capacity] = self._clock()
+        self._written += 1
+
+    def _pending(self):
+        written = self._written
+        # leave some slack, the callback might be
+        # writing into the oldest slot right now
+        oldest = written - self._capacity + 1
+        if self._read < oldest:
+            self.overruns += oldest - self._read
+            self._read = oldest
+            # the pulse before the first we have is lost
+            self._last_timestamp = None
+        first = self._read
+        timestamps = self._copy(first, written)
+        self._read = written
+        # a burst while copying might have lapped the
+        # oldest pulses, which then aren't trustworthy
+        lapped = min(self._written - self._capacity + 1 - first, len(timestamps))
+        if lapped > 0:
+            self.overruns += lapped
+            self._last_timestamp = None
+            timestamps = timestamps[lapped:]
+        return timestamps
 
+    def _copy(self, first, end):
+        """
+        The timestamps of the pulses from first up to end.
+        """
+        ring = np.frombuffer(self._timestamps)
+        start, end = first % self._capacity, end % self._capacity
+        if start <= end:
+            return ring[start:end].copy()
+        return np.concatenate([ring[start:], ring[:end]])
+
+    def process(self):
+        """
+        Feeds the pulses since the last call into the
+        filter, and returns those which follow a known
+        one: their timestamps, and periods.
+
+        Periods of zero - from a coarse clock - aren't fed
+        into the filter.
+        """
+        timestamps = self._pending()
+        if self._last_timestamp is not None:
+            timestamps = np.concatenate([[self._last_timestamp], timestamps])
+        if len(timestamps):
+            self._last_timestamp = timestamps[-1]
+        periods = np.diff(timestamps)
+        valid = periods[periods > 0.0]
+        if len(valid):
+            self._filter.feed_block(1.0 / valid / self._pulses_per_revolution)
+        return timestamps[1:], periods
+
+    @property
+    def last_pulse(self):
+        """
+        The timestamp of the last processed pulse, None
+        before the first or after a reset.
+        """
+        return self._last_timestamp
+
+    @property
+    def value(self):
+        """
+        The filtered rps as of the last process, without
+        processing new pulses.
+        """
+        return self._filter.value
+
+    def reset(self):
+        """
+        Forgets the rate, e.g. after the shaft stalled. The
+        next pulse is the first again.
+        """
+        self._last_timestamp = None
+        self._filter.value = 0.0
 
     @property
     def rps(self):
-        for _ in range(self._events.qsize()):
-            ts = self._events.get()
-            if self._last_timestamp is not None:
-                diff = ts - self._last_timestamp
-                residual = (1 / diff) / self._pulses_per_revolution - self._rpm
-                self._rpm += self._filter * residual
-            self._last_timestamp = ts
-        return self._rpm
+        self.process()
+        return self._filter.value
 
     @property
     def rpm(self):
         return self.rps * 60.0
 
 
+RPMStatistics = namedtuple("RPMStatistics", "mean min max jitter pulses")
+RPMReading = namedtuple("RPMReading", "rpm stalled statistics")
+
+
+class _History:
+    """
+    The timestamps and periods of the pulses within the
+    longest window, in preallocated arrays. New pulses are
+    written behind the live ones, which are only moved to
+    the front - or into larger arrays - once the end is
+    reached. So a sample costs the new pulses, not the
+    window.
+    """
+
+    def __init__(self, capacity=1024):
+        self._timestamps = np.empty(capacity)
+        self._periods = np.empty(capacity)
+        self._start = 0
+        self._end = 0
+
+    def append(self, timestamps, periods):
+        count = len(timestamps)
+        if self._end + count > len(self._timestamps):
+            self._make_room(count)
+        end = self._end + count
+        self._timestamps[self._end:end] = timestamps
+        self._periods[self._end:end] = periods
+        self._end = end
+
+    def _make_room(self, count):
+        live = self._end - self._start
+        capacity = len(self._timestamps)
+        # at least half of it free afterwards, so moving
+        # is rare compared to appending
+        if 2 * (live + count) > capacity:
+            capacity = 2 * (live + count)
+        timestamps, periods = self._timestamps, self._periods
+        if capacity != len(timestamps):
+            self._timestamps = np.empty(capacity)
+            self._periods = np.empty(capacity)
+        self._timestamps[:live] = timestamps[self._start:self._end]
+        self._periods[:live] = periods[self._start:self._end]
+        self._start, self._end = 0, live
+
+    def expire(self, before):
+        """
+        Forgets the pulses before the given time.
+        """
+        self._start += np.searchsorted(
+            self._timestamps[self._start:self._end], before
+        )
+
+    def periods(self, since):
+        """
+        The periods of the pulses from since on - a view,
+        valid until the next append.
+        """
+        timestamps = self._timestamps[self._start:self._end]
+        return self._periods[self._start + np.searchsorted(timestamps, since):self._end]
+
+
+class _Channel:
+
+    def __init__(self, counter, pulses_per_revolution):
+        self.counter = counter
+        self._pulses_per_revolution = pulses_per_revolution
+        self._history = _History()
+        self._last_pulse = None
+        self._stalled = False
+
+    def sample(self, now, windows, stall_periods):
+        timestamps, periods = self.counter.process()
+        if len(timestamps):
+            self._history.append(timestamps, periods)
+        if self.counter.last_pulse is not None:
+            self._last_pulse = self.counter.last_pulse
+        self._history.expire(now - max(windows))
+
+        rps = self.counter.value
+        stalled = rps <= 0.0 or (
+            now - self._last_pulse
+            > stall_periods / (rps * self._pulses_per_revolution)
+        )
+        if stalled and not self._stalled:
+            self.counter.reset()
+        self._stalled = stalled
+        return RPMReading(
+            0.0 if stalled else float(rps * 60.0),
+            stalled,
+            {window: self.statistics(now - window) for window in windows},
+        )
+
+    def statistics(self, since):
+        periods = self._history.periods(since)
+        if not len(periods):
+            return RPMStatistics(0.0, 0.0, 0.0, 0.0, 0)
+        # the mean is revolutions over time, not the mean of
+        # the rpm of each pulse
+        per_minute = 60.0 / self._pulses_per_revolution
+        total = periods.sum()
+        # pulses with the same timestamp have no rate
+        valid = periods[periods > 0.0]
+        return RPMStatistics(
+            mean=float(per_minute * len(periods) / total) if total else 0.0,
+            min=float(per_minute / valid.max()) if len(valid) else 0.0,
+            max=float(per_minute / valid.min()) if len(valid) else 0.0,
+            jitter=float(periods.std()),
+            pulses=len(periods),
+        )
+
+
+class RPMMonitor:
+    """
+    Watches many channels, each with an RPMCounter, and
+    processes their pulses every interval seconds in a
+    background thread.
+
+    Reading the results just returns what the last
+    sample computed: the filtered rpm, whether the shaft
+    stalled - no pulse in stall_periods of the last
+    period - and for each of the windows (in seconds)
+    RPMStatistics over the pulses in it. The mean is
+    in RPM, as are min and max - those of the single
+    periods - and jitter is the standard deviation of
+    the periods in seconds.
+
+    Time is taken from clock, time.monotonic if None.
+    """
+
+    def __init__(self, interval=0.1, windows=(1.0, 10.0), stall_periods=5,
+                 filter=0.1, capacity=4096, clock=None):
+        self._clock = time.monotonic if clock is None else clock
+        self._interval = interval
+        self._windows = tuple(windows)
+        self._stall_periods = stall_periods
+        self._filter = filter
+        self._capacity = capacity
+        self._channels = {}
+        self._readings = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add_channel(self, channel, pulses_per_revolution):
+        state = _Channel(
+            RPMCounter(
+                channel,
+                pulses_per_revolution,
+                filter=self._filter,
+                capacity=self._capacity,
+                clock=self._clock,
+            ),
+            pulses_per_revolution,
+        )
+        # stalled until the first sample, and the thread
+        # doesn't know the channel yet
+        readings = dict(self._readings)
+        readings[channel] = RPMReading(
+            0.0,
+            True,
+            {window: RPMStatistics(0.0, 0.0, 0.0, 0.0, 0) for window in self._windows},
+        )
+        self._readings = readings
+        self._channels[channel] = state
+
+    @property
+    def channels(self):
+        return list(self._channels)
+
+    def sample(self, now=None):
+        """
+        Processes all channels, called by the thread.
+        """
+        now = self._clock() if now is None else now
+        self._readings = {
+            channel: state.sample(now, self._windows, self._stall_periods)
+            for channel, state in list(self._channels.items())
+        }
+
+    def _run(self):
+        when = time.monotonic()
+        while not self._stop.wait(max(0.0, when - time.monotonic())):
+            self.sample()
+            when = max(when + self._interval, time.monotonic())
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def reading(self, channel):
+        return self._readings[channel]
+
+    def rpm(self, channel):
+        return self._readings[channel].rpm
+
+    def stalled(self, channel):
+        return self._readings[channel].stalled
+
+    def statistics(self, channel, window=None):
+        """
+        The statistics over the given window, which must be
+        one of the monitored - or the first if None.
+        """
+        window = self._windows[0] if window is None else window
+        return self._readings[channel].statistics[window]
+
+
 def main():
-    rpm_counter = RPMCounter(20, PULSES_PER_REVOLUTION)
+    rpm_counter = RPMCounter(20, PULSES_PER_REVOLUTION, clock=GPIO.clock)
+    GPIO.start()
     while True:
         print(rpm_counter.rpm)
         time.sleep(1)
@@ -1,8 +1,10 @@
 from __future__ import print_function
 import time
 import argparse
-import Queue
-import RPi.GPIO as GPIO
+try:
+    import queue
+except ImportError:
+    import Queue as queue
 import bisect
 
 DESCRIPTION = """A simple tool to count events on a GPIO
@@ -30,43 +32,88 @@ def main():
         default=None,
         help="If given, only count those pulses in the last SECONDS. Otherwise, count total"
     )
+    parser.add_argument(
+        "--simulate",
+        type=float,
+        default=None,
+        help="Don't use the GPIOs, but simulate SIMULATE pulses per second (Python 3 only)"
+    )
+    parser.add_argument(
+        "--jitter",
+        type=float,
+        default=0.0,
+        help="Simulated pulses are moved by up to JITTER periods"
+    )
+    parser.add_argument(
+        "--dropout",
+        type=float,
+        default=0.0,
+        help="The probability of a simulated pulse getting lost"
+    )
+    parser.add_argument(
+        "--speed",
+        type=float,
+        default=1.0,
+        help="Speed up the simulation, 0 for as fast as possible"
+    )
+    parser.add_argument(
+        "--duration",
+        type=float,
+        default=None,
+        help="Stop the simulation after DURATION simulated seconds"
+    )
 
     opts = parser.parse_args()
     pin = opts.pin
+    simulation = None
+    if opts.simulate is None:
+        import RPi.GPIO as GPIO
+        clock = time.time
+    else:
+        from pulsesim import FakeGPIO, PulseSource, Constant
+        source = PulseSource(
+            Constant(opts.simulate),
+            jitter=opts.jitter,
+            dropout=opts.dropout,
+        )
+        GPIO = FakeGPIO({pin: source}, speed=opts.speed)
+        clock = GPIO.clock
     event_type = getattr(GPIO, opts.event)
 
     GPIO.setmode(GPIO.BCM)
     GPIO.setwarnings(False)
     GPIO.setup(pin, GPIO.IN)
 
-    q = Queue.Queue()
+    q = queue.Queue()
 
     def callback(*args):
-        q.put(time.time())
+        q.put(clock())
 
     if opts.debounce is not None:
         GPIO.add_event_detect(pin, event_type, callback, bouncetime=opts.debounce)
     else:
         GPIO.add_event_detect(pin, event_type, callback)
+    if opts.simulate is not None:
+        simulation = GPIO.start(opts.duration)
 
     pulses = []
     total = 0
-    while True:
-        # transfer pulses
-        for _ in xrange(q.qsize()):
-            pulses.append(q.get())
-        if pulses:
-            if opts.seconds is None:
-                total += len(pulses)
-                pulses = []
-            else:
-                then = pulses[-1] - opts.seconds
-                pulses = pulses[bisect.bisect_left(pulses, then):]
-                total = len(pulses)
-            print(total)
-
-if __name__ == "__main__":
     try:
-        main()
+        while simulation is None or simulation.is_alive() or not q.empty():
+            # transfer pulses
+            for _ in range(q.qsize()):
+                pulses.append(q.get())
+            if pulses:
+                if opts.seconds is None:
+                    total += len(pulses)
+                    pulses = []
+                else:
+                    then = pulses[-1] - opts.seconds
+                    pulses = pulses[bisect.bisect_left(pulses, then):]
+                    total = len(pulses)
+                print(total)
     except KeyboardInterrupt:
         GPIO.cleanup()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+import random
+import unittest
+from collections import deque
+from unittest import mock
+
+import numpy as np
+
+try:
+    from scipy.signal import lfilter
+except ImportError:
+    lfilter = None
+
+import filters
+from filters import (
+    IIRFilter,
+    FIRFilter,
+    WeightedFIRFilter,
+    IIRFilterBank,
+    FIRFilterBank,
+)
+
+
+class FIRFilterTests(unittest.TestCase):
+
+    def test_matches_plain_mean(self):
+        random.seed(1)
+        fir = FIRFilter(7)
+        q = deque(maxlen=7)
+        for _ in range(100):
+            v = random.random() * 100
+            q.append(v)
+            self.assertAlmostEqual(sum(q) / len(q), fir.feed(v))
+
+    def test_resum_bounds_drift(self):
+        fir = FIRFilter(3)
+        for v in [1e16, 1.0, -1e16] * 10 + [0.0, 0.0, 0.0]:
+            fir.feed(v)
+        self.assertEqual(0.0, fir.value)
+
+
+def first_order_lfilter(b, a, x, zi):
+    """
+    What scipy.signal.lfilter computes for a first order
+    filter - in its direct form II transposed, operation
+    by operation - for running without scipy.
+    """
+    (b0,), (a0, a1) = b, a
+    b0, a1 = b0 / a0, a1 / a0
+    z = zi[0]
+    output = []
+    for x in x.tolist():
+        y = z + b0 * x
+        z = 0.0 * x - a1 * y
+        output.append(y)
+    return np.array(output), np.array([z])
+
+
+class BlockTests(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(4)
+        self.samples = rng.uniform(-1e3, 1e3, size=1000)
+
+    def assert_blocks_match(self, single, blocked, sizes):
+        expected = [single.feed(v) for v in self.samples.tolist()]
+        output = []
+        pos = 0
+        for size in sizes:
+            output.extend(blocked.feed_block(self.samples[pos:pos + size]))
+            pos += size
+        output.extend(blocked.feed_block(self.samples[pos:]))
+        self.assertEqual(expected, output)
+
+    def test_iir_block(self):
+        paths = [
+            ("lfilter", lfilter or first_order_lfilter),
+            ("python", None),
+        ]
+        for path, implementation in paths:
+            with self.subTest(path=path), \
+                    mock.patch.object(filters, "lfilter", implementation):
+                self.assert_blocks_match(
+                    IIRFilter(0.05, 3.0), IIRFilter(0.05, 3.0), [1, 0, 17, 300]
+                )
+
+    def test_fir_block(self):
+        for size, resum in [(7, None), (7, 100), (50, 13), (2000, None)]:
+            self.assert_blocks_match(
+                FIRFilter(size, resum),
+                FIRFilter(size, resum),
+                [1, 0, 3, 5, 60, 400],
+            )
+
+    def test_fir_block_carries_over_to_feed(self):
+        single, blocked = FIRFilter(9, 4), FIRFilter(9, 4)
+        for v in self.samples[:25].tolist():
+            single.feed(v)
+        blocked.feed_block(self.samples[:25])
+        for v in self.samples[25:40].tolist():
+            self.assertEqual(single.feed(v), blocked.feed(v))
+
+
+class WeightedFIRFilterTests(unittest.TestCase):
+
+    def test_taps(self):
+        fir = WeightedFIRFilter([0.5, 0.25, 0.25])
+        self.assertEqual(0.5, fir.feed(1))
+        self.assertEqual(0.75, fir.feed(1))
+        self.assertEqual(1.0, fir.feed(1))
+        self.assertEqual(2.5, fir.feed(4))
+        self.assertEqual(1.25, fir.feed(0))
+
+    def test_equal_taps_are_a_mean(self):
+        random.seed(2)
+        weighted = WeightedFIRFilter([0.25] * 4)
+        fir = FIRFilter(4)
+        values = [random.random() for _ in range(20)]
+        for v in values[:4]:
+            weighted.feed(v)
+            fir.feed(v)
+        for v in values[4:]:
+            self.assertAlmostEqual(fir.feed(v), weighted.feed(v))
+
+
+class FilterBankTests(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(3)
+        self.samples = rng.uniform(0, 100, size=(50, 4))
+
+    def test_iir_bank_matches_filters(self):
+        gains = [0.1, 0.2, 0.5, 1.0]
+        bank = IIRFilterBank(4, gains)
+        filters = [IIRFilter(gain) for gain in gains]
+        for values in self.samples:
+            output = bank.feed(values)
+            for f, v, out in zip(filters, values, output):
+                self.assertAlmostEqual(f.feed(v), out)
+
+    def test_fir_bank_matches_filters(self):
+        bank = FIRFilterBank(4, 5)
+        filters = [FIRFilter(5) for _ in range(4)]
+        for values in self.samples:
+            output = bank.feed(values)
+            for f, v, out in zip(filters, values, output):
+                self.assertAlmostEqual(f.feed(v), out)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,156 @@
+import unittest
+
+import numpy as np
+
+import rpm
+from pulsesim import Constant, Ramp, PulseSource, FakeGPIO
+
+
+class ProfileTests(unittest.TestCase):
+
+    def test_constant(self):
+        self.assertEqual([0.0, 0.5, 1.0], list(Constant(2).times(np.arange(3))))
+
+    def test_ramp(self):
+        # 100 pulses over the 10s ramp, then 20 per second
+        ramp = Ramp(0.0, 20.0, 10.0)
+        times = ramp.times(np.array([0, 25, 100, 120]))
+        np.testing.assert_allclose([0.0, 5.0, 10.0, 11.0], times)
+
+    def test_ramp_to_standstill(self):
+        # 25 pulses over the 5s ramp, then none
+        ramp = Ramp(10.0, 0.0, 5.0)
+        with np.errstate(all="raise"):
+            times = ramp.times(np.array([0, 24, 25, 26]))
+        np.testing.assert_allclose([0.0, 4.0, 5.0, np.inf], times)
+
+    def test_ramp_without_acceleration(self):
+        np.testing.assert_allclose(
+            Constant(4).times(np.arange(10)),
+            Ramp(4.0, 4.0, 1.0).times(np.arange(10)),
+        )
+
+
+class PulseSourceTests(unittest.TestCase):
+
+    def collect(self, source, batch_size=100, duration=10.0):
+        return np.concatenate(list(source.batches(batch_size, duration)))
+
+    def test_duration(self):
+        times = self.collect(PulseSource(Constant(100)))
+        self.assertEqual(1000, len(times))
+        self.assertEqual(9.99, times[-1])
+
+    def test_deterministic(self):
+        def source(seed):
+            return PulseSource(Constant(100), jitter=0.3, dropout=0.2, seed=seed)
+        first = self.collect(source(1))
+        self.assertEqual(list(first), list(self.collect(source(1))))
+        self.assertNotEqual(list(first), list(self.collect(source(2))))
+
+    def test_jitter_keeps_order(self):
+        for distribution in ["uniform", "normal"]:
+            times = self.collect(
+                PulseSource(Constant(100), jitter=2.0, distribution=distribution)
+            )
+            self.assertTrue(np.all(np.diff(times) >= 0))
+            offsets = np.abs(times - np.arange(len(times)) / 100)
+            self.assertLessEqual(offsets.max(), 0.005 + 1e-12)
+
+    def test_dropout(self):
+        times = self.collect(PulseSource(Constant(1000), dropout=0.25))
+        self.assertAlmostEqual(0.75, len(times) / 10000, places=2)
+
+    def test_standstill_stops(self):
+        for batch_size in [8, 25, 26]:
+            for jitter in [0.0, 0.3]:
+                source = PulseSource(Ramp(10.0, 0.0, 5.0), jitter=jitter)
+                with np.errstate(all="raise"):
+                    times = self.collect(source, batch_size, duration=None)
+                self.assertEqual(26, len(times))
+                self.assertTrue(np.all(np.isfinite(times)))
+                if not jitter:
+                    self.assertEqual(5.0, times[-1])
+
+    def test_unknown_distribution(self):
+        with self.assertRaises(ValueError):
+            PulseSource(Constant(1), distribution="poisson")
+
+
+class FakeGPIOTests(unittest.TestCase):
+
+    def test_channels_are_merged_in_order(self):
+        gpio = FakeGPIO(
+            {1: PulseSource(Constant(30)), 2: PulseSource(Constant(70))},
+            speed=0,
+            batch_size=16,
+        )
+        seen = []
+        gpio.add_event_detect(1, gpio.RISING, lambda channel: seen.append((gpio.clock(), channel)))
+        gpio.add_event_detect(2, gpio.RISING, lambda channel: seen.append((gpio.clock(), channel)))
+        gpio.run(duration=1.0)
+        self.assertEqual(100, len(seen))
+        self.assertEqual(sorted(seen, key=lambda seen: seen[0]), seen)
+        self.assertEqual(30, sum(channel == 1 for _, channel in seen))
+
+    def test_run_ends_when_all_sources_stop(self):
+        gpio = FakeGPIO(
+            {1: PulseSource(Ramp(10.0, 0.0, 5.0)), 2: PulseSource(Ramp(4.0, 0.0, 1.0))},
+            speed=0,
+            batch_size=4,
+        )
+        seen = []
+        gpio.add_event_detect(1, gpio.RISING, seen.append)
+        gpio.run()
+        self.assertEqual(26, len(seen))
+        self.assertEqual(26 + 3, gpio.delivered)
+
+    def test_real_time(self):
+        source = PulseSource(Constant(1000), jitter=0.2)
+        gpio = FakeGPIO({1: source}, speed=4.0)
+        seen = []
+        gpio.add_event_detect(1, gpio.RISING, lambda channel: seen.append(gpio.clock()))
+        gpio.run(duration=0.4)
+        # in the callbacks, the clock is the timestamp of the pulse
+        expected = gpio._start + np.concatenate(list(source.batches(duration=0.4)))
+        self.assertEqual(expected.tolist(), seen)
+        # and between pulses, the scaled real time
+        self.assertGreaterEqual(gpio.clock(), seen[-1])
+
+
+class RPMCounterStressTests(unittest.TestCase):
+
+    def counter(self, rate, **options):
+        gpio = FakeGPIO(
+            {20: PulseSource(Constant(rate), **options)}, speed=0
+        )
+        original, rpm.GPIO = rpm.GPIO, gpio
+        try:
+            counter = rpm.RPMCounter(20, 200, capacity=1 << 16, clock=gpio.clock)
+        finally:
+            rpm.GPIO = original
+        return gpio, counter
+
+    def test_high_rate(self):
+        # 50kHz on a 200 PPR encoder are 250 rps
+        gpio, counter = self.counter(50000, jitter=0.02, seed=3)
+        for _ in range(4):
+            gpio.run(duration=0.25)
+            self.assertAlmostEqual(250.0, counter.rps, delta=2.5)
+        self.assertEqual(0, counter.overruns)
+
+    def test_dropouts_lower_the_rate(self):
+        gpio, counter = self.counter(50000, dropout=0.5)
+        gpio.run(duration=0.5)
+        # a lost pulse doubles the period
+        self.assertLess(counter.rps, 200.0)
+
+    def test_overrun(self):
+        gpio, counter = self.counter(200000)
+        gpio.run(duration=1.0)
+        self.assertAlmostEqual(1000.0, counter.rps, places=4)
+        self.assertEqual(200000 - (1 << 16) + 1, counter.overruns)
+
+
+if __name__ == '__main__':
+    unittest.main()
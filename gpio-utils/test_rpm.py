@@ -0,0 +1,230 @@
+import time
+import unittest
+from unittest import mock
+
+import numpy as np
+
+import rpm
+
+
+class NoGPIO:
+
+    RISING = 1
+
+    def add_event_detect(self, channel, event, callback, bouncetime=0):
+        pass
+
+
+class Clock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def reference_rps(timestamps, pulses_per_revolution, filter):
+    value = 0.0
+    for last, ts in zip(timestamps, timestamps[1:]):
+        residual = (1 / (ts - last)) / pulses_per_revolution - value
+        value += filter * residual
+    return value
+
+
+class RPMCounterTests(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(rpm, "GPIO", NoGPIO())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.clock = Clock()
+
+    def pulses(self, counter, timestamps):
+        for timestamp in timestamps:
+            self.clock.now = timestamp
+            counter._rise_event(20)
+
+    def test_matches_filtered_rate(self):
+        counter = rpm.RPMCounter(20, 20, capacity=16, clock=self.clock)
+        timestamps = [i * 0.05 + (i % 3) * 0.001 for i in range(50)]
+        # several reads, wrapping around the ring
+        for start, end in [(0, 1), (1, 10), (10, 25), (25, 40), (40, 50)]:
+            self.pulses(counter, timestamps[start:end])
+            self.assertAlmostEqual(
+                reference_rps(timestamps[:end], 20, 0.1), counter.rps
+            )
+        self.assertAlmostEqual(counter.rps * 60, counter.rpm)
+        self.assertEqual(0, counter.overruns)
+
+    def test_overrun_drops_oldest(self):
+        counter = rpm.RPMCounter(20, 2, filter=1.0, capacity=8, clock=self.clock)
+        self.pulses(counter, [0.0, 1.0, 2.0])
+        self.assertEqual(0.5, counter.rps)
+        self.pulses(counter, [3.0 + i * 0.25 for i in range(20)])
+        self.assertEqual(2.0, counter.rps)
+        self.assertEqual(13, counter.overruns)
+
+    def test_process_and_accessors(self):
+        counter = rpm.RPMCounter(20, 2, filter=1.0, clock=self.clock)
+        self.assertIsNone(counter.last_pulse)
+        self.pulses(counter, [0.0, 0.5, 1.5])
+        self.assertEqual(0.0, counter.value)
+        timestamps, periods = counter.process()
+        self.assertEqual([0.5, 1.5], timestamps.tolist())
+        self.assertEqual([0.5, 1.0], periods.tolist())
+        self.assertEqual(1.5, counter.last_pulse)
+        self.assertEqual(0.5, counter.value)
+
+    def test_zero_periods_are_not_filtered(self):
+        counter = rpm.RPMCounter(20, 2, filter=1.0, clock=self.clock)
+        self.pulses(counter, [0.0, 0.5, 0.5])
+        self.assertEqual(1.0, counter.rps)
+
+    def test_burst_while_copying(self):
+        counter = rpm.RPMCounter(20, 2, filter=1.0, capacity=8, clock=self.clock)
+        self.pulses(counter, [0.0, 1.0, 2.0, 3.0, 4.0, 5.0])
+        copy = counter._copy
+
+        def burst(first, end):
+            # the callback laps the reader before it copies
+            self.pulses(counter, [100.0, 100.5, 101.0, 101.5])
+            counter._copy = copy
+            return copy(first, end)
+
+        counter._copy = burst
+        timestamps, periods = counter.process()
+        # 0.0 and 1.0 were overwritten, 2.0 might be
+        # written right now
+        self.assertEqual([4.0, 5.0], timestamps.tolist())
+        self.assertEqual([1.0, 1.0], periods.tolist())
+        self.assertEqual(3, counter.overruns)
+        self.assertEqual(0.5, counter.value)
+        # the burst itself follows with the next read
+        timestamps, periods = counter.process()
+        self.assertEqual([100.0, 100.5, 101.0, 101.5], timestamps.tolist())
+        self.assertEqual(1.0, counter.value)
+        self.assertEqual(3, counter.overruns)
+
+
+class HistoryTests(unittest.TestCase):
+
+    def test_moves_and_grows(self):
+        history = rpm._History(capacity=4)
+        timestamps = np.arange(100.0)
+        for start in range(0, 100, 3):
+            batch = timestamps[start:start + 3]
+            history.append(batch, batch / 10)
+            history.expire(start - 5)
+            expected = timestamps[max(0, start - 5):start + 3] / 10
+            self.assertEqual(expected.tolist(), history.periods(-1).tolist())
+        self.assertEqual([9.8, 9.9], history.periods(98).tolist())
+        # no more than the window needs
+        self.assertLessEqual(len(history._timestamps), 32)
+
+    def test_steady_window_doesnt_allocate(self):
+        history = rpm._History(capacity=64)
+        arrays = history._timestamps, history._periods
+        for start in range(0, 1000, 2):
+            batch = np.arange(start, start + 2.0)
+            history.append(batch, np.ones(2))
+            history.expire(start - 10)
+        self.assertIs(arrays[0], history._timestamps)
+        self.assertIs(arrays[1], history._periods)
+        self.assertEqual(12, len(history.periods(0)))
+
+
+class RPMMonitorTests(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(rpm, "GPIO", NoGPIO())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.clock = Clock()
+        self.monitor = rpm.RPMMonitor(
+            windows=(1.0, 4.0), filter=1.0, clock=self.clock
+        )
+        self.monitor.add_channel(20, 2)
+        self.monitor.add_channel(21, 4)
+
+    def pulses(self, channel, timestamps):
+        counter = self.monitor._channels[channel].counter
+        for timestamp in timestamps:
+            self.clock.now = timestamp
+            counter._rise_event(channel)
+
+    def test_no_pulses_is_stalled(self):
+        self.monitor.sample(now=1.0)
+        self.assertTrue(self.monitor.stalled(20))
+        self.assertEqual(0.0, self.monitor.rpm(20))
+        self.assertEqual(0, self.monitor.statistics(20).pulses)
+
+    def test_stalled_before_first_sample(self):
+        self.monitor.add_channel(22, 2)
+        self.assertTrue(self.monitor.stalled(22))
+        self.assertEqual(0.0, self.monitor.rpm(22))
+        self.assertEqual(0, self.monitor.statistics(22, 4.0).pulses)
+
+    def test_zero_periods(self):
+        self.pulses(20, [0.0, 0.0, 0.0])
+        self.monitor.sample(now=0.0)
+        self.assertEqual((0.0, 0.0, 0.0, 0.0, 2), self.monitor.statistics(20))
+        self.pulses(21, [0.0, 0.0, 0.5])
+        self.monitor.sample(now=0.5)
+        statistics = self.monitor.statistics(21)
+        self.assertEqual((60.0, 30.0, 30.0, 2), statistics[:3] + statistics[4:])
+        self.assertEqual(30.0, self.monitor.rpm(21))
+
+    def test_windowed_statistics(self):
+        # 1s, then 0.5s periods on 2 PPR: 30, then 60 RPM
+        self.pulses(20, [0.0, 1.0, 2.0, 2.5, 3.0, 3.5, 4.0])
+        self.pulses(21, [2.5, 2.75, 3.0])
+        self.monitor.sample(now=4.0)
+
+        self.assertEqual(60.0, self.monitor.rpm(20))
+        self.assertFalse(self.monitor.stalled(20))
+        last = self.monitor.statistics(20, 1.0)
+        self.assertEqual((60.0, 60.0, 60.0, 0.0, 3), last)
+        everything = self.monitor.statistics(20, 4.0)
+        self.assertEqual(6, everything.pulses)
+        self.assertEqual(30.0, everything.min)
+        self.assertEqual(60.0, everything.max)
+        self.assertAlmostEqual(60.0 * 3 / 4.0, everything.mean)
+        self.assertAlmostEqual(0.2357022603955158, everything.jitter)
+
+        self.assertEqual(60.0, self.monitor.rpm(21))
+        # the windows are relative to now
+        self.assertEqual(1, self.monitor.statistics(21, 1.0).pulses)
+        self.assertEqual(2, self.monitor.statistics(21, 4.0).pulses)
+
+    def test_stall_detection(self):
+        self.pulses(20, [0.0, 0.5, 1.0])
+        self.monitor.sample(now=3.0)
+        self.assertFalse(self.monitor.stalled(20))
+        self.monitor.sample(now=3.6)
+        self.assertTrue(self.monitor.stalled(20))
+        self.assertEqual(0.0, self.monitor.rpm(20))
+        # the first pulse after a stall has no period
+        self.pulses(20, [10.0])
+        self.monitor.sample(now=10.0)
+        self.assertTrue(self.monitor.stalled(20))
+        self.pulses(20, [10.5])
+        self.monitor.sample(now=10.5)
+        self.assertEqual(60.0, self.monitor.rpm(20))
+
+    def test_background_sampling(self):
+        self.monitor._interval = 0.01
+        self.monitor.start()
+        try:
+            self.pulses(20, [0.0, 0.05])
+            deadline = time.monotonic() + 2.0
+            while self.monitor.stalled(20) and time.monotonic() < deadline:
+                time.sleep(0.01)
+        finally:
+            self.monitor.stop()
+        self.assertFalse(self.monitor.stalled(20))
+        self.assertEqual([20, 21], self.monitor.channels)
+
+
+if __name__ == '__main__':
+    unittest.main()
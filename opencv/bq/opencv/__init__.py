@@ -1,17 +1,27 @@
-from .util import (
-    Bunch,
-    GREEN,
-    YELLOW,
-    RED,
-    PINK,
-    WHITE,
-    create_hsv_preview,
-    memoize,
-    colorbar,
-    RevolutionCounter,
-    Atan2Monotizer,
-)
+"""
+The names below are imported from their submodules on
+first access, so importing the package alone doesn't
+pull in cv2 and numpy - and e.g. the headless path
+doesn't load the capture devices.
+"""
+from .lazy import install
 
-from .cv23 import cv2_3
 
-from .input import GenericInput
+install(__name__, {
+    "Bunch": "util",
+    "GREEN": "util",
+    "YELLOW": "util",
+    "RED": "util",
+    "PINK": "util",
+    "WHITE": "util",
+    "create_hsv_preview": "util",
+    "memoize": "util",
+    "colorbar": "util",
+    "RevolutionCounter": "util",
+    "Atan2Monotizer": "util",
+    "FlowEstimator": "util",
+    "cv2_3": "cv23",
+    "ThreadedCapture": "capture",
+    "AdaptiveFrameRate": "rate",
+    "GenericInput": "input",
+})
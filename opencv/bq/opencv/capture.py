@@ -0,0 +1,199 @@
+import threading
+from collections import deque
+
+
+DROP_OLDEST = "drop-oldest"
+BLOCK = "block"
+
+DROP_POLICIES = (DROP_OLDEST, BLOCK)
+
+
+class ThreadedCapture(object):
+    """
+    Wraps a capture (anything with a read()-method
+    following the cv2.VideoCapture protocol), and
+    reads from it in a background thread.
+
+    Frames are decoded into a fixed ring of buffers
+    which are re-used once the consumer is done with
+    them. A frame returned by read() stays valid until
+    the next call to read().
+
+    If the consumer can't keep up, the drop policy decides:
+
+     - drop-oldest: the oldest unconsumed frame gets overwritten,
+       so the consumer always works on fresh data
+     - block: the reader waits for the consumer, no frame is lost
+    """
+
+    def __init__(self, capture, buffers=3, drop_policy=DROP_OLDEST):
+        assert buffers >= 1
+        assert drop_policy in DROP_POLICIES
+        self._capture = capture
+        self._drop_policy = drop_policy
+        self._buffers = [None] * buffers
+        # indices into _buffers
+        self._free = deque(xrange(buffers))
+        self._filled = deque()
+        self._in_use = None
+        self._eof = False
+        self._running = True
+        self._condition = threading.Condition()
+        self.dropped = 0
+
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+
+    def _run(self):
+        while True:
+            with self._condition:
+                index, stolen = self._acquire_buffer()
+                if index is None:
+                    return
+
+            # decoding happens outside the lock
+            # so the consumer can proceed meanwhile
+            grabbed, frame = self._capture.read(self._buffers[index])
+
+            with self._condition:
+                if grabbed:
+                    self._buffers[index] = frame
+                    self._filled.append(index)
+                elif stolen:
+                    # nothing got decoded, so the frame
+                    # we wanted to drop is still intact
+                    self.dropped -= 1
+                    self._filled.appendleft(index)
+                    self._eof = True
+                else:
+                    self._free.append(index)
+                    self._eof = True
+                self._condition.notify_all()
+                if not grabbed:
+                    return
+
+
+    def _acquire_buffer(self):
+        """
+        Must be called with the condition held. Returns
+        the index of the buffer to decode into, or None
+        if we are supposed to stop, and if the buffer
+        was taken away from an unconsumed frame.
+        """
+        while self._running and not self._free:
+            if self._drop_policy == DROP_OLDEST and self._filled:
+                break
+            self._condition.wait()
+        if not self._running:
+            return None, False
+        if self._free:
+            return self._free.popleft(), False
+        self.dropped += 1
+        return self._filled.popleft(), True
+
+
+    def read(self, image=None):
+        with self._condition:
+            if self._in_use is not None:
+                self._free.append(self._in_use)
+                self._in_use = None
+                self._condition.notify_all()
+
+            while not self._filled and not self._eof and self._running:
+                self._condition.wait()
+
+            if not self._filled:
+                return False, None
+
+            self._in_use = self._filled.popleft()
+            return True, self._buffers[self._in_use]
+
+
+    def grab(self):
+        grabbed, _ = self.read()
+        return grabbed
+
+
+    def release(self):
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        self._thread.join()
+        release = getattr(self._capture, "release", None)
+        if release is not None:
+            release()
+
+
+class FrameRangeCapture(object):
+    """
+    Wraps a capture and only delivers the frames
+    from start up to end (exclusive, None meaning
+    no end), and of those only every stride-th.
+
+    Skipped frames are grabbed, but not decoded,
+    if the capture supports it. If a seek-function
+    is given, it is used to get to the start instead
+    of skipping frame by frame.
+    """
+
+    def __init__(self, capture, start=0, end=None, stride=1, seek=None):
+        assert stride >= 1
+        self._capture = capture
+        self._end = end
+        self._stride = stride
+        self._pending = 0
+        self.position = 0
+        if start:
+            if seek is not None:
+                seek(capture, start)
+                self.position = start
+            else:
+                self._pending = start
+
+
+    def _exhausted(self):
+        return self._end is not None and self.position >= self._end
+
+
+    def _skip(self):
+        self.position += 1
+        grab = getattr(self._capture, "grab", None)
+        if grab is not None:
+            return grab()
+        grabbed, _ = self._capture.read()
+        return grabbed
+
+
+    def _next(self):
+        """
+        Skips up to the next frame to deliver, and
+        tells if there is one.
+        """
+        for _ in xrange(self._pending):
+            if self._exhausted() or not self._skip():
+                return False
+        self._pending = self._stride - 1
+        return not self._exhausted()
+
+
+    def read(self, image=None):
+        if not self._next():
+            return False, None
+        self.position += 1
+        return self._capture.read(image)
+
+
+    def grab(self):
+        """
+        Skips the next frame to deliver, without
+        decoding it if possible.
+        """
+        return self._next() and self._skip()
+
+
+    def release(self):
+        release = getattr(self._capture, "release", None)
+        if release is not None:
+            release()
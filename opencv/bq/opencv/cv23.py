@@ -1,13 +1,33 @@
 import cv2
 
-IS_TWO = cv2.__version__.startswith("2.")
 
-
-class cv2_3(object):
+class _CV2_3(object):
+    """
+    Papers over the differences between the OpenCV
+    versions. The CAP_PROP_* constants are looked up
+    on first access, so importing this doesn't depend
+    on the cv2 version.
+    """
 
     @staticmethod
     def findContours(*a, **k):
         res = cv2.findContours(*a, **k)
-        if IS_TWO:
-            res = (None,) + res
+        # OpenCV 2.x and 4.x only return
+        # contours and hierarchy
+        if len(res) == 2:
+            res = (None,) + tuple(res)
         return res
+
+
+    def __getattr__(self, name):
+        if not name.startswith("CAP_PROP_"):
+            raise AttributeError(name)
+        if cv2.__version__.startswith("2."):
+            value = getattr(cv2.cv, "CV_" + name)
+        else:
+            value = getattr(cv2, name)
+        setattr(self, name, value)
+        return value
+
+
+cv2_3 = _CV2_3()
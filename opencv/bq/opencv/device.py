@@ -0,0 +1,167 @@
+"""
+Live capture devices, such as the Pi camera through
+its V4L2 driver, or a webcam.
+"""
+import time
+
+import cv2
+
+from .cv23 import cv2_3
+
+
+def open_device(device, width=None, height=None, fps=None):
+    """
+    Opens the V4L2 device (an index, or a path
+    like /dev/video0), and requests the resolution
+    and frame rate - which the driver might round
+    to what it supports.
+    """
+    api = getattr(cv2, "CAP_V4L2", None)
+    if api is not None:
+        capture = cv2.VideoCapture(device, api)
+    else:
+        capture = cv2.VideoCapture(device)
+    if width is not None:
+        capture.set(cv2_3.CAP_PROP_FRAME_WIDTH, width)
+    if height is not None:
+        capture.set(cv2_3.CAP_PROP_FRAME_HEIGHT, height)
+    if fps is not None:
+        capture.set(cv2_3.CAP_PROP_FPS, fps)
+    return capture
+
+
+def parse_device(device):
+    """
+    "0" means the first device, everything
+    else is a path.
+    """
+    return int(device) if device.isdigit() else device
+
+
+class FakeDevice(object):
+    """
+    Behaves like a device, but serves the frames of
+    a movie - over and over again - or an image, in
+    the requested resolution, and at the given fps
+    (or as fast as possible if None).
+    """
+
+    def __init__(self, filename, width=None, height=None, fps=None):
+        self._filename = filename
+        self._size = None if width is None or height is None else (width, height)
+        self._period = 0.0 if fps is None else 1.0 / fps
+        self._timestamp = None
+        self._image = cv2.imread(filename)
+        self._movie = None
+        if self._image is None:
+            self._movie = cv2.VideoCapture(filename)
+        self._scratch = None
+
+
+    def _next_frame(self):
+        if self._movie is None:
+            return self._image
+        grabbed, self._scratch = self._movie.read(self._scratch)
+        if not grabbed:
+            self._movie.release()
+            self._movie = cv2.VideoCapture(self._filename)
+            grabbed, self._scratch = self._movie.read(self._scratch)
+            if not grabbed:
+                return None
+        return self._scratch
+
+
+    def read(self, image=None):
+        if self._timestamp is not None:
+            elapsed = time.time() - self._timestamp
+            if elapsed < self._period:
+                time.sleep(self._period - elapsed)
+        self._timestamp = time.time()
+
+        frame = self._next_frame()
+        if frame is None:
+            return False, None
+        if self._size is not None and frame.shape[1::-1] != self._size:
+            if image is not None and image.shape[1::-1] != self._size:
+                image = None
+            return True, cv2.resize(frame, self._size, image, interpolation=cv2.INTER_AREA)
+        if image is None or image.shape != frame.shape:
+            return True, frame.copy()
+        image[...] = frame
+        return True, image
+
+
+    def release(self):
+        if self._movie is not None:
+            self._movie.release()
+
+
+class DeviceCapture(object):
+    """
+    Wraps a device, and reads frames into re-used
+    buffers.
+
+    If crop (left, top, width, height) is given, the
+    frames handed out are views of just this region,
+    without copying. The top-left corner of the region
+    is available as origin, so coordinates in the full
+    frame can be translated.
+
+    A previously returned frame can be passed to read,
+    as ThreadedCapture does, and its buffer is re-used.
+    Otherwise, with reuse, one internal buffer is used
+    for all frames, so a frame is only valid until the
+    next read. Without, a new one is allocated as
+    cv2.VideoCapture does.
+    """
+
+    def __init__(self, device, crop=None, reuse=True):
+        self._device = device
+        self._crop = crop
+        self._reuse = reuse
+        self._buffer = None
+        self._region = None
+        self.origin = (0, 0) if crop is None else crop[:2]
+
+
+    def _crop_region(self, frame):
+        if self._region is None:
+            height, width = frame.shape[:2]
+            left, top, crop_width, crop_height = self._crop
+            left, top = min(left, width), min(top, height)
+            self._region = (
+                slice(top, min(height, top + crop_height)),
+                slice(left, min(width, left + crop_width)),
+            )
+        return frame[self._region]
+
+
+    def read(self, image=None):
+        buffer = self._buffer
+        if image is not None:
+            # a frame we handed out before
+            buffer = image if image.base is None else image.base
+        elif not self._reuse:
+            buffer = None
+        grabbed, frame = self._device.read(buffer)
+        if not grabbed:
+            return False, None
+        if image is None and self._reuse:
+            self._buffer = frame
+        if self._crop is None:
+            return True, frame
+        return True, self._crop_region(frame)
+
+
+    def grab(self):
+        grab = getattr(self._device, "grab", None)
+        if grab is not None:
+            return grab()
+        grabbed, frame = self._device.read(self._buffer)
+        if self._reuse:
+            self._buffer = frame
+        return grabbed
+
+
+    def release(self):
+        self._device.release()
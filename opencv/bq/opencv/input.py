@@ -1,10 +1,37 @@
-import cv2
+import sys
 import time
 import argparse
+from collections import OrderedDict
+
+import cv2
+
+from .cv23 import cv2_3
+from .capture import (
+    ThreadedCapture,
+    FrameRangeCapture,
+    DROP_POLICIES,
+    DROP_OLDEST,
+    BLOCK,
+)
 
 
 class GenericInput(object):
 
+    # name -> factory(generic_input, opts) returning a capture,
+    # see register_backend
+    backends = OrderedDict()
+
+
+    @classmethod
+    def register_backend(cls, name, factory):
+        """
+        Registers the backend for this class and its
+        subclasses - but not for the base classes.
+        """
+        if "backends" not in cls.__dict__:
+            cls.backends = OrderedDict(cls.backends)
+        cls.backends[name] = factory
+
 
     @classmethod
     def parser(cls, *a, **k):
@@ -12,14 +39,127 @@ class GenericInput(object):
         parser.add_argument("--movie")
         parser.add_argument("--image")
         parser.add_argument("--image-fps", type=int, default=30)
+        parser.add_argument(
+            "--device",
+            help="A V4L2 device such as the Pi camera, either "
+            "as number or path like /dev/video0",
+        )
+        parser.add_argument(
+            "--backend",
+            choices=cls.backends.keys(),
+            help="How to capture frames. Defaults to movie, image or "
+            "device, depending on which of them is given. fake-device "
+            "serves the --device file like a camera would",
+        )
+        parser.add_argument(
+            "--width",
+            type=int,
+            help="Resolution to request from the --device",
+        )
+        parser.add_argument(
+            "--height",
+            type=int,
+            help="Resolution to request from the --device",
+        )
+        parser.add_argument(
+            "--device-fps",
+            type=float,
+            help="Frame rate to request from the --device",
+        )
+        parser.add_argument(
+            "--crop",
+            action="store_true",
+            help="Only hand the region of interest of --device frames "
+            "on for processing, see capture_region",
+        )
+        parser.add_argument(
+            "--threaded-capture",
+            action="store_true",
+            help="Read & decode frames in a background thread",
+        )
+        parser.add_argument(
+            "--capture-buffers",
+            type=int,
+            default=3,
+            help="Number of frame buffers for --threaded-capture",
+        )
+        parser.add_argument(
+            "--drop-policy",
+            choices=DROP_POLICIES,
+            help="What to do if processing can't keep up with --threaded-capture. "
+            "Defaults to %s, or %s with --replay" % (DROP_OLDEST, BLOCK),
+        )
+        parser.add_argument(
+            "--replay",
+            action="store_true",
+            help="Process the input once, as fast as possible, and report the fps",
+        )
+        parser.add_argument(
+            "--start",
+            type=int,
+            default=0,
+            help="Frame to start at",
+        )
+        parser.add_argument(
+            "--end",
+            type=int,
+            help="Frame to stop at (exclusive). An --image is "
+            "only processed once in --replay mode if not given",
+        )
+        parser.add_argument(
+            "--stride",
+            type=int,
+            default=1,
+            help="Only process every STRIDE-th frame",
+        )
+        parser.add_argument(
+            "--adaptive-fps",
+            action="store_true",
+            help="Adapt the processing rate to the speed of the observed motion",
+        )
+        parser.add_argument(
+            "--min-fps",
+            type=float,
+            default=1.0,
+            help="Lowest processing rate for --adaptive-fps",
+        )
+        parser.add_argument(
+            "--max-fps",
+            type=float,
+            default=30.0,
+            help="Highest processing rate for --adaptive-fps",
+        )
+        parser.add_argument(
+            "--step-margin",
+            type=float,
+            default=0.5,
+            help="Safety margin below the largest allowed step for --adaptive-fps",
+        )
         return parser
 
 
-    def __init__(self):
+    def __init__(self, args=None):
         parser = self.parser()
         self.augment_parser(parser)
-        self.opts = parser.parse_args()
+        self.opts = parser.parse_args(args)
         self._running = True
+        self.frames_processed = 0
+        self.elapsed = 0.0
+        # when the current frame was read, see clock
+        self.timestamp = None
+        self._media_time = 0.0
+        self._frame_period = None
+        # where the frames are within the picture
+        # of the device, if they are cropped
+        self.frame_origin = (0, 0)
+        self.frame_rate = None
+        if self.opts.adaptive_fps:
+            from .rate import AdaptiveFrameRate
+            self.frame_rate = AdaptiveFrameRate(
+                min_fps=self.opts.min_fps,
+                max_fps=self.opts.max_fps,
+                margin=self.opts.step_margin,
+            )
 
 
     def augment_parser(self, parser):
@@ -28,50 +168,196 @@ class GenericInput(object):
 
     def run(self):
         opts = self.opts
-        capture = self.create_capture(opts)
+        capture = self.open_capture(opts)
         setup_called = False
 
         self._running = True
+        self.frames_processed = 0
+        then = time.time()
+        dropped = 0
+        frame_rate = self.frame_rate
+
+        try:
+            while self._running:
+                if frame_rate is not None:
+                    wait = frame_rate.wait(self.clock())
+                    # if skipping fails, so will reading
+                    if wait > 0 and self.skip_frame(capture, wait):
+                        continue
 
-        while self._running:
-            grabbed, frame = capture.read()
-            if not grabbed:
-                capture = self.create_capture(opts)
                 grabbed, frame = capture.read()
-                assert grabbed
+                if not grabbed:
+                    if opts.replay:
+                        break
+                    self.close_capture(capture)
+                    capture = self.open_capture(opts)
+                    dropped = 0
+                    grabbed, frame = capture.read()
+                    assert grabbed
+
+                if getattr(capture, "dropped", 0) != dropped:
+                    self.frames_dropped(capture.dropped - dropped)
+                    dropped = capture.dropped
+
+                self._advance_clock()
+                self.timestamp = self.clock()
+                if frame_rate is not None:
+                    frame_rate.processed(self.timestamp)
+
+                if not setup_called:
+                    setup_called = True
+                    self.setup(frame)
+                self.frame_callback(frame)
+                self.frames_processed += 1
+        finally:
+            self.close_capture(capture)
+            self.elapsed = time.time() - then
+
+        if opts.replay:
+            self.report_throughput()
+
+
+    def skip_frame(self, capture, wait):
+        """
+        Passes time until the next frame is due, by
+        grabbing without decoding if possible - so live
+        sources don't queue up old frames. Returns False
+        if the capture is exhausted.
+        """
+        grab = getattr(capture, "grab", None)
+        if grab is not None:
+            grabbed = grab()
+        elif self._frame_period is not None:
+            # the clock of a movie only moves with its frames
+            grabbed, _ = capture.read()
+        else:
+            time.sleep(wait)
+            return True
+        if grabbed:
+            self._advance_clock()
+        return grabbed
+
+
+    def clock(self):
+        """
+        For movies, this is the time within the movie,
+        based on the frames consumed. So rates measured
+        with it are independent of how fast we decode.
+
+        For everything else, it's the wall-clock.
+        """
+        if self._frame_period is not None:
+            return self._media_time
+        return time.time()
+
+
+    def _advance_clock(self):
+        if self._frame_period is not None:
+            self._media_time += self._frame_period
+
+
+    @property
+    def fps(self):
+        if self.elapsed > 0:
+            return self.frames_processed / self.elapsed
+        return 0.0
+
 
-            if not setup_called:
-                setup_called = True
-                self.setup(frame)
-            self.frame_callback(frame)
+    def report_throughput(self):
+        print >> sys.stderr, "%i frames in %.2fs, %.1f fps" % (
+            self.frames_processed,
+            self.elapsed,
+            self.fps,
+        )
 
 
     def stop(self):
         self._running = False
 
 
+    def open_capture(self, opts):
+        capture = self.create_capture(opts)
+        self.frame_origin = getattr(capture, "origin", (0, 0))
+        backend = self.backend_name(opts)
+        self._frame_period = None
+        if backend == "movie":
+            fps = capture.get(cv2_3.CAP_PROP_FPS)
+            if fps > 0:
+                self._frame_period = opts.stride / fps
+        end = opts.end
+        if opts.replay and backend == "image" and end is None:
+            end = opts.start + 1
+        if opts.start or end is not None or opts.stride > 1:
+            capture = FrameRangeCapture(
+                capture,
+                start=opts.start,
+                end=end,
+                stride=opts.stride,
+                seek=self.seek if backend == "movie" else None,
+            )
+        if opts.threaded_capture:
+            capture = ThreadedCapture(
+                capture,
+                buffers=opts.capture_buffers,
+                drop_policy=opts.drop_policy or (
+                    BLOCK if opts.replay else DROP_OLDEST
+                ),
+            )
+        return capture
+
+
+    def close_capture(self, capture):
+        release = getattr(capture, "release", None)
+        if release is not None:
+            release()
+
+
+    @staticmethod
+    def seek(capture, frame):
+        capture.set(cv2_3.CAP_PROP_POS_FRAMES, frame)
+
+
     def create_capture(self, opts):
-        if opts.movie is not None:
-            return cv2.VideoCapture(opts.movie)
+        return self.backends[self.backend_name(opts)](self, opts)
+
+
+    def backend_name(self, opts):
+        if opts.backend is not None:
+            return opts.backend
+        elif opts.movie is not None:
+            return "movie"
         elif opts.image is not None:
-            return self.single_image_capture(
-                opts.image,
-                opts.image_fps,
-            )
+            return "image"
+        elif opts.device is not None:
+            return "device"
         else:
             raise Exception("no input data specified")
 
 
+    def capture_region(self):
+        """
+        The (left, top, width, height) of the picture we
+        are interested in, or None for all of it. Used
+        by --crop.
+        """
+        return None
+
+
     def single_image_capture(self, imagename, fps):
+        """
+        Serves the image over and over again, with
+        the given fps - or as fast as possible if
+        fps is None.
+        """
         img = cv2.imread(imagename)
         class Capture(object):
             def __init__(self):
                 self._timestamp = time.time() - 1.0
-                self._period = 1.0 / fps
+                self._period = 0.0 if fps is None else 1.0 / fps
 
-            def read(self):
+            def read(self, image=None):
                 elapsed = time.time() - self._timestamp
-                if elapsed <= self._period:
+                if elapsed < self._period:
                     time.sleep(self._period - elapsed)
 
                 self._timestamp = time.time()
@@ -85,3 +371,66 @@ class GenericInput(object):
 
     def frame_callback(self, frame):
         pass
+
+
+    def frames_dropped(self, count):
+        """
+        Called if the capture had to drop
+        frames because processing didn't
+        keep up.
+        """
+        pass
+
+
+def device_capture(generic_input, opts, device):
+    # the devices are only imported if used
+    from .device import DeviceCapture
+    return DeviceCapture(
+        device,
+        crop=generic_input.capture_region() if opts.crop else None,
+        # ThreadedCapture brings its own buffers
+        reuse=not opts.threaded_capture,
+    )
+
+
+def device_backend(generic_input, opts):
+    from .device import open_device, parse_device
+    return device_capture(
+        generic_input,
+        opts,
+        open_device(
+            parse_device(opts.device),
+            opts.width,
+            opts.height,
+            opts.device_fps,
+        ),
+    )
+
+
+def fake_device_backend(generic_input, opts):
+    from .device import FakeDevice
+    return device_capture(
+        generic_input,
+        opts,
+        FakeDevice(
+            opts.device,
+            opts.width,
+            opts.height,
+            opts.device_fps,
+        ),
+    )
+
+
+GenericInput.register_backend(
+    "movie",
+    lambda generic_input, opts: cv2.VideoCapture(opts.movie),
+)
+GenericInput.register_backend(
+    "image",
+    lambda generic_input, opts: generic_input.single_image_capture(
+        opts.image,
+        None if opts.replay else opts.image_fps,
+    ),
+)
+GenericInput.register_backend("device", device_backend)
+GenericInput.register_backend("fake-device", fake_device_backend)
@@ -0,0 +1,51 @@
+"""
+Module-level __getattr__ doesn't exist in Python 2, so
+a package with lazy exports replaces itself in
+sys.modules with a LazyModule.
+"""
+import sys
+import importlib
+from types import ModuleType
+
+
+class LazyModule(ModuleType):
+    """
+    Imports the exported names - a dict of name to the
+    submodule defining it - on first access.
+    """
+
+    def __init__(self, name, exports):
+        super(LazyModule, self).__init__(name)
+        self._exports = exports
+
+
+    def __getattr__(self, name):
+        try:
+            submodule = self._exports[name]
+        except KeyError:
+            raise AttributeError(
+                "'module' object has no attribute %r" % name
+            )
+        value = getattr(
+            importlib.import_module("." + submodule, self.__name__),
+            name,
+        )
+        setattr(self, name, value)
+        return value
+
+
+    def __dir__(self):
+        return sorted(set(self.__dict__) | set(self._exports))
+
+
+def install(name, exports):
+    """
+    Replaces the module name with a LazyModule carrying
+    its attributes. Everything the LazyModule needs lives
+    here, not in the replaced module - whose globals
+    Python 2 clears once it's garbage collected.
+    """
+    module = LazyModule(name, exports)
+    module.__dict__.update(sys.modules[name].__dict__)
+    sys.modules[name] = module
+    return module
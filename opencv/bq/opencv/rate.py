@@ -0,0 +1,84 @@
+import math
+
+
+class AdaptiveFrameRate(object):
+    """
+    Chooses the processing rate based on the angular
+    velocity of the hand.
+
+    The RevolutionCounter only works if consecutive
+    angles are no farther apart than pi/2. We aim for
+    steps of at most (1 - margin) * pi/2, and otherwise
+    process as few frames as possible - but at least
+    min_fps, and never more than max_fps.
+
+    The velocity estimate rises immediately with the
+    measured velocity, but only decays slowly, so sudden
+    flow is caught quickly.
+
+    Several hands can be fed under different keys, the
+    fastest one determines the rate.
+    """
+
+    MAX_STEP = math.pi / 2
+
+    def __init__(self, min_fps=1.0, max_fps=30.0, margin=0.5, decay=0.1):
+        assert 0 < min_fps <= max_fps
+        assert 0 <= margin < 1
+        self.min_fps = min_fps
+        self.max_fps = max_fps
+        self._step = self.MAX_STEP * (1.0 - margin)
+        self._decay = decay
+        self._last = {}
+        self._velocities = {}
+        self._processed = None
+        # until we know better, we go full speed
+        self.fps = max_fps
+
+
+    @property
+    def velocity(self):
+        """
+        The fastest angular velocity, or None
+        """
+        return max(self._velocities.values()) if self._velocities else None
+
+
+    def feed(self, angle, timestamp, key=None):
+        """
+        Feed the (monotized) angle of the hand
+        identified by key at the given timestamp.
+        """
+        last = self._last.get(key)
+        if last is not None:
+            last_angle, last_timestamp = last
+            elapsed = timestamp - last_timestamp
+            if elapsed > 0:
+                diff = angle - last_angle
+                # shortest way around the circle
+                diff = math.atan2(math.sin(diff), math.cos(diff))
+                velocity = abs(diff) / elapsed
+                current = self._velocities.get(key)
+                if current is None or velocity > current:
+                    self._velocities[key] = velocity
+                else:
+                    self._velocities[key] += (velocity - current) * self._decay
+                self.fps = min(
+                    self.max_fps,
+                    max(self.min_fps, self.velocity / self._step),
+                )
+        self._last[key] = angle, timestamp
+
+
+    def wait(self, now):
+        """
+        How long to wait until the next frame should
+        be processed. Zero or less means now.
+        """
+        if self._processed is None:
+            return 0.0
+        return self._processed + 1.0 / self.fps - now
+
+
+    def processed(self, now):
+        self._processed = now
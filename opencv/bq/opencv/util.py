@@ -1,6 +1,8 @@
 from functools import wraps
+from collections import OrderedDict
 import operator
 import math
+from timeit import default_timer
 
 import cv2
 import numpy as np
@@ -44,15 +46,66 @@ def create_hsv_preview(img):
     return cv2.cvtColor(hsv_preview, cv2.COLOR_HSV2BGR)
 
 
-def memoize(f):
+def memoize(f=None, maxsize=None, maxbytes=None):
+    """
+    Caches the results of f based on its arguments.
+
+    Use either plain as @memoize, or bounded as
+
+      @memoize(maxsize=10, maxbytes=10 * 1024 * 1024)
+
+    to keep at most maxsize results, of at most maxbytes
+    (based on the nbytes of e.g. NumPy-arrays) in total. The
+    least recently used results are evicted first, but the
+    most recent one is always kept.
+
+    The decorated function gets a cache_info()-method
+    returning hits, misses, evictions, size and bytes,
+    and a cache_clear()-method.
+    """
+    if f is None:
+        return lambda f: memoize(f, maxsize=maxsize, maxbytes=maxbytes)
+
+    cache = OrderedDict()
+    info = dict(hits=0, misses=0, evictions=0, bytes=0)
+
+    def nbytes(value):
+        return getattr(value, "nbytes", 0)
+
     @wraps(f)
     def _d(*a, **k):
-        key = a, tuple((key, value) for key, value in k.iteritems())
-        if key not in f._cache:
-           f._cache[key] = f(*a, **k)
-        return f._cache[key]
-
-    f._cache = {}
+        key = a, tuple(sorted(k.iteritems()))
+        try:
+            # re-inserted below, making it the most recent
+            value = cache.pop(key)
+            info["hits"] += 1
+        except KeyError:
+            info["misses"] += 1
+            value = f(*a, **k)
+            info["bytes"] += nbytes(value)
+        cache[key] = value
+
+        while len(cache) > 1 and (
+                (maxsize is not None and len(cache) > maxsize)
+                or (maxbytes is not None and info["bytes"] > maxbytes)
+        ):
+            _, evicted = cache.popitem(last=False)
+            info["bytes"] -= nbytes(evicted)
+            info["evictions"] += 1
+        return value
+
+
+    def cache_info():
+        return dict(info, size=len(cache))
+
+
+    def cache_clear():
+        cache.clear()
+        info.update(hits=0, misses=0, evictions=0, bytes=0)
+
+
+    _d.cache_info = cache_info
+    _d.cache_clear = cache_clear
     return _d
 
 
@@ -67,18 +120,74 @@ def colorbar():
 
 
 class RevolutionFilter(object):
+    """
+    Filters are fed one value at a time, and
+    return their output. They can be chained with
+    the |-operator.
+
+    The optional timestamp is passed along the
+    chain for filters that measure rates.
+
+    The state of a filter can be stored and restored
+    as JSON-compatible dictionary.
+    """
+
+    def state(self):
+        return {}
+
+
+    def restore(self, state):
+        pass
+
+
+    def feed_many(self, inputs, timestamps=None):
+        """
+        Feeds all inputs in order, and returns an array
+        of the outputs - the same as calling feed for each.
+
+        Subclasses override this with faster versions.
+        """
+        feed = self.feed
+        if timestamps is None:
+            return np.array([feed(input_) for input_ in inputs])
+        return np.array([
+            feed(input_, timestamp)
+            for input_, timestamp in zip(inputs, timestamps)
+        ])
+
 
     def __or__(self, other):
         left = self
         right = other
         class Piped(RevolutionFilter):
 
-            def feed(self, input_):
-                return right.feed(left.feed(input_))
+            def feed(self, input_, timestamp=None):
+                return right.feed(left.feed(input_, timestamp), timestamp)
+
+
+            def feed_many(self, inputs, timestamps=None):
+                return right.feed_many(
+                    left.feed_many(inputs, timestamps),
+                    timestamps,
+                )
+
+
+            def state(self):
+                return dict(left=left.state(), right=right.state())
+
+
+            def restore(self, state):
+                left.restore(state["left"])
+                right.restore(state["right"])
 
 
             def __getattr__(self, name):
-                return getattr(right, name)
+                # the last filter wins, but we can reach
+                # the state of all of them
+                try:
+                    return getattr(right, name)
+                except AttributeError:
+                    return getattr(left, name)
 
 
         return Piped()
@@ -102,7 +211,24 @@ class RevolutionCounter(RevolutionFilter):
         self._in_quadrant = True
 
 
-    def feed(self, input_):
+    def state(self):
+        return dict(
+            revolutions=int(self.revolutions),
+            initial_quadrant=(
+                None if self._initial_quadrant is None
+                else int(self._initial_quadrant)
+            ),
+            in_quadrant=bool(self._in_quadrant),
+        )
+
+
+    def restore(self, state):
+        self.revolutions = state["revolutions"]
+        self._initial_quadrant = state["initial_quadrant"]
+        self._in_quadrant = state["in_quadrant"]
+
+
+    def feed(self, input_, timestamp=None):
         q = self._quadrant(input_)
         if self._initial_quadrant is None:
             self._initial_quadrant = q
@@ -116,6 +242,29 @@ class RevolutionCounter(RevolutionFilter):
         return self.revolutions
 
 
+    def feed_many(self, inputs, timestamps=None):
+        inputs = np.asarray(inputs, dtype=float)
+        if not len(inputs):
+            return np.empty(0, dtype=int)
+
+        q = self._quadrants(inputs)
+        if self._initial_quadrant is None:
+            self._initial_quadrant = q[0]
+            self._in_quadrant = True
+
+        # after each step, we are in the quadrant exactly
+        # if the input is, and we count each re-entering
+        inside = q == self._initial_quadrant
+        before = np.empty_like(inside)
+        before[0] = self._in_quadrant
+        before[1:] = inside[:-1]
+        res = self.revolutions + np.cumsum(inside & ~before)
+
+        self.revolutions = int(res[-1])
+        self._in_quadrant = bool(inside[-1])
+        return res
+
+
     def _quadrant(self, input_):
         """
         1 | 0
@@ -128,15 +277,40 @@ class RevolutionCounter(RevolutionFilter):
             return 2 if input_ < -math.pi / 2 else 3
 
 
+    def _quadrants(self, inputs):
+        return np.where(
+            inputs >= 0,
+            np.where(inputs < math.pi / 2, 0, 1),
+            np.where(inputs < -math.pi / 2, 2, 3),
+        )
+
+
 class Atan2Monotizer(RevolutionFilter):
 
     def __init__(self, clockwise=True):
         self._last_input = None
         self._v = None
+        self._clockwise = clockwise
         self._op = operator.le if clockwise else operator.ge
 
 
-    def feed(self, input_):
+    def state(self):
+        return dict(last_input=self._last_input)
+
+
+    def restore(self, state):
+        self._last_input = state["last_input"]
+
+
+    @property
+    def value(self):
+        """
+        The last accepted input, or None
+        """
+        return self._last_input
+
+
+    def feed(self, input_, timestamp=None):
         if self._last_input is not None:
             diff = input_ - self._last_input
             while diff > math.pi / 2.0:
@@ -150,3 +324,132 @@ class Atan2Monotizer(RevolutionFilter):
             self._last_input = input_
 
         return self._last_input
+
+
+    def feed_many(self, inputs, timestamps=None):
+        # each step depends on the last accepted input,
+        # so this is the loop from feed without the
+        # attribute and method lookups
+        res = np.empty(len(inputs))
+        last = self._last_input
+        clockwise = self._clockwise
+        half_pi = math.pi / 2.0
+        pi = math.pi
+        for i, input_ in enumerate(np.asarray(inputs, dtype=float).tolist()):
+            if last is not None:
+                diff = input_ - last
+                while diff > half_pi:
+                    diff -= pi
+                while diff < -half_pi:
+                    diff += pi
+
+                if (diff <= 0) if clockwise else (diff >= 0):
+                    last = input_
+            else:
+                last = input_
+            res[i] = last
+
+        self._last_input = last
+        return res
+
+
+class FlowEstimator(RevolutionFilter):
+    """
+    Passes the (monotized) atan2-values through, and
+    keeps track of the fractional revolutions since
+    the first input in position, and the flow in
+    revolutions per second.
+
+    The flow is an exponential moving average of
+    the rates between consecutive inputs. As those
+    don't come in regular intervals, the weight of
+    each rate depends on the time passed, with
+    time_constant being the time until an old rate
+    has decayed to 1/e.
+
+    feed uses default_timer for inputs without a
+    timestamp. feed_many can't, a batch fed at once
+    would all get the same, so it needs timestamps.
+    """
+
+    def __init__(self, clockwise=True, time_constant=5.0):
+        self.position = 0.0
+        self.flow = None
+        self._sign = -1.0 if clockwise else 1.0
+        self._time_constant = time_constant
+        self._last_input = None
+        self._last_timestamp = None
+
+
+    def state(self):
+        # timestamps don't survive a restart, so
+        # we only keep where the hand was
+        return dict(
+            position=self.position,
+            flow=self.flow,
+            last_input=self._last_input,
+        )
+
+
+    def restore(self, state):
+        self.position = state["position"]
+        self.flow = state["flow"]
+        self._last_input = state["last_input"]
+        self._last_timestamp = None
+
+
+    def feed(self, input_, timestamp=None):
+        if timestamp is None:
+            timestamp = default_timer()
+        if self._last_input is not None:
+            diff = input_ - self._last_input
+            # the shortest way around the circle
+            diff = (diff + math.pi) % (2 * math.pi) - math.pi
+            step = self._sign * diff / (2 * math.pi)
+            self.position += step
+            if self._last_timestamp is not None:
+                self._update_flow(step, timestamp - self._last_timestamp)
+        self._last_input = input_
+        self._last_timestamp = timestamp
+        return input_
+
+
+    def _update_flow(self, step, elapsed):
+        if elapsed <= 0:
+            return
+        rate = step / elapsed
+        if self.flow is None:
+            self.flow = rate
+        else:
+            alpha = 1.0 - math.exp(-elapsed / self._time_constant)
+            self.flow += (rate - self.flow) * alpha
+
+
+    def feed_many(self, inputs, timestamps=None):
+        inputs = np.asarray(inputs, dtype=float)
+        if not len(inputs):
+            return inputs
+        if timestamps is None:
+            raise ValueError("FlowEstimator.feed_many needs timestamps")
+        timestamps = np.asarray(timestamps, dtype=float)
+
+        if self._last_input is None:
+            self._last_input = inputs[0]
+        if self._last_timestamp is None:
+            # no rate for the first step, as in feed
+            self._last_timestamp = timestamps[0]
+        diffs = np.diff(np.concatenate([[self._last_input], inputs]))
+        diffs = (diffs + math.pi) % (2 * math.pi) - math.pi
+        steps = self._sign * diffs / (2 * math.pi)
+        elapsed = np.diff(np.concatenate([[self._last_timestamp], timestamps]))
+        # summing up one by one keeps us identical to feed
+        position = self.position
+        update_flow = self._update_flow
+        for step, dt in zip(steps.tolist(), elapsed.tolist()):
+            position += step
+            update_flow(step, dt)
+
+        self.position = position
+        self._last_input = float(inputs[-1])
+        self._last_timestamp = float(timestamps[-1])
+        return inputs
@@ -1,2 +1,39 @@
-from .calibration import calibration
-from .base import wasserzaehler
+"""
+The console scripts live in their own modules, which
+are only imported when a script is invoked - so e.g.
+the headless wasserzaehler doesn't load the GUI or
+the multiprocessing machinery.
+
+The entry points don't share their names with the
+submodules, importing those would replace them.
+"""
+
+
+def calibration_main():
+    from .calibration import calibration
+    return calibration()
+
+
+def autocalibration_main():
+    from .autocalibration import autocalibration
+    return autocalibration()
+
+
+def wasserzaehler_main():
+    from .base import wasserzaehler
+    return wasserzaehler()
+
+
+def batch_main():
+    from .batch import batch
+    return batch()
+
+
+def benchmark_main():
+    from .benchmark import benchmark
+    return benchmark()
+
+
+def replay_angles_main():
+    from .anglelog import replay_angles
+    return replay_angles()
@@ -0,0 +1,208 @@
+"""
+A compact, append-only log of the hand directions.
+
+The file starts with a fixed header, followed by
+fixed-size records of
+
+  timestamp (float64), angle (float64), meter index (uint16)
+
+in little endian, without padding. The angle is NaN if
+no hand was found in a processed frame. The records can
+be memory-mapped directly with RECORD as dtype.
+"""
+import os
+import sys
+import json
+import atexit
+import argparse
+from timeit import default_timer
+
+import numpy as np
+
+from ..opencv import (
+    Atan2Monotizer,
+    FlowEstimator,
+    RevolutionCounter,
+)
+
+
+MAGIC = "BQANGLE1"
+HEADER_SIZE = 16
+HEADER = MAGIC.ljust(HEADER_SIZE, "\0")
+
+RECORD = np.dtype([
+    ("timestamp", "<f8"),
+    ("angle", "<f8"),
+    ("meter", "<u2"),
+])
+
+
+class AngleLogError(Exception):
+    pass
+
+
+def _check_header(inf):
+    if inf.read(HEADER_SIZE) != HEADER:
+        raise AngleLogError("%s is no angle log" % inf.name)
+
+
+class AngleLogWriter(object):
+    """
+    Appends records to an angle log, creating it
+    if necessary. Records are buffered, and written
+    in chunks of buffer_size - or after flush_interval
+    seconds, so a crash loses only little. Whatever is
+    buffered at exit is written, too.
+
+    A trailing partial record, e.g. from a crash
+    while writing, is cut off when opening the log.
+    """
+
+    def __init__(self, filename, buffer_size=1024, flush_interval=1.0):
+        size = os.path.getsize(filename) if os.path.exists(filename) else 0
+        if size:
+            with open(filename, "rb") as inf:
+                _check_header(inf)
+            complete = HEADER_SIZE + (size - HEADER_SIZE) // RECORD.itemsize * RECORD.itemsize
+            self._file = open(filename, "r+b")
+            self._file.truncate(complete)
+            self._file.seek(complete)
+        else:
+            self._file = open(filename, "wb")
+            self._file.write(HEADER)
+
+        self._buffer = np.zeros(buffer_size, dtype=RECORD)
+        self._count = 0
+        self._flush_interval = flush_interval
+        self._flushed = default_timer()
+        atexit.register(self.close)
+
+
+    def write(self, timestamp, angle, meter=0):
+        record = self._buffer[self._count]
+        record["timestamp"] = timestamp
+        record["angle"] = np.nan if angle is None else angle
+        record["meter"] = meter
+        self._count += 1
+        if (
+            self._count == len(self._buffer) or
+            default_timer() - self._flushed >= self._flush_interval
+        ):
+            self.flush()
+
+
+    def flush(self):
+        self._file.write(self._buffer[:self._count].tostring())
+        self._file.flush()
+        self._count = 0
+        self._flushed = default_timer()
+
+
+    def close(self):
+        if self._file.closed:
+            return
+        self.flush()
+        self._file.close()
+
+
+def read_angle_log(filename):
+    """
+    Returns the records of the log as
+    read-only memory-mapped array.
+    """
+    with open(filename, "rb") as inf:
+        _check_header(inf)
+    count = (os.path.getsize(filename) - HEADER_SIZE) // RECORD.itemsize
+    if not count:
+        return np.zeros(0, dtype=RECORD)
+    return np.memmap(
+        filename,
+        dtype=RECORD,
+        mode="r",
+        offset=HEADER_SIZE,
+        shape=(count,),
+    )
+
+
+def angles(records, meter=0):
+    """
+    The records of the meter where
+    a hand was found.
+    """
+    records = records[records["meter"] == meter]
+    return records[~np.isnan(records["angle"])]
+
+
+def replay(records, revolution_filter, meter=0):
+    """
+    Feeds the angles of the meter through the
+    revolution filter chain, and returns its outputs.
+    """
+    records = angles(records, meter)
+    return revolution_filter.feed_many(records["angle"], records["timestamp"])
+
+
+# the filters the replay tool can combine
+FILTERS = {
+    "monotizer" : lambda opts: Atan2Monotizer(clockwise=not opts.counterclockwise),
+    "flow" : lambda opts: FlowEstimator(
+        clockwise=not opts.counterclockwise,
+        time_constant=opts.time_constant,
+    ),
+    "counter" : lambda opts: RevolutionCounter(),
+}
+
+
+def replay_angles():
+    parser = argparse.ArgumentParser(
+        description="Replay an angle log through a revolution filter chain",
+    )
+    parser.add_argument("log")
+    parser.add_argument(
+        "--meter",
+        type=int,
+        default=0,
+        help="The index of the meter to replay",
+    )
+    parser.add_argument(
+        "--chain",
+        default="monotizer,flow,counter",
+        help="Comma-separated filters, out of %s" % ", ".join(sorted(FILTERS)),
+    )
+    parser.add_argument(
+        "--counterclockwise",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--time-constant",
+        type=float,
+        default=5.0,
+        help="Smoothing of the flow filter, in seconds",
+    )
+    opts = parser.parse_args()
+
+    names = opts.chain.split(",")
+    for name in names:
+        if name not in FILTERS:
+            parser.error("unknown filter %r" % name)
+    revolution_filter = reduce(
+        lambda left, right: left | right,
+        [FILTERS[name](opts) for name in names],
+    )
+
+    records = read_angle_log(opts.log)
+    started = default_timer()
+    output = replay(records, revolution_filter, opts.meter)
+    elapsed = default_timer() - started
+
+    res = dict(
+        samples=len(output),
+        seconds=elapsed,
+        output=output[-1].item() if len(output) else None,
+    )
+    for name in ("revolutions", "position", "flow"):
+        value = getattr(revolution_filter, name, None)
+        if value is not None:
+            res[name] = value
+    json.dump(res, sys.stdout, sort_keys=True)
+    print
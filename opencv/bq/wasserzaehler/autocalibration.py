@@ -0,0 +1,330 @@
+"""
+Finds the settings of a meter in sample footage,
+without anybody dragging trackbars.
+
+The candidates are derived from the footage:
+
+ - pixels which change over the sample frames are
+   where the hand moves
+ - the hue histogram of these pixels tells us which
+   hue ranges are worth trying
+ - the area where the pixels of a hue range come
+   and go is the ROI
+
+Each candidate is run over the sample frames by a
+pool of worker processes, and scored by how stable
+the detected hand direction is.
+
+To save memory, only the region around the moving
+pixels of the sample frames is kept for all that.
+"""
+import sys
+import json
+import math
+import argparse
+import itertools
+import multiprocessing
+
+import cv2
+import numpy as np
+
+from ..opencv import (
+    Bunch,
+    cv2_3,
+)
+
+from .base import (
+    DEFAULT_SETTINGS,
+    RoiPipeline,
+    arrow_direction,
+    create_color_corrected_roi,
+    dump_meter_settings,
+    load_settings,
+)
+
+
+# consecutive directions farther apart count as
+# jump, half of what the RevolutionCounter copes with
+MAX_STEP = math.pi / 4
+
+
+def sample_frames(movie, count, start=0, stride=1):
+    capture = cv2.VideoCapture(movie)
+    frames = []
+    try:
+        if start:
+            capture.set(cv2_3.CAP_PROP_POS_FRAMES, start)
+        while len(frames) < count:
+            grabbed, frame = capture.read()
+            if not grabbed:
+                break
+            frames.append(frame)
+            for _ in xrange(stride - 1):
+                capture.grab()
+    finally:
+        capture.release()
+    return frames
+
+
+def hsv_frames(frames, s):
+    """
+    The color corrected frames in HSV, as one
+    array of shape (frames, height, width, 3).
+    """
+    height, width = frames[0].shape[:2]
+    whole = Bunch(**dict(s.dict(), left=0, top=0, width=width, height=height))
+    return np.array([create_color_corrected_roi(frame, whole) for frame in frames])
+
+
+def moving_pixels(frames, min_std=10.0):
+    """
+    A mask of the pixels whose brightness
+    varies over the frames.
+    """
+    # running sums, so we don't need all frames in gray
+    total = squares = None
+    for frame in frames:
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY).astype(float)
+        if total is None:
+            total = np.zeros(gray.shape)
+            squares = np.zeros(gray.shape)
+        total += gray
+        squares += gray * gray
+    mean = total / len(frames)
+    return squares / len(frames) - mean * mean >= min_std ** 2
+
+
+def hue_in_range(hue, Hlow, Hhigh):
+    """
+    Like filter_for_color_range, a range
+    with Hlow above Hhigh wraps around 0.
+    """
+    if Hlow <= Hhigh:
+        return (hue >= Hlow) & (hue <= Hhigh)
+    return (hue >= Hlow) | (hue <= Hhigh)
+
+
+def hue_peaks(hsv, mask, min_saturation=64, min_value=64, count=3, distance=10):
+    """
+    The most frequent hues of the saturated, bright
+    pixels within the mask, at least distance apart.
+    """
+    pixels = hsv[:, mask]
+    pixels = pixels[
+        (pixels[..., 1] >= min_saturation) & (pixels[..., 2] >= min_value)
+    ]
+    histogram = np.bincount(pixels[:, 0], minlength=180).astype(float)
+    # hue is circular
+    kernel = np.ones(5)
+    padded = np.concatenate([histogram[-2:], histogram, histogram[:2]])
+    histogram = np.convolve(padded, kernel, mode="valid")
+
+    peaks = []
+    for hue in np.argsort(histogram)[::-1]:
+        if not histogram[hue] or len(peaks) == count:
+            break
+        if all(min(abs(hue - p), 180 - abs(hue - p)) >= distance for p in peaks):
+            peaks.append(int(hue))
+    return peaks
+
+
+def sweep_roi(in_range, margin=0.1):
+    """
+    The bounding box (left, top, width, height) of
+    the pixels which are in range in some, but not
+    all frames - or None if there are none.
+    """
+    return bounding_box(in_range.any(axis=0) & ~in_range.all(axis=0), margin)
+
+
+def bounding_box(mask, margin=0.1):
+    """
+    The bounding box (left, top, width, height) of the
+    mask, enlarged by margin on each side - or None if
+    the mask is empty.
+    """
+    rows = np.flatnonzero(mask.any(axis=1))
+    columns = np.flatnonzero(mask.any(axis=0))
+    if not len(rows):
+        return None
+    height, width = mask.shape
+    pad_y = int((rows[-1] - rows[0] + 1) * margin)
+    pad_x = int((columns[-1] - columns[0] + 1) * margin)
+    top = max(0, rows[0] - pad_y)
+    left = max(0, columns[0] - pad_x)
+    bottom = min(height, rows[-1] + 1 + pad_y)
+    right = min(width, columns[-1] + 1 + pad_x)
+    return int(left), int(top), int(right - left), int(bottom - top)
+
+
+def candidates(
+        frames,
+        s,
+        moving=None,
+        hue_widths=(5, 10),
+        saturations=(64, 128),
+        values=(64, 128),
+        blurs=(3, 5),
+):
+    """
+    Generates settings to try, based on s.
+    """
+    hsv = hsv_frames(frames, s)
+    if moving is None:
+        moving = moving_pixels(frames)
+    if not moving.any():
+        moving = np.ones(moving.shape, dtype=bool)
+
+    hue, saturation, value = hsv[..., 0], hsv[..., 1], hsv[..., 2]
+    for peak in hue_peaks(hsv, moving):
+        for width, Slow, Vlow in itertools.product(hue_widths, saturations, values):
+            Hlow, Hhigh = (peak - width) % 180, (peak + width) % 180
+            in_range = (
+                hue_in_range(hue, Hlow, Hhigh) &
+                (saturation >= Slow) & (value >= Vlow)
+            )
+            roi = sweep_roi(in_range)
+            if roi is None:
+                continue
+            left, top, roi_width, roi_height = roi
+            for blur in blurs:
+                yield dict(
+                    s.dict(),
+                    Hlow=Hlow, Hhigh=Hhigh,
+                    hue_wrap=Hlow > Hhigh,
+                    Slow=Slow, Shigh=255,
+                    Vlow=Vlow, Vhigh=255,
+                    left=left, top=top,
+                    width=roi_width, height=roi_height,
+                    blur=blur,
+                )
+
+
+def stability(directions):
+    """
+    The fraction of frames with a direction,
+    reduced by the fraction of jumps between
+    consecutive directions.
+    """
+    directions = np.asarray(directions, dtype=float)
+    if not len(directions):
+        return 0.0
+    found = ~np.isnan(directions)
+    steps = np.diff(directions)
+    steps = steps[~np.isnan(steps)]
+    steps = np.abs(np.arctan2(np.sin(steps), np.cos(steps)))
+    jumps = float(np.sum(steps > MAX_STEP)) / len(steps) if len(steps) else 0.0
+    return found.mean() * (1.0 - jumps)
+
+
+# the sample frames, shared with the worker processes
+_frames = None
+
+
+def _init_worker(frames):
+    global _frames
+    _frames = frames
+
+
+def score(d):
+    s = Bunch(**d)
+    pipeline = RoiPipeline()
+    directions = []
+    for frame in _frames:
+        roi = pipeline.color_corrected_roi(frame, s)
+        roi = pipeline.color_range_filtered(roi, s)
+        res = arrow_direction(pipeline.shapes(roi, s), s)
+        directions.append(float("nan") if res is None else res[0])
+    return stability(directions), d
+
+
+def calibrate(frames, s, processes=None, margin=0.2):
+    """
+    Returns the best settings for the frames
+    and their score, or None if there aren't
+    any candidates.
+
+    Only the region where pixels move, enlarged
+    by margin, is kept of the frames.
+    """
+    moving = moving_pixels(frames)
+    height, width = moving.shape
+    left, top, width, height = bounding_box(moving, margin) or (0, 0, width, height)
+    region = slice(top, top + height), slice(left, left + width)
+    # copies, so the full frames can go
+    frames = [np.ascontiguousarray(frame[region]) for frame in frames]
+    moving = moving[region]
+
+    pool = multiprocessing.Pool(
+        processes=processes,
+        initializer=_init_worker,
+        initargs=(frames,),
+    )
+    try:
+        best = None
+        for res, d in pool.imap_unordered(score, candidates(frames, s, moving)):
+            # on a tie, the smaller ROI is less
+            # likely to pick up something else
+            key = (res, -d["width"] * d["height"])
+            if best is None or key > best[0]:
+                best = key, d
+    finally:
+        pool.terminate()
+    if best is None:
+        return None
+    (res, _), d = best
+    d.update(left=d["left"] + left, top=d["top"] + top)
+    return Bunch(**d), res
+
+
+def autocalibration():
+    parser = argparse.ArgumentParser(
+        description="Find the settings for a meter in a movie",
+    )
+    parser.add_argument("movie")
+    parser.add_argument(
+        "--settings",
+        help="Settings to start from, e.g. for the color correction",
+    )
+    parser.add_argument(
+        "--frames",
+        type=int,
+        default=60,
+        help="Number of sample frames",
+    )
+    parser.add_argument(
+        "--start",
+        type=int,
+        default=0,
+        help="Frame to start sampling at",
+    )
+    parser.add_argument(
+        "--stride",
+        type=int,
+        default=1,
+        help="Only sample every STRIDE-th frame. The hand should "
+        "move less than an eighth of a revolution in between",
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        help="Number of worker processes, defaults to the number of cores",
+    )
+    opts = parser.parse_args()
+
+    if opts.settings is not None:
+        s = load_settings(opts.settings)
+    else:
+        s = Bunch(**DEFAULT_SETTINGS)
+
+    frames = sample_frames(opts.movie, opts.frames, opts.start, opts.stride)
+    if not frames:
+        parser.error("no frames in %s" % opts.movie)
+    res = calibrate(frames, s, opts.processes)
+    if res is None:
+        print >> sys.stderr, "no hand found"
+        sys.exit(1)
+
+    s, stable = res
+    print >> sys.stderr, "stability: %.3f" % stable
+    print json.dumps(dump_meter_settings([(None, s)]))
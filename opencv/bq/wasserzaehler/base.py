@@ -11,6 +11,7 @@ from ..opencv import (
     cv2_3,
     GenericInput,
     Atan2Monotizer,
+    FlowEstimator,
     RevolutionCounter,
 )
 
@@ -18,6 +19,9 @@ from ..opencv import (
 DEFAULT_SETTINGS = {
     "Hhigh" : 0,
     "Hlow" : 0,
+    # whether Hlow above Hhigh wraps around 0, see
+    # filter_for_color_range
+    "hue_wrap" : False,
     "Shigh" : 0,
     "Slow" : 0,
     "Vhigh" : 0,
@@ -29,10 +33,17 @@ DEFAULT_SETTINGS = {
     "cH" : 0,
     "blur" : 3,
     "cmix" : 0,
+    # how to find the arrow, see DIRECTION_ESTIMATORS
+    "direction" : "contours",
+    # skip unchanged frames, see MotionGate
+    "motion_threshold" : 0,
+    "motion_refresh" : 30,
+    "motion_scale" : 4,
 }
 
 
-@memoize
+# one for each meter, plus some slack for the calibration
+@memoize(maxsize=16)
 def complementary_image(H, shape):
     res = np.zeros(shape, dtype="uint8")
     res[:,:,0] = H
@@ -40,58 +51,326 @@ def complementary_image(H, shape):
     return cv2.cvtColor(res, cv2.COLOR_HSV2BGR)
 
 
-def create_color_corrected_roi(frame, s):
+def roi_of(frame, s):
+    return frame[s.top:s.top + s.height, s.left:s.left + s.width]
+
+
+def create_color_corrected_roi(frame, s, blended=None, hsv=None):
     """
     Cuts out the ROI, and potentially blends
-    it with the color correction
+    it with the color correction.
+
+    The optional blended and hsv arrays are used
+    as output buffers if given.
     """
-    roi = frame[s.top:s.top + s.height, s.left:s.left + s.width]
+    roi = roi_of(frame, s)
 
     if s.cmix > 0:
         comp_img = complementary_image(s.cH, roi.shape)
-        roi = cv2.addWeighted(roi, 1.0 - s.cmix, comp_img, s.cmix, 0)
+        roi = cv2.addWeighted(roi, 1.0 - s.cmix, comp_img, s.cmix, 0, blended)
 
-    return cv2.cvtColor(roi, cv2.COLOR_BGR2HSV)
+    return cv2.cvtColor(roi, cv2.COLOR_BGR2HSV, hsv)
 
 
-@memoize
+@memoize(maxsize=256)
 def range_array(*a):
     return np.array(a, dtype="uint8")
 
 
-def filter_for_color_range(roi, s):
+def filter_for_color_range(roi, s, mask=None):
+    """
+    Hue is circular, so with hue_wrap and Hlow above
+    Hhigh the range wraps around 0 - e.g. 170 to 10 for
+    red - and is split into Hlow to 179 and 0 to Hhigh.
+    Without hue_wrap, such a range matches nothing, as
+    it always did.
+    """
     lower = range_array(s.Hlow, s.Slow, s.Vlow)
     upper = range_array(s.Hhigh, s.Shigh, s.Vhigh)
-    return cv2.inRange(roi, lower, upper)
+    if s.Hlow <= s.Hhigh or not s.hue_wrap:
+        return cv2.inRange(roi, lower, upper, mask)
+    mask = cv2.inRange(roi, lower, range_array(179, s.Shigh, s.Vhigh), mask)
+    return cv2.bitwise_or(
+        mask,
+        cv2.inRange(roi, range_array(0, s.Slow, s.Vlow), upper),
+        mask,
+    )
+
 
+def blur_mask(roi, s, blurred=None):
+    return cv2.GaussianBlur(roi, (s.blur, s.blur), 0, blurred)
 
-def find_contours(roi, s):
-    roi = cv2.GaussianBlur(roi, (s.blur, s.blur), 0)
 
+def external_contours(roi):
+    """
+    Careful: older OpenCV versions modify
+    the roi while finding the contours.
+    """
     _, contours, _ = cv2_3.findContours(
-        roi.copy(),
+        roi,
         cv2.RETR_EXTERNAL,
         cv2.CHAIN_APPROX_SIMPLE
     )
     return contours
 
 
-class Wasserzaehler(GenericInput):
+def find_contours(roi, s, blurred=None):
+    """
+    Blurs the mask and finds the external contours.
 
-    def __init__(self, *a, **k):
-        super(Wasserzaehler, self).__init__(*a, **k)
-        self._revolution_filter = Atan2Monotizer() | RevolutionCounter()
-        self._settings = Bunch(**DEFAULT_SETTINGS)
-        if self.opts.settings is not None:
-            with open(self.opts.settings) as inf:
-                self._settings = Bunch(**json.load(inf))
+    If blurred is given, it is used as scratch
+    buffer. The mask itself is left untouched.
+    """
+    return external_contours(blur_mask(roi, s, blurred))
 
-        self._last_revolution = -1
 
+def find_arrow_direction(contours):
+    """
+    Takes the contour with the biggest enclosing
+    circle, and returns the direction from its centroid
+    to the circle center, together with the circle
+    and the centroid.
+
+    Returns None if the contour has no area.
+    """
+    contours = [
+        # return ((cx, cy), radius)
+        (cv2.minEnclosingCircle(contour), contour)
+        for contour in contours
+    ]
+    # only take the biggest one, based on circle radius
+    contours.sort(key=lambda c: c[0][1])
+    ((ecx, ecy), radius), contour = contours[-1]
+    M = cv2.moments(contour)
+
+    if M['m00']:
+        cx = int(M['m10']/M['m00'])
+        cy = int(M['m01']/M['m00'])
+        return (
+            math.atan2(ecy - cy, ecx - cx),
+            ((ecx, ecy), radius),
+            (cx, cy),
+        )
+
+
+class Components(object):
+    """
+    The connected components of a mask, without
+    the background. Component i has the label i + 1.
+    """
+
+    def __init__(self, labels, stats, centroids):
+        self.labels = labels
+        self.stats = stats
+        self.centroids = centroids
+
+
+    def __len__(self):
+        return len(self.stats)
+
+
+def find_components(roi):
+    _, labels, stats, centroids = cv2.connectedComponentsWithStats(roi)
+    return Components(labels, stats[1:], centroids[1:])
+
+
+def find_arrow_direction_in_components(components):
+    """
+    Like find_arrow_direction, but works on the
+    biggest connected component of the mask, using
+    NumPy instead of a loop over all contours.
+
+    The enclosing circle is approximated by the two
+    pixels farthest apart: the one farthest from the
+    centroid, and the one farthest from that.
+    """
+    areas = components.stats[:, cv2.CC_STAT_AREA]
+    index = int(np.argmax(areas))
+    cx, cy = components.centroids[index]
+    left, top, width, height = components.stats[index, :4]
+
+    blob = components.labels[top:top + height, left:left + width] == index + 1
+    ys, xs = np.nonzero(blob)
+    xs = xs + left
+    ys = ys + top
+
+    first = np.argmax((xs - cx) ** 2 + (ys - cy) ** 2)
+    fx, fy = xs[first], ys[first]
+    distances = (xs - fx) ** 2 + (ys - fy) ** 2
+    second = np.argmax(distances)
+    ecx = (fx + xs[second]) / 2.0
+    ecy = (fy + ys[second]) / 2.0
+    radius = math.sqrt(distances[second]) / 2.0
+
+    return (
+        math.atan2(ecy - cy, ecx - cx),
+        ((ecx, ecy), radius),
+        (int(cx), int(cy)),
+    )
+
+
+# the settings "direction" chooses how to find
+# the shapes in the mask, and the arrow within them
+DIRECTION_ESTIMATORS = {
+    "contours" : ("found_contours", find_arrow_direction),
+    "components" : ("found_components", find_arrow_direction_in_components),
+}
+
+
+def arrow_direction(shapes, s):
+    """
+    Returns (direction, circle, centroid) for
+    the shapes found by RoiPipeline.shapes,
+    or None.
+    """
+    if len(shapes) > 0:
+        _, estimator = DIRECTION_ESTIMATORS[s.direction]
+        return estimator(shapes)
+
+
+def load_settings(filename):
+    """
+    Loads the settings, with defaults
+    for anything not given.
+    """
+    with open(filename) as inf:
+        return Bunch(**dict(DEFAULT_SETTINGS, **json.load(inf)))
+
+
+def meter_settings(d):
+    """
+    Returns a list of (name, settings) for the
+    meters described by the settings dictionary d.
+
+    This is either the plain settings of a single
+    meter (with the name None), or
+
+        {"meters": [{"name": "cold", ...}, {"name": "hot", ...}]}
+
+    where all other top-level keys are used as
+    defaults for the individual meters.
+    """
+    d = dict(DEFAULT_SETTINGS, **d)
+    meters = d.pop("meters", None)
+    if meters is None:
+        d.pop("name", None)
+        return [(None, Bunch(**d))]
+
+    res = []
+    for i, meter in enumerate(meters):
+        meter = dict(d, **meter)
+        name = meter.pop("name", "meter%i" % i)
+        res.append((name, Bunch(**meter)))
+    return res
+
+
+def load_meter_settings(filename):
+    with open(filename) as inf:
+        return meter_settings(json.load(inf))
+
+
+def dump_meter_settings(meters):
+    """
+    The inverse of meter_settings.
+    """
+    if len(meters) == 1 and meters[0][0] is None:
+        return meters[0][1].dict()
+    return {
+        "meters" : [
+            dict(s.dict(), name=name)
+            for name, s in meters
+        ]
+    }
+
+
+class RoiPipeline(object):
+    """
+    Runs the ROI-processing steps, but owns
+    the intermediate images so they are
+    only allocated when the ROI geometry
+    changes, not for every frame.
+
+    The results returned are only valid
+    until the next frame is processed.
+    """
+
+    def __init__(self):
+        self._shape = None
+
+
+    def _ensure_buffers(self, frame, s):
+        # the ROI might be clipped by the frame
+        height = max(0, min(s.top + s.height, frame.shape[0]) - s.top)
+        width = max(0, min(s.left + s.width, frame.shape[1]) - s.left)
+        shape = (height, width)
+        if shape != self._shape:
+            self._shape = shape
+            self._blended = np.empty(shape + frame.shape[2:], dtype=frame.dtype)
+            self._hsv = np.empty(shape + frame.shape[2:], dtype="uint8")
+            self._mask = np.empty(shape, dtype="uint8")
+            self._blurred = np.empty(shape, dtype="uint8")
+
+
+    def color_corrected_roi(self, frame, s):
+        self._ensure_buffers(frame, s)
+        return create_color_corrected_roi(
+            frame, s,
+            blended=self._blended,
+            hsv=self._hsv,
+        )
+
+
+    def color_range_filtered(self, roi, s):
+        return filter_for_color_range(roi, s, mask=self._mask)
 
-    @property
-    def revolutions(self):
-        return self._revolution_filter.revolutions
+
+    def blurred(self, roi, s):
+        return blur_mask(roi, s, blurred=self._blurred)
+
+
+    def contours(self, roi, s):
+        return external_contours(self.blurred(roi, s))
+
+
+    def components(self, roi, s):
+        return find_components(self.blurred(roi, s))
+
+
+    def shapes(self, roi, s):
+        """
+        Either contours or components, depending
+        on the direction-setting.
+        """
+        if s.direction == "components":
+            return self.components(roi, s)
+        return self.contours(roi, s)
+
+
+class Meter(object):
+    """
+    One meter within the frame: its settings,
+    the processing pipeline and the revolution
+    filter chain.
+    """
+
+    def __init__(self, name, settings, index=0):
+        self.name = name
+        self.index = index
+        self.origin = (0, 0)
+        self.settings = settings
+        # the hand direction found in the last processed frame, or None
+        self.direction = None
+        self.pipeline = RoiPipeline()
+        # imported where needed, for a fast startup
+        from .motion import MotionGate
+        self.motion_gate = MotionGate()
+        self.monotizer = Atan2Monotizer()
+        self.flow_estimator = FlowEstimator()
+        self.revolution_filter = (
+            self.monotizer
+            | self.flow_estimator
+            | RevolutionCounter()
+        )
 
 
     @property
@@ -99,80 +378,323 @@ class Wasserzaehler(GenericInput):
         return self._settings
 
 
-    def setup(self, frame):
-        super(Wasserzaehler, self).setup(frame)
+    @settings.setter
+    def settings(self, settings):
+        self._settings = settings
+        self.translate(self.origin)
 
 
-    def augment_parser(self, parser):
-        super(Wasserzaehler, self).augment_parser(parser)
-        parser.add_argument(
-            "--settings",
-        )
+    def translate(self, origin):
+        """
+        If the frames are cropped, origin is their top-left
+        corner within the full picture the settings refer
+        to. The translated settings are computed once here,
+        not for every frame.
+        """
+        self.origin = origin
+        s = self._settings
+        if origin == (0, 0):
+            self._frame_settings = s
+        else:
+            self._frame_settings = Bunch(**dict(
+                s.dict(),
+                left=s.left - origin[0],
+                top=s.top - origin[1],
+            ))
 
 
-    def frame_callback(self, frame):
-        s = self.settings
-        roi = create_color_corrected_roi(frame, s)
+    @property
+    def revolutions(self):
+        return self.revolution_filter.revolutions
 
-        self.color_adjusted_roi(roi)
 
-        roi = filter_for_color_range(roi, s)
-        self.color_range_filtered_roi(roi)
-        contours = find_contours(roi, s)
-        self.found_contours(contours)
+    @property
+    def position(self):
+        """
+        The fractional revolutions since the first
+        direction was found
+        """
+        return self.flow_estimator.position
+
 
-        if len(contours) > 0:
-            direction = self.find_arrow_direction(contours)
-            self._revolution_filter.feed(direction)
+    @property
+    def flow(self):
+        """
+        The smoothed flow in revolutions per second, or None
+        """
+        return self.flow_estimator.flow
+
+
+    def process(self, frame, instrumentation, timestamp=None):
+        """
+        Processes the frame, and feeds the hand
+        direction into the revolution filter.
+
+        Returns False if the frame was skipped
+        because the ROI didn't change.
+        """
+        s = self._frame_settings
+        pipeline = self.pipeline
+
+        if not self.motion_gate.changed(roi_of(frame, s), s):
+            if instrumentation:
+                instrumentation.count("unchanged_frames")
+            return False
+
+        # only measure if anybody is interested
+        if instrumentation:
+            from .instrumentation import Lap
+            lap = Lap(instrumentation)
+
+        roi = pipeline.color_corrected_roi(frame, s)
+        if instrumentation:
+            lap("color_adjusted_roi", roi)
+
+        roi = pipeline.color_range_filtered(roi, s)
+        if instrumentation:
+            lap("color_range_filtered_roi", roi)
+
+        shapes = pipeline.shapes(roi, s)
+        if instrumentation:
+            stage, _ = DIRECTION_ESTIMATORS[s.direction]
+            lap(stage, shapes)
+
+        self.direction = None
+        res = arrow_direction(shapes, s)
+        if res is not None:
+            direction, circle, centroid = res
+            self.direction = direction
+            if instrumentation:
+                lap("enclosing_circle_and_centroid", (circle, centroid))
+            self.revolution_filter.feed(direction, timestamp)
+
+        if instrumentation:
+            lap.done()
+        return True
 
-        if self._last_revolution != self.revolutions:
-            self._last_revolution = self.revolutions
-            print self.revolutions
 
+class Wasserzaehler(GenericInput):
 
-    def find_arrow_direction(self, contours):
-        contours = [
-            # return ((cx, cy), radius)
-            (cv2.minEnclosingCircle(contour), contour)
-            for contour in contours
+    def __init__(self, *a, **k):
+        super(Wasserzaehler, self).__init__(*a, **k)
+        meters = [(None, Bunch(**DEFAULT_SETTINGS))]
+        if self.opts.settings is not None:
+            meters = load_meter_settings(self.opts.settings)
+        self.meters = [
+            Meter(name, s, index)
+            for index, (name, s) in enumerate(meters)
         ]
-        # only take the biggest one, based on circle radius
-        contours.sort(key=lambda c: c[0][1])
-        ((ecx, ecy), radius), contour = contours[-1]
-        M = cv2.moments(contour)
-
-        if M['m00']:
-            cx = int(M['m10']/M['m00'])
-            cy = int(M['m01']/M['m00'])
-
-            self.enclosing_circle_and_centroid(
-                ((ecx, ecy), radius),
-                (cx, cy)
+
+        self._last_revolutions = {}
+        self._last_reported = {}
+        # imported where needed, for a fast startup
+        from .instrumentation import Instrumentation, add_default_observers
+        from .sinks import create_sink
+        self.instrumentation = Instrumentation()
+        if self.opts.stats_interval is not None:
+            add_default_observers(
+                self.instrumentation,
+                self.opts.stats_interval,
+            )
+        self.angle_log = None
+        if self.opts.angle_log is not None:
+            from .anglelog import AngleLogWriter
+            self.angle_log = AngleLogWriter(self.opts.angle_log)
+        self.sinks = [create_sink(spec) for spec in self.opts.output or ["print"]]
+        self.checkpointer = None
+        if self.opts.checkpoint is not None:
+            from .checkpoint import Checkpointer, load_checkpoint
+            state = load_checkpoint(self.opts.checkpoint)
+            if state is not None:
+                self.restore(state)
+            self.checkpointer = Checkpointer(
+                self.opts.checkpoint,
+                self.opts.checkpoint_interval,
             )
-            return math.atan2(ecy - cy, ecx - cx)
 
 
-    # The following callbacks are for
-    # introspection into the processing.
-    #
-    # They aren't beautiful, but allow
-    # the Calibration to show meaningful states
-    # to tune the system.
+    @property
+    def revolutions(self):
+        """
+        The revolutions of the first meter
+        """
+        return self.meters[0].revolutions
 
-    def color_adjusted_roi(self, roi):
-        pass
 
+    @property
+    def settings(self):
+        """
+        The settings of the first meter
+        """
+        return self.meters[0].settings
+
+
+    @settings.setter
+    def settings(self, settings):
+        self.meters[0].settings = settings
+
+
+    def capture_region(self):
+        """
+        The bounding box of all meters
+        """
+        rois = [meter.settings for meter in self.meters]
+        left = min(s.left for s in rois)
+        top = min(s.top for s in rois)
+        return (
+            left,
+            top,
+            max(s.left + s.width for s in rois) - left,
+            max(s.top + s.height for s in rois) - top,
+        )
+
+
+    def open_capture(self, opts):
+        capture = super(Wasserzaehler, self).open_capture(opts)
+        for meter in self.meters:
+            meter.translate(self.frame_origin)
+        return capture
+
+
+    def settings_dict(self):
+        return dump_meter_settings([
+            (meter.name, meter.settings)
+            for meter in self.meters
+        ])
+
+
+    def setup(self, frame):
+        super(Wasserzaehler, self).setup(frame)
 
-    def color_range_filtered_roi(self, roi):
-        pass
+
+    def run(self):
+        try:
+            super(Wasserzaehler, self).run()
+        finally:
+            if self.angle_log is not None:
+                self.angle_log.close()
+            if self.checkpointer is not None:
+                self.checkpointer.close()
+            for sink in self.sinks:
+                sink.close()
+
+
+    def checkpoint_state(self):
+        return dict(meters=[
+            dict(name=meter.name, filter=meter.revolution_filter.state())
+            for meter in self.meters
+        ])
+
+
+    def restore(self, state):
+        """
+        Restores the filter state of the meters
+        found in the checkpoint state.
+        """
+        filters = dict(
+            (meter["name"], meter["filter"])
+            for meter in state["meters"]
+        )
+        for meter in self.meters:
+            if meter.name in filters:
+                meter.revolution_filter.restore(filters[meter.name])
+
+
+    def augment_parser(self, parser):
+        super(Wasserzaehler, self).augment_parser(parser)
+        parser.add_argument(
+            "--settings",
+        )
+        parser.add_argument(
+            "--stats-interval",
+            type=float,
+            help="Dump processing statistics as JSON to stderr every STATS_INTERVAL seconds",
+        )
+        parser.add_argument(
+            "--angle-log",
+            help="Append the timestamp and hand direction of each processed frame "
+            "to this file, see wasserzaehler-replay-angles",
+        )
+        parser.add_argument(
+            "--checkpoint",
+            help="Keep the revolutions in this file, and continue from "
+            "there after a restart",
+        )
+        parser.add_argument(
+            "--checkpoint-interval",
+            type=float,
+            default=60.0,
+            help="Write the --checkpoint at most every CHECKPOINT_INTERVAL seconds",
+        )
+        parser.add_argument(
+            "--output",
+            action="append",
+            help="Where to write the readings, can be given several times: "
+            "print (the default), json[:FILENAME], csv:FILENAME, "
+            "sqlite:FILENAME or socket:PATH",
+        )
+        parser.add_argument(
+            "--output-interval",
+            type=float,
+            help="Besides on each revolution, write the readings "
+            "every OUTPUT_INTERVAL seconds",
+        )
+
+
+    def frame_callback(self, frame):
+        # all meters share the decoded frame
+        for meter in self.meters:
+            self.process_meter(meter, frame)
+        if self.checkpointer is not None:
+            self.checkpointer.update(self.checkpoint_state())
+
+
+    def process_meter(self, meter, frame):
+        processed = meter.process(
+            frame,
+            self.instrumentation,
+            self.timestamp,
+        )
+        if processed and self.angle_log is not None:
+            self.angle_log.write(self.timestamp, meter.direction, meter.index)
+        # even if the frame was skipped - no motion
+        # means we can slow down
+        self._update_frame_rate(meter)
+
+        revolutions = meter.revolutions
+        interval = self.opts.output_interval
+        if self._last_revolutions.get(meter.name) != revolutions:
+            self._last_revolutions[meter.name] = revolutions
+            self.report(meter)
+        elif interval is not None and (
+            self.timestamp >= self._last_reported.get(meter.name, 0.0) + interval
+        ):
+            self.report(meter)
+
+
+    def report(self, meter):
+        self._last_reported[meter.name] = self.timestamp
+        reading = dict(
+            timestamp=self.timestamp,
+            meter=meter.name,
+            revolutions=meter.revolutions,
+            position=meter.position,
+            flow=meter.flow,
+        )
+        for sink in self.sinks:
+            sink.write(reading)
 
 
-    def found_contours(self, contours):
-        pass
+    def _update_frame_rate(self, meter):
+        angle = meter.monotizer.value
+        if self.frame_rate is not None and angle is not None:
+            self.frame_rate.feed(angle, self.timestamp, key=meter.name)
 
 
-    def enclosing_circle_and_centroid(self, circle, centroid):
-        pass
+    def frames_dropped(self, count):
+        super(Wasserzaehler, self).frames_dropped(count)
+        if self.instrumentation:
+            self.instrumentation.count("dropped_frames", count)
 
 
 def wasserzaehler():
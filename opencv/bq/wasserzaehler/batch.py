@@ -0,0 +1,197 @@
+"""
+Re-processes recorded movies in parallel.
+
+Each movie is optionally cut into segments, and
+the segments are processed by a pool of worker
+processes. The workers only compute the hand
+direction per frame, the (cheap) revolution
+counting is done afterwards in the original order,
+so the filter state carries over the segment
+boundaries exactly as if the movie had been
+processed in one go.
+"""
+import json
+import argparse
+import multiprocessing
+from array import array
+from itertools import izip
+
+import cv2
+import numpy as np
+
+from ..opencv import (
+    cv2_3,
+    Atan2Monotizer,
+    RevolutionCounter,
+)
+
+from .base import (
+    RoiPipeline,
+    arrow_direction,
+    load_meter_settings,
+    roi_of,
+)
+from .motion import MotionGate
+
+
+NO_DIRECTION = float("nan")
+
+
+def frame_count(movie):
+    capture = cv2.VideoCapture(movie)
+    try:
+        return int(capture.get(cv2_3.CAP_PROP_FRAME_COUNT))
+    finally:
+        capture.release()
+
+
+def segments(frames, count):
+    """
+    Splits the range of frames into count
+    consecutive (start, end) pairs.
+
+    If the number of frames is unknown, the
+    whole movie is one segment.
+    """
+    if frames <= 0:
+        return [(0, None)]
+    count = max(1, min(count, frames))
+    bounds = [frames * i // count for i in xrange(count + 1)]
+    return zip(bounds[:-1], bounds[1:])
+
+
+def process_segment(job):
+    """
+    Computes the hand direction of each meter
+    for each frame from start to end (exclusive,
+    None meaning to the end of the movie).
+
+    The meters are a list of (name, settings),
+    the result is a list of directions for each
+    meter. Frames without a detected hand, or
+    without motion, yield NO_DIRECTION.
+    """
+    movie, meters, start, end = job
+    pipelines = [
+        (s, RoiPipeline(), MotionGate(), array("d"))
+        for _, s in meters
+    ]
+
+    capture = cv2.VideoCapture(movie)
+    try:
+        if start:
+            capture.set(cv2_3.CAP_PROP_POS_FRAMES, start)
+        pos = start
+        frame = None
+        while end is None or pos < end:
+            grabbed, frame = capture.read(frame)
+            if not grabbed:
+                break
+            pos += 1
+
+            for s, pipeline, motion_gate, directions in pipelines:
+                if not motion_gate.changed(roi_of(frame, s), s):
+                    directions.append(NO_DIRECTION)
+                    continue
+
+                roi = pipeline.color_corrected_roi(frame, s)
+                roi = pipeline.color_range_filtered(roi, s)
+                res = arrow_direction(pipeline.shapes(roi, s), s)
+                directions.append(NO_DIRECTION if res is None else res[0])
+    finally:
+        capture.release()
+    return [directions for _, _, _, directions in pipelines]
+
+
+def count_revolutions(directions, revolution_filter=None):
+    if revolution_filter is None:
+        revolution_filter = Atan2Monotizer() | RevolutionCounter()
+    directions = np.asarray(directions, dtype=float)
+    revolution_filter.feed_many(directions[~np.isnan(directions)])
+    return revolution_filter.revolutions
+
+
+def process_movies(movies, settings, segment_count=1, processes=None):
+    """
+    Generates (movie, {meter-name: revolutions}) for
+    each of the given movies, in order. The settings
+    are a list of the same length as movies, each
+    entry being a list of (name, settings) for the
+    meters in the movie.
+    """
+    jobs, owners = [], []
+    for index, (movie, meters) in enumerate(zip(movies, settings)):
+        for start, end in segments(frame_count(movie), segment_count):
+            jobs.append((movie, meters, start, end))
+            owners.append(index)
+
+    def result(index, filters):
+        names = [name for name, _ in settings[index]]
+        return movies[index], dict(
+            (name, f.revolutions) for name, f in zip(names, filters)
+        )
+
+    pool = multiprocessing.Pool(processes=processes)
+    try:
+        results = pool.imap(process_segment, jobs)
+        current, filters = None, None
+        for index, meter_directions in izip(owners, results):
+            if index != current:
+                if current is not None:
+                    yield result(current, filters)
+                current = index
+                filters = [
+                    Atan2Monotizer() | RevolutionCounter()
+                    for _ in meter_directions
+                ]
+            for directions, f in zip(meter_directions, filters):
+                count_revolutions(directions, f)
+        if current is not None:
+            yield result(current, filters)
+    finally:
+        pool.terminate()
+
+
+def batch():
+    parser = argparse.ArgumentParser(
+        description="Count revolutions in recorded movies using all cores",
+    )
+    parser.add_argument("movies", nargs="+")
+    parser.add_argument(
+        "--settings",
+        action="append",
+        default=[],
+        help="Either one settings file for all movies, or one per movie",
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        help="Number of worker processes, defaults to the number of cores",
+    )
+    parser.add_argument(
+        "--segments",
+        type=int,
+        default=1,
+        help="Split each movie into this many segments processed in parallel",
+    )
+    opts = parser.parse_args()
+
+    if len(opts.settings) == 1:
+        settings = opts.settings * len(opts.movies)
+    elif len(opts.settings) == len(opts.movies):
+        settings = opts.settings
+    else:
+        parser.error("pass either one --settings, or one per movie")
+
+    settings = [load_meter_settings(filename) for filename in settings]
+    for movie, revolutions in process_movies(
+            opts.movies,
+            settings,
+            segment_count=opts.segments,
+            processes=opts.processes,
+    ):
+        if revolutions.keys() == [None]:
+            res = dict(movie=movie, revolutions=revolutions[None])
+        else:
+            res = dict(movie=movie, meters=revolutions)
+        print json.dumps(res)
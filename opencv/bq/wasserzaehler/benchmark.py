@@ -0,0 +1,318 @@
+import os
+import sys
+import math
+import json
+import argparse
+import subprocess
+from itertools import cycle, islice
+from timeit import default_timer
+
+import cv2
+import numpy as np
+
+from ..opencv import Bunch
+
+from .base import (
+    DEFAULT_SETTINGS,
+    DIRECTION_ESTIMATORS,
+    RoiPipeline,
+    external_contours,
+    find_components,
+    arrow_direction,
+    load_settings,
+)
+
+
+STAGES = [
+    "color_corrected_roi",
+    "color_range_filtered",
+    "blur",
+    "contours",
+    "arrow_direction",
+]
+
+PERCENTILES = [50, 90, 99]
+
+TESTDATA = os.path.join(
+    os.path.dirname(__file__),
+    os.pardir,
+    os.pardir,
+    "testdata",
+    "wasserzaehler",
+)
+
+
+# the modules behind the console scripts
+ENTRY_MODULES = [
+    "bq.opencv",
+    "bq.wasserzaehler.base",
+    "bq.wasserzaehler.calibration",
+]
+
+IMPORT_SCRIPT = """
+import sys
+import json
+from timeit import default_timer
+%(preload)s
+started = default_timer()
+import %(module)s
+elapsed = default_timer() - started
+print json.dumps(dict(seconds=elapsed, modules=sorted(sys.modules)))
+"""
+
+
+RED_HAND_SETTINGS = dict(
+    DEFAULT_SETTINGS,
+    Hlow=0, Hhigh=10,
+    Slow=100, Shigh=255,
+    Vlow=100, Vhigh=255,
+)
+
+
+def rotating_hand_frame(angle, size=(240, 320), radius=80):
+    """
+    A white frame with a red hand in the middle,
+    pointing at angle (in radians, image coordinates).
+    """
+    frame = np.full(size + (3,), 255, dtype="uint8")
+    center = (size[1] // 2, size[0] // 2)
+    tip = (
+        int(center[0] + math.cos(angle) * radius),
+        int(center[1] + math.sin(angle) * radius),
+    )
+    cv2.circle(frame, center, radius // 5, (0, 0, 255), -1)
+    cv2.line(frame, center, tip, (0, 0, 255), max(1, radius // 16))
+    return frame
+
+
+def synthetic_scenario(count, size=(480, 640), steps_per_revolution=60):
+    """
+    Returns frames of a hand rotating clockwise, and
+    settings covering it.
+
+    Only one revolution is rendered, the frames repeat
+    it, so memory doesn't grow with the count.
+    """
+    radius = min(size) // 3
+    revolution = [
+        rotating_hand_frame(
+            -i * 2 * math.pi / steps_per_revolution,
+            size,
+            radius,
+        )
+        for i in xrange(min(count, steps_per_revolution))
+    ]
+    frames = list(islice(cycle(revolution), count))
+    settings = Bunch(**dict(
+        RED_HAND_SETTINGS,
+        left=size[1] // 2 - radius - 10,
+        top=size[0] // 2 - radius - 10,
+        width=2 * radius + 20,
+        height=2 * radius + 20,
+    ))
+    return frames, settings
+
+
+def testdata_scenario(count):
+    """
+    The testdata image, processed with the color
+    ranges from the testdata settings. The ROI
+    of these settings doesn't fit the (cropped)
+    image, so the whole image is used instead.
+    """
+    frame = cv2.imread(os.path.join(TESTDATA, "wasserzaehler.jpg"))
+    s = load_settings(os.path.join(TESTDATA, "settings.json")).dict()
+    s.update(left=0, top=0, width=frame.shape[1], height=frame.shape[0])
+    return [frame] * count, Bunch(**s)
+
+
+def time_stages(frames, s):
+    """
+    Runs the frames through the pipeline, and
+    returns a dictionary of stage-name to an
+    array of durations in seconds, plus the
+    total time spent.
+    """
+    pipeline = RoiPipeline()
+    timings = np.zeros((len(STAGES), len(frames)))
+    timer = default_timer
+
+    started = timer()
+    for i, frame in enumerate(frames):
+        t0 = timer()
+        roi = pipeline.color_corrected_roi(frame, s)
+        t1 = timer()
+        mask = pipeline.color_range_filtered(roi, s)
+        t2 = timer()
+        blurred = pipeline.blurred(mask, s)
+        t3 = timer()
+        if s.direction == "components":
+            shapes = find_components(blurred)
+        else:
+            shapes = external_contours(blurred)
+        t4 = timer()
+        arrow_direction(shapes, s)
+        t5 = timer()
+        timings[:, i] = (t1 - t0, t2 - t1, t3 - t2, t4 - t3, t5 - t4)
+    total = timer() - started
+
+    return dict(zip(STAGES, timings)), total
+
+
+def summarize(timings, total, frames):
+    """
+    Condenses the timings into a JSON-able
+    dictionary, all durations in milliseconds.
+    """
+    stages = {}
+    for stage, durations in timings.items():
+        durations = durations * 1000.0
+        summary = dict(
+            mean=float(np.mean(durations)),
+            max=float(np.max(durations)),
+        )
+        for p, value in zip(
+                PERCENTILES,
+                np.percentile(durations, PERCENTILES),
+        ):
+            summary["p%i" % p] = float(value)
+        stages[stage] = summary
+
+    return dict(
+        frames=frames,
+        total=total * 1000.0,
+        fps=frames / total if total > 0 else 0.0,
+        stages=stages,
+    )
+
+
+def run_scenario(frames, s):
+    timings, total = time_stages(frames, s)
+    return summarize(timings, total, len(frames))
+
+
+def import_time(module, repeat=5, preload=None):
+    """
+    Imports the module in fresh interpreters, and
+    returns the fastest and median time in seconds,
+    and the modules loaded along the way.
+
+    The modules in preload (e.g. "cv2, numpy") are
+    imported before the clock starts, which leaves
+    just the cost of the module itself.
+    """
+    env = dict(os.environ)
+    # this package's bq, not some installed one
+    root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    env["PYTHONPATH"] = os.pathsep.join(
+        [root] + [p for p in [os.environ.get("PYTHONPATH")] if p]
+    )
+    script = IMPORT_SCRIPT % dict(
+        module=module,
+        preload="import " + preload if preload else "",
+    )
+    runs = [
+        json.loads(subprocess.check_output(
+            [sys.executable, "-c", script],
+            env=env,
+        ))
+        for _ in xrange(repeat)
+    ]
+    seconds = sorted(run["seconds"] for run in runs)
+    return dict(
+        min=seconds[0],
+        median=seconds[len(seconds) // 2],
+        modules=runs[0]["modules"],
+    )
+
+
+def print_import_report(results, out=sys.stdout):
+    print >> out, "imports:"
+    print >> out, "  %-32s%10s%10s%10s" % ("module", "min [ms]", "median", "modules")
+    for module in ENTRY_MODULES:
+        result = results[module]
+        print >> out, "  %-32s%10.1f%10.1f%10i" % (
+            module,
+            result["min"] * 1000,
+            result["median"] * 1000,
+            len(result["modules"]),
+        )
+
+
+def print_report(name, result, out=sys.stdout):
+    print >> out, "%s: %i frames, %.1f fps" % (
+        name,
+        result["frames"],
+        result["fps"],
+    )
+    columns = ["mean"] + ["p%i" % p for p in PERCENTILES] + ["max"]
+    print >> out, "  %-22s" % "stage [ms]" + "".join(
+        "%10s" % c for c in columns
+    )
+    for stage in STAGES:
+        summary = result["stages"][stage]
+        print >> out, "  %-22s" % stage + "".join(
+            "%10.3f" % summary[c] for c in columns
+        )
+
+
+def benchmark():
+    parser = argparse.ArgumentParser(
+        description="Time the stages of the wasserzaehler pipeline",
+    )
+    parser.add_argument(
+        "--frames",
+        type=int,
+        default=300,
+        help="Number of frames per scenario",
+    )
+    parser.add_argument(
+        "--scenario",
+        choices=["testdata", "synthetic"],
+        action="append",
+        help="Scenarios to run, defaults to all",
+    )
+    parser.add_argument(
+        "--json",
+        help="Write the results as JSON to this file, - for stdout",
+    )
+    parser.add_argument(
+        "--direction",
+        choices=sorted(DIRECTION_ESTIMATORS),
+        help="Override the direction estimator of the scenarios",
+    )
+    parser.add_argument(
+        "--imports",
+        action="store_true",
+        help="Also time the imports behind the console scripts",
+    )
+    opts = parser.parse_args()
+
+    scenarios = dict(
+        testdata=testdata_scenario,
+        synthetic=synthetic_scenario,
+    )
+    results = {}
+    for name in opts.scenario or sorted(scenarios):
+        frames, s = scenarios[name](opts.frames)
+        if opts.direction is not None:
+            s.direction = opts.direction
+        results[name] = run_scenario(frames, s)
+    if opts.imports:
+        results["imports"] = dict(
+            (module, import_time(module))
+            for module in ENTRY_MODULES
+        )
+
+    if opts.json == "-":
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+        print
+    else:
+        for name in sorted(results):
+            if name == "imports":
+                print_import_report(results[name])
+            else:
+                print_report(name, results[name])
+        if opts.json is not None:
+            with open(opts.json, "w") as outf:
+                json.dump(results, outf, indent=2, sort_keys=True)
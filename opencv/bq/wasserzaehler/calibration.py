@@ -1,11 +1,11 @@
 import json
+import time
 
 import numpy as np
 import cv2
 
 
 from ..opencv import (
-    Bunch,
     GREEN,
     PINK,
     RED,
@@ -18,25 +18,38 @@ from ..opencv import (
 from .base import (
     Wasserzaehler,
 )
+from .instrumentation import MethodObserver
 
 
 WINDOWNAME = "preview"
 
 
+# the trackbars showing settings as is
+INTEGER_TRACKBARS = [
+    "Hhigh", "Hlow", "Shigh",
+    "Slow", "Vhigh", "Vlow",
+    "left", "top", "width",
+    "height", "cH", "blur",
+]
+
+# settings shown in the colorbar
+COLORBAR_SETTINGS = ["Hlow", "Hhigh", "cH"]
+
+
 class Calibration(Wasserzaehler):
 
     def __init__(self, *a, **k):
         super(Calibration, self).__init__(*a, **k)
         cv2.namedWindow(WINDOWNAME)
+        # the stage results are shown as previews
+        self.instrumentation.add(MethodObserver(self))
+        self._colorbar = None
+        self._last_preview = None
+        self._preview_due = True
 
 
     def _propagate_settings(self):
-        for key in [
-                "Hhigh", "Hlow", "Shigh",
-                "Slow", "Vhigh", "Vlow",
-                "left", "top", "width",
-                "height", "cH", "blur",
-                ]:
+        for key in INTEGER_TRACKBARS:
             value = getattr(self.settings, key)
             cv2.setTrackbarPos(key, WINDOWNAME, value)
 
@@ -45,20 +58,22 @@ class Calibration(Wasserzaehler):
             cv2.setTrackbarPos(key, WINDOWNAME, int(value * 1000))
 
 
-    def _update_settings(self):
-        d = {}
-        for key in [
-                "Hhigh", "Hlow", "Shigh",
-                "Slow", "Vhigh", "Vlow",
-                "left", "top", "width",
-                "height", "cH", "blur",
-                ]:
-            d[key] = cv2.getTrackbarPos(key, WINDOWNAME)
-
-        for key in ["cmix"]:
-            d[key] = cv2.getTrackbarPos(key, WINDOWNAME) / 1000.0
-
-        self._settings = Bunch(**d)
+    def trackbar_changed(self, key, value):
+        """
+        Called by HighGUI from within waitKey, so
+        never while a frame is processed.
+        """
+        if key == "cmix":
+            value = value / 1000.0
+        elif key == "blur":
+            # the gaussian kernel must be odd
+            value |= 1
+        setattr(self.settings, key, value)
+        # the meter keeps a translated copy if cropping
+        meter = self.meters[0]
+        meter.translate(meter.origin)
+        if key in COLORBAR_SETTINGS:
+            self._colorbar = None
 
 
     def color_range_filtered_roi(self, roi):
@@ -69,9 +84,8 @@ class Calibration(Wasserzaehler):
         self._found_contours = contours
 
 
-    def enclosing_circle_and_centroid(self, circle, centroid):
-        self._circle = circle
-        self._centroid = centroid
+    def enclosing_circle_and_centroid(self, circle_and_centroid):
+        self._circle, self._centroid = circle_and_centroid
 
 
     def run(self):
@@ -80,12 +94,28 @@ class Calibration(Wasserzaehler):
 
 
     def frame_callback(self, frame):
-        self._update_settings()
-        s = self.settings
+        now = time.time()
+        self._preview_due = (
+            self._last_preview is None or
+            now >= self._last_preview + 1.0 / self.opts.preview_fps
+        )
+        self._found_contours = None
+        self._circle = self._centroid = None
+
+        # we only calibrate the first meter
+        self.process_meter(self.meters[0], frame)
+
+        if self._preview_due:
+            self._last_preview = now
+            self.show_previews(frame)
+
+        k = cv2.waitKey(1) & 0xFF
+        if k == 27:
+            self.stop()
 
-        opts = self.opts
-        super(Calibration, self).frame_callback(frame)
 
+    def show_previews(self, frame):
+        s = self.settings
         # convert back for preview
         roi = cv2.cvtColor(self._color_range_filtered_roi, cv2.COLOR_GRAY2BGR)
 
@@ -111,89 +141,91 @@ class Calibration(Wasserzaehler):
             WHITE,
         )
 
-        scale = self.opts.scale
-        (ecx, ecy), radius = self._circle
-        cx, cy = self._centroid
+        scale = self.opts.scale or 1.0
+        if self._circle is not None:
+            (ecx, ecy), radius = self._circle
+            cx, cy = self._centroid
 
-        cv2.circle(
-            roi,
-            (int(ecx), int(ecy)),
-            int(radius),
-            RED,
-        )
-        cv2.circle(
-            roi,
-            (cx, cy),
-            int(5 / scale),
-            YELLOW,
-        )
+            cv2.circle(
+                roi,
+                (int(ecx), int(ecy)),
+                int(radius),
+                RED,
+            )
+            cv2.circle(
+                roi,
+                (cx, cy),
+                int(5 / scale),
+                YELLOW,
+            )
 
-        cv2.line(
-            roi,
-            (cx, cy),
-            (int(ecx), int(ecy)),
-            (0, 255, 0), 2,
-        )
+            cv2.line(
+                roi,
+                (cx, cy),
+                (int(ecx), int(ecy)),
+                (0, 255, 0), 2,
+            )
 
         cv2.imshow("roi", roi)
 
-
-        cv2.rectangle(
-            frame,
-            (s.left, s.top),
-            (s.left + s.width, s.top + s.height),
-            GREEN,
-            int(1.0 / opts.scale),
-        )
-
-        if opts.scale is not None:
+        # the frame might be a capture buffer, so
+        # we draw on a scaled copy
+        if self.opts.scale is not None:
             dim = (
-                int(frame.shape[1] * opts.scale),
-                int(frame.shape[0] * opts.scale)
+                int(frame.shape[1] * scale),
+                int(frame.shape[0] * scale)
             )
-            frame = cv2.resize(frame, dim, interpolation=cv2.INTER_AREA)
-
-        cv2.imshow("preview", frame)
-
-        cbar = colorbar()
-        cbar[0,s.Hlow,:] = [255, 255, 255]
-        cbar[0,s.Hhigh,:] = [255, 255, 255]
-        cbar[0,s.cH,:] = [0, 0, 0]
-
-        colorbar_stretched = np.zeros((10, 180, 3), dtype="uint8")
+            preview = cv2.resize(frame, dim, interpolation=cv2.INTER_AREA)
+        else:
+            preview = frame.copy()
 
-        for i in xrange(10):
-            colorbar_stretched[i,::] = cbar
-        cv2.imshow("colorbar",
-            colorbar_stretched,
+        cv2.rectangle(
+            preview,
+            (int(s.left * scale), int(s.top * scale)),
+            (int((s.left + s.width) * scale), int((s.top + s.height) * scale)),
+            GREEN,
         )
-
-        k = cv2.waitKey(1) & 0xFF
-        if k == 27:
-            self.stop()
+        cv2.imshow("preview", preview)
+        cv2.imshow("colorbar", self.colorbar_preview())
+
+
+    def colorbar_preview(self):
+        """
+        The hue range and the color correction
+        hue on a colorbar, only re-drawn if they
+        changed.
+        """
+        if self._colorbar is None:
+            s = self.settings
+            cbar = colorbar()
+            cbar[0,s.Hlow,:] = [255, 255, 255]
+            cbar[0,s.Hhigh,:] = [255, 255, 255]
+            cbar[0,s.cH,:] = [0, 0, 0]
+            self._colorbar = np.repeat(cbar, 10, axis=0)
+        return self._colorbar
 
 
     def setup(self, frame):
         super(Calibration, self).setup(frame)
 
-        def nop(*_a):
-            pass
+        def changed(key):
+            return lambda value: self.trackbar_changed(key, value)
 
         minsize = 20
 
-        cv2.createTrackbar("cmix", WINDOWNAME, 0, 1000, nop)
-        cv2.createTrackbar("cH", WINDOWNAME, 0, 179, nop)
-        cv2.createTrackbar("Hhigh", WINDOWNAME, 0, 179, nop)
-        cv2.createTrackbar("Hlow", WINDOWNAME, 0, 179, nop)
-        cv2.createTrackbar("Shigh", WINDOWNAME, 0, 255, nop)
-        cv2.createTrackbar("Slow", WINDOWNAME, 0, 255, nop)
-        cv2.createTrackbar("Vhigh", WINDOWNAME, 0, 255, nop)
-        cv2.createTrackbar("Vlow", WINDOWNAME, 0, 255, nop)
-        cv2.createTrackbar("blur", WINDOWNAME, 3, 5, nop)
-        cv2.createTrackbar("left", WINDOWNAME, 0, frame.shape[1], nop)
-        cv2.createTrackbar("top", WINDOWNAME, 0, frame.shape[0], nop)
-        cv2.createTrackbar("width", WINDOWNAME, minsize, frame.shape[1] - minsize, nop)
-        cv2.createTrackbar("height", WINDOWNAME, minsize, frame.shape[0] - minsize, nop)
+        cv2.createTrackbar("cmix", WINDOWNAME, 0, 1000, changed("cmix"))
+        cv2.createTrackbar("cH", WINDOWNAME, 0, 179, changed("cH"))
+        cv2.createTrackbar("Hhigh", WINDOWNAME, 0, 179, changed("Hhigh"))
+        cv2.createTrackbar("Hlow", WINDOWNAME, 0, 179, changed("Hlow"))
+        cv2.createTrackbar("Shigh", WINDOWNAME, 0, 255, changed("Shigh"))
+        cv2.createTrackbar("Slow", WINDOWNAME, 0, 255, changed("Slow"))
+        cv2.createTrackbar("Vhigh", WINDOWNAME, 0, 255, changed("Vhigh"))
+        cv2.createTrackbar("Vlow", WINDOWNAME, 0, 255, changed("Vlow"))
+        cv2.createTrackbar("blur", WINDOWNAME, 3, 5, changed("blur"))
+        cv2.createTrackbar("left", WINDOWNAME, 0, frame.shape[1], changed("left"))
+        cv2.createTrackbar("top", WINDOWNAME, 0, frame.shape[0], changed("top"))
+        cv2.createTrackbar("width", WINDOWNAME, minsize, frame.shape[1] - minsize, changed("width"))
+        cv2.createTrackbar("height", WINDOWNAME, minsize, frame.shape[0] - minsize, changed("height"))
         self._propagate_settings()
 
 
@@ -204,15 +236,22 @@ class Calibration(Wasserzaehler):
             help="Scale down input - but just for displaying!",
             type=float,
         )
+        parser.add_argument(
+            "--preview-fps",
+            help="Update the previews at most this often",
+            type=float,
+            default=10.0,
+        )
 
 
     def color_adjusted_roi(self, roi):
         # create a preview with the percieved colors
         # to gauge the color-space filtering
-        cv2.imshow(
-            "hsvpreview",
-            create_hsv_preview(roi),
-        )
+        if self._preview_due:
+            cv2.imshow(
+                "hsvpreview",
+                create_hsv_preview(roi),
+            )
 
 
 
@@ -220,4 +259,4 @@ def calibration():
     gi = Calibration()
 
     gi.run()
-    print json.dumps(gi.settings.dict())
+    print json.dumps(gi.settings_dict())
@@ -0,0 +1,108 @@
+import os
+import json
+import threading
+from timeit import default_timer
+
+
+def load_checkpoint(filename):
+    """
+    The state stored in the checkpoint,
+    or None if there is none yet.
+    """
+    if not os.path.exists(filename):
+        return None
+    with open(filename) as inf:
+        return json.load(inf)
+
+
+def write_atomically(filename, data):
+    """
+    Writes data so that filename either has the old
+    or the new content, even if we lose power midway.
+    """
+    tmp = filename + ".tmp"
+    with open(tmp, "wb") as outf:
+        outf.write(data)
+        outf.flush()
+        os.fsync(outf.fileno())
+    os.rename(tmp, filename)
+    # persist the rename itself
+    fd = os.open(os.path.dirname(os.path.abspath(filename)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class Checkpointer(object):
+    """
+    Writes the state handed to update() to a file
+    in a background thread, so the frame loop never
+    waits for the storage.
+
+    At most one write happens per interval. Updates
+    in between only replace the pending state, so
+    SD-cards don't get worn out by frequent writes.
+    """
+
+    def __init__(self, filename, interval=60.0):
+        self.filename = filename
+        self._interval = interval
+        self._pending = None
+        self._running = True
+        self._condition = threading.Condition()
+        self.writes = 0
+
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+
+    def update(self, state):
+        """
+        The state must not be changed afterwards.
+        """
+        with self._condition:
+            self._pending = state
+            self._condition.notify()
+
+
+    def _run(self):
+        last_write = None
+        while True:
+            with self._condition:
+                while self._running and (
+                    self._pending is None or
+                    last_write is not None and
+                    default_timer() < last_write + self._interval
+                ):
+                    if self._pending is None:
+                        self._condition.wait()
+                    else:
+                        self._condition.wait(
+                            last_write + self._interval - default_timer()
+                        )
+                state, self._pending = self._pending, None
+                running = self._running
+
+            if state is not None:
+                last_write = default_timer()
+                self._write(state)
+            if not running:
+                return
+
+
+    def _write(self, state):
+        write_atomically(self.filename, json.dumps(state, sort_keys=True))
+        self.writes += 1
+
+
+    def close(self):
+        """
+        Writes the pending state, and stops
+        the writer.
+        """
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+        self._thread.join()
@@ -0,0 +1,296 @@
+import sys
+import json
+import math
+import time
+from timeit import default_timer
+
+
+class StageObserver(object):
+    """
+    Base class for observers of the frame processing.
+
+    Override what you are interested in:
+
+     - stage is called after each processing stage
+       with the stage result, and the time it took
+     - frame is called after each frame with the
+       overall processing time
+     - count is called for events such as dropped
+       frames
+     - snapshot returns a JSON-able summary
+    """
+
+    name = None
+
+    def stage(self, name, result, elapsed):
+        pass
+
+
+    def frame(self, elapsed):
+        pass
+
+
+    def count(self, name, n):
+        pass
+
+
+    def snapshot(self):
+        return None
+
+
+class Instrumentation(object):
+    """
+    A registry of StageObservers.
+
+    It is false if there are no observers, so the
+    processing can skip the time-taking altogether:
+
+        if instrumentation:
+            instrumentation.stage(...)
+    """
+
+    def __init__(self):
+        self._observers = []
+
+
+    def __nonzero__(self):
+        return bool(self._observers)
+
+
+    def add(self, observer):
+        self._observers.append(observer)
+        return observer
+
+
+    def remove(self, observer):
+        self._observers.remove(observer)
+
+
+    def stage(self, name, result, elapsed):
+        for observer in self._observers:
+            observer.stage(name, result, elapsed)
+
+
+    def frame(self, elapsed):
+        for observer in self._observers:
+            observer.frame(elapsed)
+
+
+    def count(self, name, n=1):
+        for observer in self._observers:
+            observer.count(name, n)
+
+
+    def snapshot(self):
+        res = {}
+        for observer in self._observers:
+            snapshot = observer.snapshot()
+            if snapshot is not None:
+                res[observer.name] = snapshot
+        return res
+
+
+class Lap(object):
+    """
+    Measures the time between consecutive
+    stages of one frame, and reports them
+    to the instrumentation.
+    """
+
+    def __init__(self, instrumentation):
+        self._instrumentation = instrumentation
+        self._started = self._last = default_timer()
+
+
+    def __call__(self, name, result):
+        now = default_timer()
+        self._instrumentation.stage(name, result, now - self._last)
+        self._last = now
+
+
+    def done(self):
+        self._instrumentation.frame(default_timer() - self._started)
+
+
+class MethodObserver(StageObserver):
+    """
+    Forwards stage results to the methods
+    of the same name on the target, if it
+    has them.
+    """
+
+    def __init__(self, target):
+        self._target = target
+
+
+    def stage(self, name, result, elapsed):
+        method = getattr(self._target, name, None)
+        if method is not None:
+            method(result)
+
+
+class Histogram(object):
+    """
+    Counts durations in logarithmic buckets, each
+    twice as wide as the one before, starting at one
+    microsecond.
+    """
+
+    BUCKETS = 24
+
+    def __init__(self):
+        self.counts = [0] * self.BUCKETS
+        self.total = 0.0
+        self.max = 0.0
+
+
+    def add(self, elapsed):
+        us = elapsed * 1000000.0
+        bucket = 0 if us < 1.0 else int(math.log(us, 2)) + 1
+        self.counts[min(bucket, self.BUCKETS - 1)] += 1
+        self.total += elapsed
+        self.max = max(self.max, elapsed)
+
+
+    @property
+    def n(self):
+        return sum(self.counts)
+
+
+    def percentile(self, p):
+        """
+        The upper bound (in seconds) of the bucket
+        containing the p-th percentile.
+        """
+        n = self.n
+        if not n:
+            return 0.0
+        wanted = n * p / 100.0
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if seen >= wanted:
+                break
+        return min(2 ** bucket / 1000000.0, self.max)
+
+
+    def snapshot(self):
+        n = self.n
+        return dict(
+            n=n,
+            mean=self.total / n if n else 0.0,
+            p50=self.percentile(50),
+            p90=self.percentile(90),
+            p99=self.percentile(99),
+            max=self.max,
+        )
+
+
+class StageTimer(StageObserver):
+
+    name = "timings"
+
+    def __init__(self):
+        self.histograms = {}
+
+
+    def _histogram(self, name):
+        try:
+            return self.histograms[name]
+        except KeyError:
+            return self.histograms.setdefault(name, Histogram())
+
+
+    def stage(self, name, result, elapsed):
+        self._histogram(name).add(elapsed)
+
+
+    def frame(self, elapsed):
+        self._histogram("frame").add(elapsed)
+
+
+    def snapshot(self):
+        return dict(
+            (name, histogram.snapshot())
+            for name, histogram in self.histograms.iteritems()
+        )
+
+
+class EventCounter(StageObserver):
+    """
+    Sums up counted events, e.g. dropped frames.
+    """
+
+    name = "events"
+
+    def __init__(self):
+        self.counts = {}
+
+
+    def count(self, name, n):
+        self.counts[name] = self.counts.get(name, 0) + n
+
+
+    def snapshot(self):
+        return dict(self.counts)
+
+
+class ContourCounter(StageObserver):
+
+    name = "contours"
+
+    def __init__(self):
+        self.frames = 0
+        self.total = 0
+        self.max = 0
+
+
+    def stage(self, name, result, elapsed):
+        if name in ("found_contours", "found_components"):
+            count = len(result)
+            self.frames += 1
+            self.total += count
+            self.max = max(self.max, count)
+
+
+    def snapshot(self):
+        return dict(
+            frames=self.frames,
+            mean=float(self.total) / self.frames if self.frames else 0.0,
+            max=self.max,
+        )
+
+
+class PeriodicDump(StageObserver):
+    """
+    Writes the snapshot of the instrumentation
+    as JSON line to out every interval seconds.
+    """
+
+    def __init__(self, instrumentation, interval, out=sys.stderr):
+        self._instrumentation = instrumentation
+        self._interval = interval
+        self._out = out
+        self._last = time.time()
+
+
+    def frame(self, elapsed):
+        now = time.time()
+        if now - self._last >= self._interval:
+            self._last = now
+            snapshot = self._instrumentation.snapshot()
+            snapshot["timestamp"] = now
+            self._out.write(json.dumps(snapshot, sort_keys=True) + "\n")
+            self._out.flush()
+
+
+def add_default_observers(instrumentation, interval=None, out=sys.stderr):
+    """
+    Adds the stage timings, event- and contour-counters,
+    and if interval is given, a periodic dump of them.
+    """
+    for observer in (StageTimer(), EventCounter(), ContourCounter()):
+        instrumentation.add(observer)
+    if interval is not None:
+        instrumentation.add(PeriodicDump(instrumentation, interval, out))
+    return instrumentation
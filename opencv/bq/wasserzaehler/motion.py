@@ -0,0 +1,62 @@
+import cv2
+import numpy as np
+
+
+class MotionGate(object):
+    """
+    Decides if a ROI changed enough since the last
+    time it was processed to warrant running the
+    detector again.
+
+    The ROI is scaled down by the settings "motion_scale",
+    converted to grayscale, and compared to the reference,
+    which is the last ROI that passed. If the mean absolute
+    difference exceeds "motion_threshold", the ROI passes.
+    To not get stuck on slowly creeping changes, it also
+    passes after "motion_refresh" frames in any case.
+
+    A "motion_threshold" of 0 lets everything pass.
+    """
+
+    def __init__(self):
+        self._shape = None
+        self._skipped = 0
+
+
+    def _ensure_buffers(self, roi, s):
+        scale = max(1, s.motion_scale)
+        shape = (
+            max(1, roi.shape[0] // scale),
+            max(1, roi.shape[1] // scale),
+        )
+        if shape != self._shape:
+            self._shape = shape
+            self._small = np.empty(shape + roi.shape[2:], dtype=roi.dtype)
+            self._gray = np.empty(shape, dtype="uint8")
+            self._reference = np.empty(shape, dtype="uint8")
+            self._diff = np.empty(shape, dtype="uint8")
+            return True
+        return False
+
+
+    def changed(self, roi, s):
+        if s.motion_threshold <= 0:
+            return True
+
+        new_geometry = self._ensure_buffers(roi, s)
+        height, width = self._shape
+        cv2.resize(roi, (width, height), self._small, interpolation=cv2.INTER_AREA)
+        if self._small.ndim == 3:
+            cv2.cvtColor(self._small, cv2.COLOR_BGR2GRAY, self._gray)
+        else:
+            self._gray[...] = self._small
+
+        if not new_geometry and self._skipped < s.motion_refresh:
+            cv2.absdiff(self._gray, self._reference, self._diff)
+            if cv2.mean(self._diff)[0] <= s.motion_threshold:
+                self._skipped += 1
+                return False
+
+        self._reference, self._gray = self._gray, self._reference
+        self._skipped = 0
+        return True
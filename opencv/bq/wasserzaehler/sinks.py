@@ -0,0 +1,359 @@
+"""
+Where the readings of the meters go.
+
+A reading is a dictionary with the keys of FIELDS.
+Sinks are created from a spec such as "csv:readings.csv",
+see create_sink.
+"""
+import os
+import sys
+import csv
+import json
+import errno
+import threading
+from collections import deque
+from timeit import default_timer
+
+
+FIELDS = ["timestamp", "meter", "revolutions", "position", "flow"]
+
+
+class Sink(object):
+
+    def write(self, reading):
+        pass
+
+
+    def close(self):
+        pass
+
+
+class PrintSink(Sink):
+    """
+    The classic output: the revolutions, prefixed
+    with the meter name if there are several meters.
+    """
+
+    def __init__(self, out=sys.stdout):
+        self._out = out
+
+
+    def write(self, reading):
+        if reading["meter"] is None:
+            print >> self._out, reading["revolutions"]
+        else:
+            print >> self._out, reading["meter"], reading["revolutions"]
+
+
+class BufferedSink(Sink):
+    """
+    Collects readings, and writes them in batches
+    from a background thread, so slow storage never
+    stalls the frame processing.
+
+    A batch is written once batch_size readings are
+    pending, or flush_interval seconds after the first
+    of them arrived. If more than max_pending readings
+    pile up, the oldest are dropped and counted.
+
+    Subclasses implement write_batch(readings), and can
+    implement open() and close_output() for resources
+    which must belong to the writer thread.
+
+    If writing a batch fails, the error is reported, the
+    batch counted in failed, and the writer carries on with
+    the next one. If open fails, the readings are dropped,
+    and close raises the error.
+    """
+
+    def __init__(self, batch_size=64, flush_interval=1.0, max_pending=10000):
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._pending = deque(maxlen=max_pending)
+        self._since = None
+        self._running = True
+        self._condition = threading.Condition()
+        self._error = None
+        self.dropped = 0
+        self.failed = 0
+
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+
+    def write(self, reading):
+        with self._condition:
+            if self._error is not None:
+                self.dropped += 1
+                return
+            if len(self._pending) == self._pending.maxlen:
+                self.dropped += 1
+            self._pending.append(reading)
+            if self._since is None:
+                self._since = default_timer()
+            if len(self._pending) >= self._batch_size:
+                self._condition.notify()
+
+
+    def _due(self):
+        return self._pending and (
+            len(self._pending) >= self._batch_size or
+            default_timer() >= self._since + self._flush_interval
+        )
+
+
+    def _run(self):
+        try:
+            self.open()
+        except Exception as e:
+            with self._condition:
+                self._error = e
+                self.dropped += len(self._pending)
+                self._pending.clear()
+            return
+        try:
+            while True:
+                with self._condition:
+                    while self._running and not self._due():
+                        if self._pending:
+                            self._condition.wait(
+                                self._since + self._flush_interval - default_timer()
+                            )
+                        else:
+                            self._condition.wait()
+                    batch = list(self._pending)
+                    self._pending.clear()
+                    self._since = None
+                    running = self._running
+
+                if batch:
+                    try:
+                        self.write_batch(batch)
+                    except Exception as e:
+                        self.failed += len(batch)
+                        print >> sys.stderr, "%s: writing %i readings failed: %s" % (
+                            type(self).__name__,
+                            len(batch),
+                            e,
+                        )
+                if not running:
+                    return
+        finally:
+            self.close_output()
+
+
+    def open(self):
+        pass
+
+
+    def close_output(self):
+        pass
+
+
+    def close(self):
+        """
+        Writes what's pending, and stops
+        the writer.
+        """
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+
+
+class JSONLinesSink(BufferedSink):
+    """
+    One JSON object per reading and line, appended
+    to a file, or to stdout for "-".
+    """
+
+    def __init__(self, filename="-", **k):
+        self._filename = filename
+        super(JSONLinesSink, self).__init__(**k)
+
+
+    def open(self):
+        if self._filename == "-":
+            self._out = sys.stdout
+        else:
+            self._out = open(self._filename, "a")
+
+
+    def write_batch(self, readings):
+        self._out.write("".join(
+            json.dumps(reading, sort_keys=True) + "\n"
+            for reading in readings
+        ))
+        self._out.flush()
+
+
+    def close_output(self):
+        if self._out is not sys.stdout:
+            self._out.close()
+
+
+class CSVSink(BufferedSink):
+    """
+    Appends the readings to a CSV file. Once it
+    exceeds max_bytes, it is renamed to FILENAME.1,
+    the older ones to FILENAME.2 and so on, keeping
+    at most backups of them.
+    """
+
+    def __init__(self, filename, max_bytes=1024 * 1024, backups=5, **k):
+        self._filename = filename
+        self._max_bytes = max_bytes
+        self._backups = backups
+        super(CSVSink, self).__init__(**k)
+
+
+    def open(self):
+        self._out = open(self._filename, "ab")
+        self._writer = csv.DictWriter(self._out, FIELDS)
+        if not self._out.tell():
+            self._writer.writeheader()
+
+
+    def write_batch(self, readings):
+        self._writer.writerows(readings)
+        self._out.flush()
+        if self._out.tell() >= self._max_bytes:
+            self._rotate()
+
+
+    def _rotate(self):
+        self._out.close()
+        for i in xrange(self._backups - 1, 0, -1):
+            older = "%s.%i" % (self._filename, i)
+            if os.path.exists(older):
+                os.rename(older, "%s.%i" % (self._filename, i + 1))
+        if self._backups:
+            os.rename(self._filename, self._filename + ".1")
+        else:
+            os.remove(self._filename)
+        self.open()
+
+
+    def close_output(self):
+        self._out.close()
+
+
+class SQLiteSink(BufferedSink):
+    """
+    Inserts the readings into a table of a SQLite
+    database, one transaction per batch.
+    """
+
+    def __init__(self, filename, table="readings", **k):
+        self._filename = filename
+        self._table = table
+        super(SQLiteSink, self).__init__(**k)
+
+
+    def open(self):
+        # only needed here, and slow to import
+        import sqlite3
+        # connections can't be shared between threads
+        self._connection = sqlite3.connect(self._filename)
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS %s "
+                "(timestamp REAL, meter TEXT, revolutions INTEGER, position REAL, flow REAL)"
+                % self._table
+            )
+
+
+    def write_batch(self, readings):
+        with self._connection:
+            self._connection.executemany(
+                "INSERT INTO %s VALUES (?, ?, ?, ?, ?)" % self._table,
+                [[reading[field] for field in FIELDS] for reading in readings],
+            )
+
+
+    def close_output(self):
+        self._connection.close()
+
+
+class SocketSink(BufferedSink):
+    """
+    Publishes the readings as JSON lines to all
+    clients connected to a UNIX socket. Clients
+    which don't keep up are disconnected.
+    """
+
+    def __init__(self, path, **k):
+        # only needed here, and slow to import
+        import socket
+        self._path = path
+        self._clients = []
+        if os.path.exists(path):
+            os.remove(path)
+        self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._server.bind(path)
+        self._server.listen(5)
+        self._server.setblocking(False)
+        super(SocketSink, self).__init__(**k)
+
+
+    def _accept(self):
+        while True:
+            try:
+                client, _ = self._server.accept()
+            except IOError as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return
+                raise
+            client.setblocking(False)
+            self._clients.append(client)
+
+
+    def write_batch(self, readings):
+        self._accept()
+        data = "".join(
+            json.dumps(reading, sort_keys=True) + "\n"
+            for reading in readings
+        )
+        for client in self._clients[:]:
+            try:
+                client.sendall(data)
+            except IOError:
+                client.close()
+                self._clients.remove(client)
+
+
+    def close_output(self):
+        for client in self._clients:
+            client.close()
+        self._server.close()
+        os.remove(self._path)
+
+
+SINKS = {
+    "print": lambda arg: PrintSink(),
+    "json": lambda arg: JSONLinesSink(arg or "-"),
+    "csv": CSVSink,
+    "sqlite": SQLiteSink,
+    "socket": SocketSink,
+}
+
+
+def create_sink(spec):
+    """
+    Creates a sink from a spec of the form
+    KIND or KIND:ARGUMENT, e.g. "json:-",
+    "csv:readings.csv", "sqlite:readings.db",
+    "socket:/tmp/wasserzaehler.sock"
+    """
+    kind, _, arg = spec.partition(":")
+    if kind not in SINKS:
+        raise ValueError("unknown output %r, choose from %s" % (
+            kind,
+            ", ".join(sorted(SINKS)),
+        ))
+    if not arg and kind not in ("print", "json"):
+        raise ValueError("output %r needs an argument, e.g. %s:FILENAME" % (kind, kind))
+    return SINKS[kind](arg or None)
@@ -12,8 +12,12 @@ setup(
     url = "https://github.com/deets/brombeerquark",
     entry_points={
         'console_scripts': [
-            'wasserzaehler-calibration = bq.wasserzaehler:calibration',
-            'wasserzaehler = bq.wasserzaehler:wasserzaehler',
+            'wasserzaehler-calibration = bq.wasserzaehler:calibration_main',
+            'wasserzaehler-autocalibration = bq.wasserzaehler:autocalibration_main',
+            'wasserzaehler = bq.wasserzaehler:wasserzaehler_main',
+            'wasserzaehler-batch = bq.wasserzaehler:batch_main',
+            'wasserzaehler-benchmark = bq.wasserzaehler:benchmark_main',
+            'wasserzaehler-replay-angles = bq.wasserzaehler:replay_angles_main',
         ],
     },
 )
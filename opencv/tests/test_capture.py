@@ -0,0 +1,290 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import cv2
+import numpy as np
+
+from bq.opencv import GenericInput
+from bq.opencv.device import (
+    DeviceCapture,
+    FakeDevice,
+)
+from bq.opencv.capture import (
+    ThreadedCapture,
+    FrameRangeCapture,
+    BLOCK,
+    DROP_OLDEST,
+)
+
+
+class FakeCapture(object):
+
+    def __init__(self, frames):
+        self._frames = iter(xrange(frames))
+        self.allocations = 0
+        self.released = False
+        self.gate = threading.Semaphore(0)
+        self.gated = False
+        self.grabs = 0
+
+
+    def read(self, image=None):
+        if self.gated:
+            self.gate.acquire()
+        try:
+            number = next(self._frames)
+        except StopIteration:
+            return False, None
+        if image is None:
+            self.allocations += 1
+            image = np.zeros((2, 2), dtype="uint32")
+        image[:] = number
+        return True, image
+
+
+    def grab(self):
+        self.grabs += 1
+        try:
+            next(self._frames)
+        except StopIteration:
+            return False
+        return True
+
+
+    def release(self):
+        self.released = True
+
+
+def read_all(capture):
+    res = []
+    while True:
+        grabbed, frame = capture.read()
+        if not grabbed:
+            break
+        res.append(int(frame[0, 0]))
+    return res
+
+
+class TestThreadedCapture(unittest.TestCase):
+
+    def test_blocking_delivers_all_frames_in_order(self):
+        fake = FakeCapture(100)
+        capture = ThreadedCapture(fake, buffers=3, drop_policy=BLOCK)
+        self.assertEqual(range(100), read_all(capture))
+        self.assertEqual(0, capture.dropped)
+        capture.release()
+        self.assertTrue(fake.released)
+
+
+    def test_buffers_are_reused(self):
+        fake = FakeCapture(100)
+        capture = ThreadedCapture(fake, buffers=3, drop_policy=BLOCK)
+        read_all(capture)
+        capture.release()
+        self.assertTrue(fake.allocations <= 3)
+
+
+    def test_drop_oldest_keeps_freshest_frames(self):
+        fake = FakeCapture(10)
+        capture = ThreadedCapture(fake, buffers=2, drop_policy=DROP_OLDEST)
+        # wait until the reader ran out of input
+        capture._thread.join()
+        frames = read_all(capture)
+        self.assertEqual([8, 9], frames)
+        self.assertEqual(8, capture.dropped)
+        capture.release()
+
+
+    def test_frame_in_use_is_not_overwritten(self):
+        fake = FakeCapture(10)
+        capture = ThreadedCapture(fake, buffers=2, drop_policy=DROP_OLDEST)
+        capture._thread.join()
+        grabbed, frame = capture.read()
+        self.assertTrue(grabbed)
+        self.assertEqual(8, frame[0, 0])
+        grabbed, other = capture.read()
+        self.assertEqual(9, other[0, 0])
+        self.assertFalse(frame is other)
+        capture.release()
+
+
+    def test_release_stops_blocked_reader(self):
+        fake = FakeCapture(1000)
+        capture = ThreadedCapture(fake, buffers=1, drop_policy=BLOCK)
+        capture.read()
+        capture.release()
+        self.assertFalse(capture._thread.is_alive())
+
+
+class TestFrameRangeCapture(unittest.TestCase):
+
+    def test_start_end_stride(self):
+        fake = FakeCapture(100)
+        capture = FrameRangeCapture(fake, start=10, end=20, stride=3)
+        self.assertEqual([10, 13, 16, 19], read_all(capture))
+        # skipped frames aren't decoded
+        self.assertEqual(16, fake.grabs)
+
+
+    def test_stride_without_end(self):
+        capture = FrameRangeCapture(FakeCapture(10), stride=4)
+        self.assertEqual([0, 4, 8], read_all(capture))
+
+
+    def test_grab_honours_stride_and_end(self):
+        fake = FakeCapture(100)
+        capture = FrameRangeCapture(fake, start=10, end=20, stride=3)
+        self.assertTrue(capture.grab())
+        self.assertTrue(capture.grab())
+        self.assertEqual([16, 19], read_all(capture))
+        self.assertFalse(capture.grab())
+        self.assertEqual(18, fake.grabs)
+
+
+    def test_seek(self):
+        fake = FakeCapture(100)
+        seeks = []
+
+        def seek(capture, frame):
+            seeks.append(frame)
+            for _ in xrange(frame):
+                capture.grab()
+
+        capture = FrameRangeCapture(fake, start=95, seek=seek)
+        self.assertEqual([95, 96, 97, 98, 99], read_all(capture))
+        self.assertEqual([95], seeks)
+
+
+class TestReplay(unittest.TestCase):
+
+    IMAGE = os.path.join(
+        os.path.dirname(__file__),
+        os.pardir,
+        "testdata",
+        "wasserzaehler",
+        "wasserzaehler.jpg",
+    )
+
+    class Counting(GenericInput):
+
+        def frame_callback(self, frame):
+            self.shape = frame.shape
+
+
+    def test_image_replay_terminates(self):
+        gi = self.Counting(["--image", self.IMAGE, "--replay", "--end", "50"])
+        gi.run()
+        self.assertEqual(50, gi.frames_processed)
+        self.assertTrue(gi.fps > 0)
+
+
+    def test_image_replay_defaults_to_one_frame(self):
+        gi = self.Counting(["--image", self.IMAGE, "--replay"])
+        gi.run()
+        self.assertEqual(1, gi.frames_processed)
+
+
+    def test_threaded_replay(self):
+        gi = self.Counting([
+            "--image", self.IMAGE,
+            "--replay",
+            "--end", "20",
+            "--stride", "2",
+            "--threaded-capture",
+        ])
+        gi.run()
+        self.assertEqual(10, gi.frames_processed)
+
+
+class TestBackends(unittest.TestCase):
+
+    def test_registering_doesnt_touch_base_classes(self):
+
+        class Special(GenericInput):
+            pass
+
+        Special.register_backend("special", lambda generic_input, opts: None)
+        self.assertIn("special", Special.backends)
+        self.assertIn("movie", Special.backends)
+        self.assertNotIn("special", GenericInput.backends)
+
+
+class TestDeviceCapture(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.movie = os.path.join(self.tmpdir, "counting.avi")
+        writer = cv2.VideoWriter(
+            self.movie,
+            cv2.VideoWriter_fourcc(*"MJPG"),
+            30,
+            (64, 48),
+        )
+        for i in xrange(5):
+            writer.write(np.full((48, 64, 3), i * 50, dtype="uint8"))
+        writer.release()
+
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+
+    def test_fake_device_loops(self):
+        device = FakeDevice(self.movie, width=32, height=24)
+        values = []
+        for _ in xrange(12):
+            grabbed, frame = device.read()
+            self.assertTrue(grabbed)
+            self.assertEqual((24, 32, 3), frame.shape)
+            values.append(int(round(frame.mean() / 50.0)))
+        device.release()
+        self.assertEqual([0, 1, 2, 3, 4] * 2 + [0, 1], values)
+
+
+    def test_cropped_views_of_reused_buffer(self):
+        capture = DeviceCapture(FakeDevice(self.movie), crop=(10, 20, 30, 100))
+        self.assertEqual((10, 20), capture.origin)
+        _, first = capture.read()
+        _, second = capture.read()
+        self.assertEqual((28, 30, 3), second.shape)
+        self.assertTrue(first.base is second.base)
+        self.assertEqual((48, 64, 3), second.base.shape)
+        capture.release()
+
+
+    def test_threaded_buffers_are_reused(self):
+        capture = ThreadedCapture(
+            DeviceCapture(FakeDevice(self.movie), crop=(0, 0, 8, 8), reuse=False),
+            buffers=2,
+            drop_policy=BLOCK,
+        )
+        bases = set()
+        for _ in xrange(20):
+            _, frame = capture.read()
+            self.assertEqual((8, 8, 3), frame.shape)
+            bases.add(id(frame.base))
+        capture.release()
+        self.assertTrue(len(bases) <= 2, bases)
+
+
+    def test_generic_input_backend(self):
+
+        class Cropping(TestReplay.Counting):
+
+            def capture_region(self):
+                return (16, 8, 32, 16)
+
+        gi = Cropping([
+            "--backend", "fake-device",
+            "--device", self.movie,
+            "--crop",
+            "--replay",
+            "--end", "7",
+        ])
+        gi.run()
+        self.assertEqual(7, gi.frames_processed)
+        self.assertEqual((16, 32, 3), gi.shape)
+        self.assertEqual((16, 8), gi.frame_origin)
@@ -1,11 +1,16 @@
 import math
+import json
 import unittest
 import random
 
+import numpy as np
+
 from bq.opencv import (
     memoize,
     RevolutionCounter,
     Atan2Monotizer,
+    FlowEstimator,
+    AdaptiveFrameRate,
 )
 
 
@@ -35,6 +40,56 @@ class TestUtils(unittest.TestCase):
         self.assertTrue(a is b)
 
 
+    def test_memoize_keyword_arguments(self):
+
+        @memoize
+        def foobar(*a, **k):
+            return object()
+
+        self.assertTrue(foobar(a=1, b=2) is foobar(b=2, a=1))
+        self.assertFalse(foobar(a=1) is foobar(a=2))
+
+
+    def test_memoize_lru_eviction(self):
+        calls = []
+
+        @memoize(maxsize=2)
+        def foobar(x):
+            calls.append(x)
+            return x
+
+        foobar(1)
+        foobar(2)
+        foobar(1)
+        foobar(3)  # evicts 2
+        foobar(1)
+        foobar(2)
+        self.assertEqual([1, 2, 3, 2], calls)
+        self.assertEqual(
+            dict(hits=2, misses=4, evictions=2, size=2, bytes=0),
+            foobar.cache_info(),
+        )
+
+
+    def test_memoize_byte_budget(self):
+
+        @memoize(maxbytes=250)
+        def image(value):
+            return np.full((10, 10), value, dtype="uint8")
+
+        for value in xrange(5):
+            image(value)
+
+        info = image.cache_info()
+        self.assertEqual(2, info["size"])
+        self.assertEqual(200, info["bytes"])
+        self.assertEqual(3, info["evictions"])
+
+        image.cache_clear()
+        self.assertEqual(0, image.cache_info()["size"])
+        self.assertEqual(0, image.cache_info()["bytes"])
+
+
     def test_revolution_counter_clockwise(self):
         counter = RevolutionCounter()
 
@@ -88,3 +143,189 @@ class TestUtils(unittest.TestCase):
             revolutions = counter.feed(input_)
 
         self.assertEqual(3, revolutions)
+
+
+class TestFeedMany(unittest.TestCase):
+
+    def rotationdata(self, revolutions, steps, noise):
+        random.seed(revolutions * steps + noise)
+        return [
+            i for _, i in TestUtils.produce_rotationdata(revolutions, steps, noise)
+        ]
+
+
+    def assert_same_as_feed(self, factory, inputs):
+        single = factory()
+        expected = [single.feed(input_) for input_ in inputs]
+        many = factory()
+        # in chunks, to see the state is carried over
+        output = np.concatenate([
+            many.feed_many(inputs[:len(inputs) // 3]),
+            many.feed_many(inputs[len(inputs) // 3:]),
+        ])
+        self.assertEqual(expected, output.tolist())
+        return output
+
+
+    def test_revolution_counter(self):
+        for steps in (-5, 5, 30):
+            inputs = self.rotationdata(5.5, steps, 0)
+            self.assert_same_as_feed(RevolutionCounter, inputs)
+
+
+    def test_atan2_monotizer(self):
+        for clockwise in (True, False):
+            inputs = self.rotationdata(3.5, 5, 20)
+            self.assert_same_as_feed(
+                lambda: Atan2Monotizer(clockwise=clockwise),
+                inputs,
+            )
+
+
+    def test_piped(self):
+        inputs = self.rotationdata(10.5, -5, 20)
+        output = self.assert_same_as_feed(
+            lambda: Atan2Monotizer() | RevolutionCounter(),
+            inputs,
+        )
+        self.assertEqual(10, output[-1])
+
+
+    def test_empty(self):
+        counter = Atan2Monotizer() | RevolutionCounter()
+        self.assertEqual(0, len(counter.feed_many([])))
+        self.assertEqual(0, counter.revolutions)
+
+
+    def test_restored_chain_continues(self):
+        inputs = self.rotationdata(6.5, -5, 20)
+        factory = lambda: Atan2Monotizer() | FlowEstimator() | RevolutionCounter()
+        expected = factory()
+        expected.feed_many(inputs, np.arange(len(inputs), dtype=float))
+
+        chain = factory()
+        half = len(inputs) // 2
+        chain.feed_many(inputs[:half], np.arange(half, dtype=float))
+        state = json.loads(json.dumps(chain.state()))
+        restored = factory()
+        restored.restore(state)
+        restored.feed_many(inputs[half:], np.arange(half, len(inputs), dtype=float))
+
+        self.assertEqual(6, restored.revolutions)
+        self.assertEqual(expected.revolutions, restored.revolutions)
+        self.assertAlmostEqual(expected.position, restored.position)
+
+
+class TestFlowEstimator(unittest.TestCase):
+
+    def turning(self, revolutions_per_second, seconds, fps=10.0):
+        timestamps = np.arange(0, seconds, 1.0 / fps)
+        angles = -2 * math.pi * revolutions_per_second * timestamps
+        return np.arctan2(np.sin(angles), np.cos(angles)), timestamps
+
+
+    def test_position_and_flow(self):
+        inputs, timestamps = self.turning(0.25, 20.0)
+        flow = FlowEstimator()
+        output = flow.feed_many(inputs, timestamps)
+        self.assertTrue(np.array_equal(inputs, output))
+        self.assertAlmostEqual(0.25 * timestamps[-1], flow.position)
+        self.assertAlmostEqual(0.25, flow.flow)
+
+
+    def test_flow_follows_changes(self):
+        flow = FlowEstimator(time_constant=1.0)
+        inputs, timestamps = self.turning(0.2, 10.0)
+        flow.feed_many(inputs, timestamps)
+        # the hand stops
+        for t in xrange(1, 6):
+            flow.feed(inputs[-1], timestamps[-1] + t)
+        self.assertTrue(flow.flow < 0.2 * math.exp(-4))
+
+
+    def test_feed_many_is_same_as_feed(self):
+        inputs, timestamps = self.turning(0.3, 7.0, fps=3.3)
+        single = FlowEstimator(clockwise=False)
+        for input_, timestamp in zip(inputs, timestamps):
+            single.feed(-input_, timestamp)
+        many = FlowEstimator(clockwise=False)
+        many.feed_many(-inputs[:5], timestamps[:5])
+        many.feed_many(-inputs[5:], timestamps[5:])
+        self.assertEqual(single.position, many.position)
+        self.assertEqual(single.flow, many.flow)
+
+
+    def test_feed_many_needs_timestamps(self):
+        with self.assertRaises(ValueError):
+            FlowEstimator().feed_many([0.1, 0.2])
+
+
+    def test_chained(self):
+        inputs, timestamps = self.turning(0.5, 5.0, fps=7.0)
+        chain = Atan2Monotizer() | FlowEstimator() | RevolutionCounter()
+        chain.feed_many(inputs, timestamps)
+        self.assertEqual(2, chain.revolutions)
+        self.assertAlmostEqual(0.5, chain.flow)
+        self.assertTrue(2.0 < chain.position < 2.5)
+
+
+class TestAdaptiveFrameRate(unittest.TestCase):
+
+    def feed(self, rate, velocity, seconds=2.0):
+        """
+        Feeds a hand turning with velocity (rad/s)
+        sampled at the current rate.
+        """
+        t = self.t
+        while t < self.t + seconds:
+            rate.feed(math.atan2(math.sin(-velocity * t), math.cos(-velocity * t)), t)
+            t += 1.0 / rate.fps
+        self.t = t
+
+
+    def setUp(self):
+        self.t = 0.0
+
+
+    def test_starts_at_max(self):
+        self.assertEqual(30.0, AdaptiveFrameRate(max_fps=30.0).fps)
+
+
+    def test_idle_hand_goes_to_min(self):
+        rate = AdaptiveFrameRate(min_fps=2.0, max_fps=30.0)
+        self.feed(rate, 0.0, 10.0)
+        self.assertEqual(2.0, rate.fps)
+
+
+    def test_steps_stay_within_margin(self):
+        rate = AdaptiveFrameRate(min_fps=1.0, max_fps=100.0, margin=0.5)
+        self.feed(rate, 10.0)
+        step = 10.0 / rate.fps
+        self.assertTrue(step <= math.pi / 4 + 1e-6, step)
+        self.assertTrue(rate.fps < 100.0)
+
+
+    def test_speeding_up_is_immediate_slowing_down_gradual(self):
+        rate = AdaptiveFrameRate(min_fps=1.0, max_fps=100.0)
+        self.feed(rate, 1.0)
+        slow = rate.fps
+        self.feed(rate, 10.0, 0.5)
+        fast = rate.fps
+        self.assertTrue(fast > slow * 5)
+        rate.feed(rate._last[None][0], self.t + 1.0 / fast)
+        self.assertTrue(slow < rate.fps < fast)
+
+
+    def test_fastest_hand_wins(self):
+        rate = AdaptiveFrameRate(min_fps=1.0, max_fps=100.0)
+        for i in xrange(10):
+            rate.feed(0.0, i, key="idle")
+            rate.feed(-0.5 * i, i, key="busy")
+        self.assertAlmostEqual(0.5, rate.velocity)
+
+
+    def test_wait(self):
+        rate = AdaptiveFrameRate(min_fps=1.0, max_fps=10.0)
+        self.assertEqual(0.0, rate.wait(100.0))
+        rate.processed(100.0)
+        self.assertAlmostEqual(0.05, rate.wait(100.05))
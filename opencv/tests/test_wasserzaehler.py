@@ -0,0 +1,818 @@
+import os
+import sys
+import json
+import math
+import socket
+import sqlite3
+import time
+import shutil
+import tempfile
+import unittest
+from StringIO import StringIO
+
+import cv2
+import numpy as np
+
+from bq.opencv import (
+    Bunch,
+    Atan2Monotizer,
+    RevolutionCounter,
+)
+from bq.wasserzaehler.base import (
+    DEFAULT_SETTINGS,
+    Wasserzaehler,
+    arrow_direction,
+    dump_meter_settings,
+    load_settings,
+    meter_settings,
+    RoiPipeline,
+    create_color_corrected_roi,
+    filter_for_color_range,
+    find_contours,
+)
+from bq.wasserzaehler.motion import MotionGate
+from bq.wasserzaehler.instrumentation import (
+    Histogram,
+    Instrumentation,
+    StageObserver,
+    add_default_observers,
+)
+from bq.wasserzaehler.benchmark import (
+    STAGES,
+    import_time,
+    rotating_hand_frame,
+    run_scenario,
+    synthetic_scenario,
+    testdata_scenario,
+)
+from bq.wasserzaehler.batch import (
+    segments,
+    process_segment,
+    process_movies,
+    count_revolutions,
+)
+from bq.wasserzaehler.autocalibration import (
+    calibrate,
+    hue_in_range,
+    sample_frames,
+    stability,
+)
+from bq.wasserzaehler.sinks import (
+    BufferedSink,
+    CSVSink,
+    SQLiteSink,
+    SocketSink,
+    create_sink,
+)
+from bq.wasserzaehler.checkpoint import (
+    Checkpointer,
+    load_checkpoint,
+)
+from bq.wasserzaehler.anglelog import (
+    HEADER_SIZE,
+    RECORD,
+    AngleLogWriter,
+    read_angle_log,
+    replay,
+)
+
+
+TESTDATA = os.path.join(
+    os.path.dirname(__file__),
+    os.pardir,
+    "testdata",
+    "wasserzaehler",
+)
+
+
+def test_settings(**k):
+    settings = dict(
+        DEFAULT_SETTINGS,
+        Hlow=0, Hhigh=20,
+        Slow=0, Shigh=255,
+        Vlow=0, Vhigh=255,
+        left=20, top=30,
+        width=200, height=180,
+        cH=57, cmix=0.093,
+    )
+    settings.update(k)
+    return Bunch(**settings)
+
+
+class TestRoiPipeline(unittest.TestCase):
+
+    def setUp(self):
+        self.frame = cv2.imread(os.path.join(TESTDATA, "wasserzaehler.jpg"))
+
+
+    def test_pipeline_matches_functions(self):
+        s = test_settings()
+        pipeline = RoiPipeline()
+
+        roi = create_color_corrected_roi(self.frame, s)
+        mask = filter_for_color_range(roi, s)
+        contours = find_contours(mask, s)
+
+        p_roi = pipeline.color_corrected_roi(self.frame, s)
+        self.assertTrue(np.array_equal(roi, p_roi))
+        p_mask = pipeline.color_range_filtered(p_roi, s)
+        self.assertTrue(np.array_equal(mask, p_mask))
+        p_contours = pipeline.contours(p_mask, s)
+        self.assertEqual(len(contours), len(p_contours))
+        for a, b in zip(contours, p_contours):
+            self.assertTrue(np.array_equal(a, b))
+        # the mask stays intact
+        self.assertTrue(np.array_equal(mask, p_mask))
+
+
+    def test_buffers_are_reused(self):
+        s = test_settings()
+        pipeline = RoiPipeline()
+        roi = pipeline.color_corrected_roi(self.frame, s)
+        mask = pipeline.color_range_filtered(roi, s)
+        self.assertTrue(roi is pipeline.color_corrected_roi(self.frame, s))
+        self.assertTrue(mask is pipeline.color_range_filtered(roi, s))
+
+
+    def test_geometry_change_reallocates(self):
+        pipeline = RoiPipeline()
+        roi = pipeline.color_corrected_roi(self.frame, test_settings())
+        other = pipeline.color_corrected_roi(
+            self.frame,
+            test_settings(width=100),
+        )
+        self.assertEqual((180, 200, 3), roi.shape)
+        self.assertEqual((180, 100, 3), other.shape)
+
+
+    def test_clipped_roi(self):
+        pipeline = RoiPipeline()
+        roi = pipeline.color_corrected_roi(
+            self.frame,
+            test_settings(left=200, width=200),
+        )
+        self.assertEqual((180, 90, 3), roi.shape)
+
+
+HAND_SETTINGS = dict(
+    Hlow=0, Hhigh=10,
+    Slow=100, Shigh=255,
+    Vlow=100, Vhigh=255,
+    left=40, top=10,
+    width=240, height=220,
+    cmix=0,
+)
+
+
+class HandMovieMixin(object):
+    """
+    Gives each test a tmpdir, and writes a movie of a
+    hand turning 2.5 revolutions clockwise - when movie
+    is first used - and settings to detect it into it.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self._movie = None
+
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+
+    @property
+    def movie(self):
+        if self._movie is None:
+            self._movie = self.write_hand_movie()
+        return self._movie
+
+
+    def write_hand_movie(self):
+        movie = os.path.join(self.tmpdir, "hand.avi")
+        writer = cv2.VideoWriter(
+            movie,
+            cv2.VideoWriter_fourcc(*"MJPG"),
+            30,
+            (320, 240),
+        )
+        for i in xrange(90):
+            writer.write(rotating_hand_frame(-i * math.pi * 5 / 90))
+        writer.release()
+        return movie
+
+
+    def write_hand_settings(self):
+        settings = os.path.join(self.tmpdir, "settings.json")
+        with open(settings, "w") as outf:
+            json.dump(dict(DEFAULT_SETTINGS, **HAND_SETTINGS), outf)
+        return settings
+
+
+class TestDirectionEstimators(unittest.TestCase):
+
+    def directions(self, s):
+        pipeline = RoiPipeline()
+        res = []
+        for i in xrange(36):
+            angle = math.pi * (i * 10 - 180) / 180.0
+            frame = rotating_hand_frame(angle)
+            roi = pipeline.color_corrected_roi(frame, s)
+            mask = pipeline.color_range_filtered(roi, s)
+            direction, _, _ = arrow_direction(pipeline.shapes(mask, s), s)
+            res.append((angle, direction))
+        return res
+
+
+    def test_estimators_find_the_hand(self):
+        for estimator in ("contours", "components"):
+            s = test_settings(direction=estimator, **HAND_SETTINGS)
+            for angle, direction in self.directions(s):
+                error = math.atan2(
+                    math.sin(direction - angle),
+                    math.cos(direction - angle),
+                )
+                self.assertTrue(abs(error) < 0.15, (estimator, angle, direction))
+
+
+    def test_no_shapes_no_direction(self):
+        s = test_settings(direction="components", **HAND_SETTINGS)
+        pipeline = RoiPipeline()
+        frame = np.full((240, 320, 3), 255, dtype="uint8")
+        roi = pipeline.color_corrected_roi(frame, s)
+        mask = pipeline.color_range_filtered(roi, s)
+        self.assertEqual(None, arrow_direction(pipeline.shapes(mask, s), s))
+
+
+    def test_settings_default_to_contours(self):
+        settings = os.path.join(tempfile.mkdtemp(), "settings.json")
+        try:
+            with open(settings, "w") as outf:
+                json.dump(dict(Hlow=10), outf)
+            s = load_settings(settings)
+        finally:
+            shutil.rmtree(os.path.dirname(settings))
+        self.assertEqual(10, s.Hlow)
+        self.assertEqual("contours", s.direction)
+
+
+class TestMotionGate(unittest.TestCase):
+
+    def test_disabled_gate_passes_everything(self):
+        gate = MotionGate()
+        s = test_settings()
+        frame = rotating_hand_frame(0)
+        self.assertTrue(all(gate.changed(frame, s) for _ in xrange(10)))
+
+
+    def test_unchanged_frames_are_gated(self):
+        gate = MotionGate()
+        s = test_settings(motion_threshold=1, motion_refresh=5)
+        frame = rotating_hand_frame(0)
+        passed = [gate.changed(frame, s) for _ in xrange(13)]
+        self.assertEqual(
+            [True] + [False] * 5 + [True] + [False] * 5 + [True],
+            passed,
+        )
+
+
+    def test_motion_passes(self):
+        gate = MotionGate()
+        s = test_settings(motion_threshold=1, motion_refresh=100)
+        self.assertTrue(gate.changed(rotating_hand_frame(0), s))
+        self.assertFalse(gate.changed(rotating_hand_frame(0), s))
+        self.assertTrue(gate.changed(rotating_hand_frame(1.0), s))
+        self.assertFalse(gate.changed(rotating_hand_frame(1.0), s))
+
+
+class TestBatch(HandMovieMixin, unittest.TestCase):
+
+    def test_segments(self):
+        self.assertEqual([(0, None)], segments(0, 4))
+        self.assertEqual([(0, 3), (3, 6), (6, 10)], segments(10, 3))
+        self.assertEqual([(0, 1), (1, 2)], segments(2, 5))
+
+
+    def test_segmented_processing_is_stitched(self):
+        for estimator in ("contours", "components"):
+            settings = test_settings(direction=estimator, **HAND_SETTINGS)
+            directions, = process_segment((self.movie, [(None, settings)], 0, None))
+            self.assertEqual(90, len(directions))
+            self.assertEqual(2, count_revolutions(directions))
+
+        settings = test_settings(motion_threshold=1, **HAND_SETTINGS)
+        directions, = process_segment((self.movie, [(None, settings)], 0, None))
+        self.assertEqual(90, len(directions))
+        self.assertEqual(2, count_revolutions(directions))
+        for count in (1, 4):
+            res = list(process_movies(
+                [self.movie], [[(None, settings)]],
+                segment_count=count,
+                processes=2,
+            ))
+            self.assertEqual([(self.movie, {None: 2})], res)
+
+
+    def test_multiple_meters(self):
+        movie = os.path.join(self.tmpdir, "hands.avi")
+        writer = cv2.VideoWriter(
+            movie,
+            cv2.VideoWriter_fourcc(*"MJPG"),
+            30,
+            (640, 240),
+        )
+        for i in xrange(90):
+            writer.write(np.hstack([
+                rotating_hand_frame(-i * math.pi * 5 / 90),
+                rotating_hand_frame(-i * math.pi * 3 / 90),
+            ]))
+        writer.release()
+
+        d = dict(
+            HAND_SETTINGS,
+            meters=[
+                dict(name="left"),
+                dict(name="right", left=HAND_SETTINGS["left"] + 320),
+            ],
+        )
+        meters = meter_settings(d)
+        self.assertEqual(["left", "right"], [name for name, _ in meters])
+        self.assertEqual(360, meters[1][1].left)
+        self.assertEqual(
+            [(name, s.dict()) for name, s in meters],
+            [
+                (name, s.dict())
+                for name, s in meter_settings(dump_meter_settings(meters))
+            ],
+        )
+
+        res = list(process_movies([movie], [meters], segment_count=2))
+        self.assertEqual([(movie, {"left": 2, "right": 1})], res)
+
+        settings = os.path.join(self.tmpdir, "settings.json")
+        with open(settings, "w") as outf:
+            json.dump(d, outf)
+        wz = Wasserzaehler(["--movie", movie, "--settings", settings, "--replay"])
+        wz.run()
+        self.assertEqual([2, 1], [meter.revolutions for meter in wz.meters])
+
+
+class TestAdaptiveFrameRate(HandMovieMixin, unittest.TestCase):
+
+    def test_adaptive_frame_rate_skips_frames(self):
+        settings = self.write_hand_settings()
+        wz = Wasserzaehler([
+            "--movie", self.movie,
+            "--settings", settings,
+            "--replay",
+            "--adaptive-fps",
+        ])
+        wz.run()
+        self.assertEqual(2, wz.revolutions)
+        self.assertTrue(wz.frames_processed < 60, wz.frames_processed)
+        # the clock follows the movie, not the wall
+        self.assertAlmostEqual(3.0, wz.clock(), 1)
+
+
+    def test_adaptive_frame_rate_with_stride(self):
+        settings = self.write_hand_settings()
+        wz = Wasserzaehler([
+            "--movie", self.movie,
+            "--settings", settings,
+            "--replay",
+            "--adaptive-fps",
+            "--stride", "2",
+        ])
+        wz.run()
+        self.assertEqual(2, wz.revolutions)
+        self.assertTrue(wz.frames_processed < 45, wz.frames_processed)
+        self.assertAlmostEqual(3.0, wz.clock(), 1)
+
+
+class TestDeviceCapture(HandMovieMixin, unittest.TestCase):
+
+    def test_cropped_device(self):
+        settings = self.write_hand_settings()
+        wz = Wasserzaehler([
+            "--backend", "fake-device",
+            "--device", self.movie,
+            "--crop",
+            "--settings", settings,
+            "--replay",
+            "--end", "90",
+        ])
+        self.assertEqual((40, 10, 240, 220), wz.capture_region())
+        wz.run()
+        self.assertEqual((40, 10), wz.frame_origin)
+        self.assertEqual(2, wz.revolutions)
+
+
+class TestAutocalibration(HandMovieMixin, unittest.TestCase):
+
+    def test_autocalibration(self):
+        frames = sample_frames(self.movie, 30, stride=2)
+        self.assertEqual(30, len(frames))
+        s, score = calibrate(frames, Bunch(**DEFAULT_SETTINGS), processes=2)
+        self.assertEqual(1.0, score)
+        directions, = process_segment((self.movie, [(None, s)], 0, None))
+        self.assertEqual(2, count_revolutions(directions))
+
+
+    def test_red_hand_wraps_around(self):
+        frames = []
+        for i in xrange(20):
+            frame = rotating_hand_frame(-i * math.pi / 10)
+            # a hue of 178, just below 0
+            frame[(frame == [0, 0, 255]).all(axis=2)] = [17, 0, 255]
+            frames.append(frame)
+        s, score = calibrate(frames, Bunch(**DEFAULT_SETTINGS), processes=2)
+        self.assertEqual(1.0, score)
+        self.assertTrue(s.Hlow > s.Hhigh, (s.Hlow, s.Hhigh))
+        self.assertTrue(s.hue_wrap)
+
+
+    def test_wrapping_hue_range(self):
+        hsv = np.array([[[0, 200, 200], [5, 200, 200], [90, 200, 200], [175, 200, 200]]], dtype="uint8")
+        s = test_settings(Hlow=170, Hhigh=5, Slow=100, Vlow=100, hue_wrap=True)
+        self.assertEqual([255, 255, 0, 255], list(filter_for_color_range(hsv, s)[0]))
+        # existing settings keep their meaning
+        s = test_settings(Hlow=170, Hhigh=5, Slow=100, Vlow=100)
+        self.assertEqual([0, 0, 0, 0], list(filter_for_color_range(hsv, s)[0]))
+        self.assertEqual(
+            [True, True, False, True],
+            list(hue_in_range(hsv[0, :, 0], 170, 5)),
+        )
+
+
+    def test_stability(self):
+        nan = float("nan")
+        self.assertEqual(1.0, stability([0.1, 0.2, 0.3]))
+        self.assertEqual(0.5, stability([0.1, nan, 0.2, nan]))
+        self.assertEqual(0.5, stability([0.1, 0.2, 3.0]))
+        self.assertEqual(0.0, stability([]))
+
+
+class TestSinks(HandMovieMixin, unittest.TestCase):
+
+    def readings(self, count):
+        return [
+            dict(timestamp=i, meter="m", revolutions=i // 10, position=i / 10.0, flow=0.1)
+            for i in xrange(count)
+        ]
+
+
+    def test_csv_rotates(self):
+        filename = os.path.join(self.tmpdir, "readings.csv")
+        readings = self.readings(40)
+        # each batch exceeds max_bytes
+        for i in xrange(0, 40, 10):
+            sink = CSVSink(filename, max_bytes=200, backups=2)
+            for reading in readings[i:i + 10]:
+                sink.write(reading)
+            sink.close()
+        self.assertEqual(
+            ["readings.csv", "readings.csv.1", "readings.csv.2"],
+            sorted(os.listdir(self.tmpdir)),
+        )
+        with open(filename + ".1") as inf:
+            lines = inf.read().splitlines()
+        self.assertEqual("timestamp,meter,revolutions,position,flow", lines[0])
+
+
+    def test_sqlite(self):
+        filename = os.path.join(self.tmpdir, "readings.db")
+        sink = SQLiteSink(filename, batch_size=7)
+        for reading in self.readings(20):
+            sink.write(reading)
+        sink.close()
+        connection = sqlite3.connect(filename)
+        self.assertEqual(
+            [(20, 1)],
+            connection.execute("SELECT COUNT(*), MAX(revolutions) FROM readings").fetchall(),
+        )
+        connection.close()
+
+
+    def test_socket(self):
+        path = os.path.join(self.tmpdir, "readings.sock")
+        sink = SocketSink(path, batch_size=1)
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        client.connect(path)
+        readings = self.readings(3)
+        for reading in readings:
+            sink.write(reading)
+        sink.close()
+        data = ""
+        while True:
+            chunk = client.recv(4096)
+            if not chunk:
+                break
+            data += chunk
+        client.close()
+        self.assertEqual(readings, [json.loads(line) for line in data.splitlines()])
+        self.assertFalse(os.path.exists(path))
+
+
+    def test_failing_batches_are_reported(self):
+
+        class FlakySink(BufferedSink):
+
+            written = []
+
+            def write_batch(self, readings):
+                if not self.failed:
+                    raise IOError("disk full")
+                self.written.extend(readings)
+
+        readings = self.readings(10)
+        stderr, sys.stderr = sys.stderr, StringIO()
+        try:
+            sink = FlakySink(batch_size=5)
+            for reading in readings[:5]:
+                sink.write(reading)
+            deadline = time.time() + 5.0
+            while not sink.failed and time.time() < deadline:
+                time.sleep(0.01)
+            for reading in readings[5:]:
+                sink.write(reading)
+            sink.close()
+            errors = sys.stderr.getvalue()
+        finally:
+            sys.stderr = stderr
+        self.assertEqual(5, sink.failed)
+        self.assertEqual(readings[5:], FlakySink.written)
+        self.assertIn("disk full", errors)
+
+
+    def test_failing_open_is_raised_on_close(self):
+        sink = CSVSink(os.path.join(self.tmpdir, "missing", "readings.csv"))
+        sink.write(self.readings(1)[0])
+        self.assertRaises(IOError, sink.close)
+        self.assertEqual(1, sink.dropped)
+
+
+    def test_specs(self):
+        self.assertRaises(ValueError, create_sink, "nope")
+        self.assertRaises(ValueError, create_sink, "csv")
+
+
+    def test_json_output(self):
+        readings = os.path.join(self.tmpdir, "readings.jsonl")
+        wz = Wasserzaehler([
+            "--movie", self.movie,
+            "--settings", self.write_hand_settings(),
+            "--replay",
+            "--output", "json:" + readings,
+            "--output-interval", "0.5",
+        ])
+        wz.run()
+        with open(readings) as inf:
+            readings = [json.loads(line) for line in inf]
+        self.assertEqual([0, 1, 2], sorted(set(r["revolutions"] for r in readings)))
+        # the movie takes three seconds
+        self.assertTrue(len(readings) >= 6, len(readings))
+        last = readings[-1]
+        self.assertAlmostEqual(last["timestamp"] * 2.5 / 3, last["position"], 1)
+        self.assertAlmostEqual(2.5 / 3, last["flow"], 1)
+
+
+class TestCheckpointer(HandMovieMixin, unittest.TestCase):
+
+    def setUp(self):
+        super(TestCheckpointer, self).setUp()
+        self.checkpoint = os.path.join(self.tmpdir, "checkpoint.json")
+
+
+    def test_writes_are_coalesced(self):
+        self.assertEqual(None, load_checkpoint(self.checkpoint))
+        checkpointer = Checkpointer(self.checkpoint, interval=60.0)
+        for i in xrange(100):
+            checkpointer.update(dict(i=i))
+        checkpointer.close()
+        # the first update, and the last one on closing
+        self.assertTrue(checkpointer.writes <= 2)
+        self.assertEqual(dict(i=99), load_checkpoint(self.checkpoint))
+
+
+    def test_checkpoint_survives_restart(self):
+        args = [
+            "--movie", self.movie,
+            "--settings", self.write_hand_settings(),
+            "--checkpoint", self.checkpoint,
+        ]
+        wz = Wasserzaehler(args + ["--replay"])
+        wz.run()
+        self.assertEqual(2, wz.revolutions)
+        self.assertEqual(
+            ["checkpoint.json", "hand.avi", "settings.json"],
+            sorted(os.listdir(self.tmpdir)),
+        )
+
+        wz = Wasserzaehler(args)
+        self.assertEqual(2, wz.revolutions)
+        self.assertAlmostEqual(2.5, wz.meters[0].position, 1)
+
+
+class TestAngleLog(HandMovieMixin, unittest.TestCase):
+
+    def setUp(self):
+        super(TestAngleLog, self).setUp()
+        self.log = os.path.join(self.tmpdir, "angles.log")
+
+
+    def test_append_and_no_detection(self):
+        writer = AngleLogWriter(self.log, buffer_size=2)
+        for i in xrange(3):
+            writer.write(i, 0.5 * i, 0)
+        writer.close()
+        writer = AngleLogWriter(self.log)
+        writer.write(3, None, 1)
+        writer.close()
+
+        records = read_angle_log(self.log)
+        self.assertEqual([0, 1, 2, 3], list(records["timestamp"]))
+        self.assertEqual([0, 0, 0, 1], list(records["meter"]))
+        self.assertTrue(np.isnan(records["angle"][3]))
+        self.assertEqual(
+            HEADER_SIZE + 4 * RECORD.itemsize,
+            os.path.getsize(self.log),
+        )
+
+
+    def test_partial_record_is_cut_off(self):
+        writer = AngleLogWriter(self.log)
+        writer.write(0, 1.0)
+        writer.close()
+        with open(self.log, "ab") as outf:
+            outf.write("\0" * 5)
+        self.assertEqual(1, len(read_angle_log(self.log)))
+        writer = AngleLogWriter(self.log)
+        writer.write(1, 2.0)
+        writer.close()
+        self.assertEqual([1.0, 2.0], list(read_angle_log(self.log)["angle"]))
+
+
+    def test_flush_interval(self):
+        writer = AngleLogWriter(self.log, flush_interval=0.0)
+        writer.write(0, 1.0)
+        self.assertEqual(1, len(read_angle_log(self.log)))
+        writer.close()
+        writer.close()
+
+        writer = AngleLogWriter(self.log, flush_interval=3600.0)
+        writer.write(1, 2.0)
+        self.assertEqual(1, len(read_angle_log(self.log)))
+        writer.close()
+        self.assertEqual(2, len(read_angle_log(self.log)))
+
+
+    def test_angle_log_replay(self):
+        wz = Wasserzaehler([
+            "--movie", self.movie,
+            "--settings", self.write_hand_settings(),
+            "--replay",
+            "--angle-log", self.log,
+        ])
+        wz.run()
+
+        records = read_angle_log(self.log)
+        self.assertEqual(90, len(records))
+        self.assertTrue(np.all(np.diff(records["timestamp"]) > 0))
+        self.assertTrue(np.all(records["meter"] == 0))
+        output = replay(records, Atan2Monotizer() | RevolutionCounter())
+        self.assertEqual(wz.revolutions, output[-1])
+
+
+class TestBenchmark(unittest.TestCase):
+
+    def test_scenarios(self):
+        for scenario in (testdata_scenario, synthetic_scenario):
+            frames, s = scenario(5)
+            s.direction = "components"
+            result = run_scenario(frames, s)
+            self.assertEqual(5, result["frames"])
+            self.assertEqual(set(STAGES), set(result["stages"]))
+            for summary in result["stages"].values():
+                self.assertTrue(summary["p50"] <= summary["p99"] <= summary["max"])
+
+
+    def test_synthetic_frames_repeat_a_revolution(self):
+        frames, _ = synthetic_scenario(150, size=(48, 64), steps_per_revolution=60)
+        self.assertEqual(150, len(frames))
+        self.assertEqual(60, len(set(id(frame) for frame in frames)))
+        self.assertIs(frames[0], frames[120])
+
+
+# what the headless path imports on top of cv2 and numpy.
+# Only raise the budget for imports it really needs. The
+# time includes compiling the sources without bytecode.
+HEADLESS_MODULE_BUDGET = 29
+HEADLESS_SECONDS_BUDGET = 0.03
+
+
+class TestImports(unittest.TestCase):
+
+    def test_package_import_is_lazy(self):
+        modules = import_time("bq.opencv", repeat=1)["modules"]
+        self.assertFalse("cv2" in modules)
+        self.assertFalse("numpy" in modules)
+
+
+    def test_headless_path(self):
+        modules = import_time("bq.wasserzaehler.base", repeat=1)["modules"]
+        for module in [
+                "bq.wasserzaehler.calibration",
+                "bq.wasserzaehler.batch",
+                "bq.wasserzaehler.motion",
+                "bq.wasserzaehler.anglelog",
+                "bq.wasserzaehler.sinks",
+                "bq.wasserzaehler.checkpoint",
+                "bq.wasserzaehler.instrumentation",
+                "bq.opencv.device",
+                "bq.opencv.rate",
+                "csv",
+                "multiprocessing",
+                "sqlite3",
+                "socket",
+        ]:
+            self.assertFalse(module in modules, module)
+
+
+    def test_headless_import_budget(self):
+        # cv2 and numpy can't be avoided, the budgets are
+        # for what bq.wasserzaehler.base adds on top
+        dependencies = import_time("cv2, numpy", repeat=1)
+        base = import_time("bq.wasserzaehler.base", preload="cv2, numpy")
+        added = set(base["modules"]) - set(dependencies["modules"])
+        self.assertTrue(len(added) <= HEADLESS_MODULE_BUDGET, sorted(added))
+        self.assertTrue(base["min"] < HEADLESS_SECONDS_BUDGET, base["min"])
+
+
+    def test_entry_points_are_lazy(self):
+        modules = import_time("bq.wasserzaehler", repeat=1)["modules"]
+        self.assertFalse("bq.wasserzaehler.base" in modules)
+        self.assertFalse("cv2" in modules)
+
+
+    def test_entry_points_survive_submodule_imports(self):
+        import bq.wasserzaehler
+        import bq.wasserzaehler.batch
+        import bq.wasserzaehler.calibration
+        self.assertTrue(callable(bq.wasserzaehler.batch_main))
+        self.assertTrue(callable(bq.wasserzaehler.calibration_main))
+
+
+class TestInstrumentation(unittest.TestCase):
+
+    def test_empty_instrumentation_is_false(self):
+        instrumentation = Instrumentation()
+        self.assertFalse(instrumentation)
+        instrumentation.add(StageObserver())
+        self.assertTrue(instrumentation)
+
+
+    def test_histogram_percentiles(self):
+        histogram = Histogram()
+        for _ in xrange(90):
+            histogram.add(0.000010)
+        for _ in xrange(10):
+            histogram.add(0.001)
+        self.assertEqual(100, histogram.n)
+        self.assertTrue(0.000010 <= histogram.percentile(50) < 0.000020)
+        self.assertEqual(0.001, histogram.percentile(99))
+
+
+    def test_wasserzaehler_reports_stages(self):
+        frame = rotating_hand_frame(1.0)
+        settings = os.path.join(tempfile.mkdtemp(), "settings.json")
+        try:
+            with open(settings, "w") as outf:
+                json.dump(dict(DEFAULT_SETTINGS, **HAND_SETTINGS), outf)
+            wz = Wasserzaehler(["--image", "-", "--settings", settings])
+        finally:
+            shutil.rmtree(os.path.dirname(settings))
+
+        add_default_observers(wz.instrumentation)
+        seen = []
+
+        class Recorder(StageObserver):
+
+            def stage(self, name, result, elapsed):
+                seen.append(name)
+
+        wz.instrumentation.add(Recorder())
+        wz.frame_callback(frame)
+        wz.frames_dropped(3)
+
+        self.assertEqual(
+            [
+                "color_adjusted_roi",
+                "color_range_filtered_roi",
+                "found_contours",
+                "enclosing_circle_and_centroid",
+            ],
+            seen,
+        )
+        snapshot = wz.instrumentation.snapshot()
+        self.assertEqual(1, snapshot["timings"]["frame"]["n"])
+        self.assertEqual(1, snapshot["contours"]["max"])
+        self.assertEqual({"dropped_frames": 3}, snapshot["events"])